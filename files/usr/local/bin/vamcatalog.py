@@ -0,0 +1,274 @@
+# ----------------------------------------------------------------------------
+# Catalog of the sessions of pi-vameter.
+#
+# The catalog is a SQLite-database in the data-directory with the summary
+# of every session, so the web-server does not need to read all summary-
+# files for every request. It is updated by vameter.py (if it exists) and
+# by the web-server, which watches the data-directory with inotify.
+#
+# Author: Bernhard Bablok, Lothar Hiller
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-vameter
+#
+# ----------------------------------------------------------------------------
+
+import os, time, json, sqlite3, struct, errno, ctypes, ctypes.util
+
+CATALOG_FILE = "catalog.sqlite"
+COLUMNS      = ["name","ts_start","ts_end","I_avg","I_max","U_avg","U_max",
+                "P_avg","P_max","P_tot"]
+
+# databases created from capture-files (<name>-cap.rrd) belong to their
+# session and are not listed
+CAPTURE_SUFFIX = "-cap"
+
+# inotify-events (see linux/inotify.h)
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM  = 0x040
+IN_MOVED_TO    = 0x080
+IN_CREATE      = 0x100
+IN_DELETE      = 0x200
+IN_EVENT_FMT   = "iIII"              # wd,mask,cookie,len (followed by name)
+IN_EVENT_LEN   = struct.calcsize(IN_EVENT_FMT)
+
+# --- path of the catalog   --------------------------------------------------
+
+def get_catalog_path(data_root):
+  """ return path of the catalog of a data-directory """
+  return os.path.join(data_root,CATALOG_FILE)
+
+# --- sessions of the catalog   ---------------------------------------------
+
+def is_session(name):
+  """ check if a database is a session (and not created from a capture) """
+  return not name.endswith(CAPTURE_SUFFIX)
+
+# --- update catalog from vameter.py   ---------------------------------------
+
+def update_session(sumfile,summary):
+  """ update the summary of a session if the directory has a catalog """
+
+  path = get_catalog_path(os.path.dirname(os.path.abspath(sumfile)))
+  name = os.path.splitext(os.path.basename(sumfile))[0]
+  if not os.path.exists(path) or not is_session(name):
+    return
+  catalog = Catalog(path)
+  catalog.update(name,summary,os.path.getmtime(sumfile))
+  catalog.close()
+
+# --- catalog   --------------------------------------------------------------
+
+class Catalog(object):
+  """ SQLite-database with the summaries of all sessions """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,path):
+    """ Constructor - creates the catalog if necessary """
+
+    self._db = sqlite3.connect(path,timeout=10,check_same_thread=False)
+    self._db.execute("PRAGMA journal_mode=WAL")
+    self._db.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                          name TEXT PRIMARY KEY, mtime REAL,
+                          ts_start REAL, ts_end REAL,
+                          I_avg REAL, I_max REAL, U_avg REAL, U_max REAL,
+                          P_avg REAL, P_max REAL, P_tot REAL,
+                          summary TEXT)""")
+    self._db.execute("""CREATE INDEX IF NOT EXISTS sessions_start
+                          ON sessions (ts_start)""")
+
+    # counter of changes, shared by all processes using the catalog
+    self._db.execute("""CREATE TABLE IF NOT EXISTS changes (
+                          id INTEGER PRIMARY KEY CHECK (id = 0),
+                          generation INTEGER, modified REAL)""")
+    self._db.execute("INSERT OR IGNORE INTO changes VALUES (0,0,?)",
+                     (time.time(),))
+    self._db.commit()
+
+  # --- update a session   ---------------------------------------------------
+
+  def update(self,name,summary,mtime,commit=True):
+    """ insert or replace a session (summary is None if it is missing) """
+
+    values = [(summary or {}).get(c) for c in COLUMNS[1:]]
+    self._db.execute("INSERT OR REPLACE INTO sessions VALUES (%s)" %
+                     ",".join(["?"]*12),
+                     [name,mtime] + values +
+                     [json.dumps(summary) if summary else None])
+    self._changed()
+    if commit:
+      self._db.commit()
+
+  # --- remove a session   ---------------------------------------------------
+
+  def remove(self,name,commit=True):
+    """ remove a session """
+
+    if self._db.execute("DELETE FROM sessions WHERE name = ?",
+                        (name,)).rowcount:
+      self._changed()
+    if commit:
+      self._db.commit()
+
+  # --- track changes   -----------------------------------------------------
+
+  def _changed(self):
+    """ count a change (committed together with the change) """
+
+    self._db.execute("""UPDATE changes SET generation = generation+1,
+                          modified = ?""",(time.time(),))
+
+  def get_changes(self):
+    """ return generation (number of changes) and time of the last change
+        of the catalog, e.g. for caching. Changes of other processes (e.g.
+        vameter.py) are included """
+
+    return self._db.execute(
+                  "SELECT generation,modified FROM changes").fetchone()
+
+  # --- refresh a session from the filesystem   ------------------------------
+
+  def refresh(self,data_root,name,mtime=None,commit=True):
+    """ read summary of a session again (or remove the session) """
+
+    base = os.path.join(data_root,name)
+    if not is_session(name) or not os.path.exists(base + ".rrd"):
+      self.remove(name,commit)
+      return
+    try:
+      sumfile = base + ".summary"
+      mtime   = mtime or os.path.getmtime(sumfile)
+      f = open(sumfile,"r")
+      summary = json.load(f)
+      f.close()
+    except (IOError,OSError,ValueError):
+      # no (valid) summary yet
+      summary = None
+      mtime   = 0
+
+    # unchanged summaries are not counted as a change
+    row = self._db.execute("SELECT mtime FROM sessions WHERE name = ?",
+                           (name,)).fetchone()
+    if row and row[0] == mtime:
+      return
+    self.update(name,summary,mtime,commit)
+
+  # --- synchronize with the filesystem   ------------------------------------
+
+  def sync(self,data_root):
+    """ synchronize the catalog with the data-directory (only changed
+        summaries are read) - returns the number of changes """
+
+    known = dict(self._db.execute("SELECT name,mtime FROM sessions"))
+    found = {}
+    files = set(os.listdir(data_root))
+    for f in files:
+      (name,ext) = os.path.splitext(f)
+      if ext == ".rrd" and is_session(name):
+        found[name] = 0
+        if name + ".summary" in files:
+          found[name] = os.path.getmtime(os.path.join(data_root,
+                                                      name + ".summary"))
+
+    changes = 0
+    for name,mtime in found.items():
+      if not name in known or known[name] != mtime:
+        self.refresh(data_root,name,mtime,commit=False)
+        changes += 1
+    for name in known:
+      if not name in found:
+        self.remove(name,commit=False)
+        changes += 1
+    self._db.commit()
+    return changes
+
+  # --- query sessions   -----------------------------------------------------
+
+  def query(self,search=None,order=None,desc=False,start=0,length=-1):
+    """ return number of all sessions, number of matching sessions and
+        the summaries of the selected sessions """
+
+    total = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+    where = ""
+    args  = []
+    if search:
+      where = "WHERE name LIKE ? ESCAPE '\\'"
+      args  = ["%%%s%%" % search.replace("\\","\\\\").replace(
+                                 "%","\\%").replace("_","\\_")]
+    count = self._db.execute("SELECT COUNT(*) FROM sessions " + where,
+                             args).fetchone()[0]
+
+    if not order in COLUMNS:
+      order = "ts_start"
+    sql  = ("SELECT name,summary FROM sessions %s ORDER BY %s %s,name " +
+            "LIMIT ? OFFSET ?") % (where,order,"DESC" if desc else "ASC")
+    rows = []
+    for name,summary in self._db.execute(sql,args + [length,start]):
+      item = json.loads(summary) if summary else {}
+      item['name'] = name
+      rows.append(item)
+    return (total,count,rows)
+
+  # --- close catalog   ------------------------------------------------------
+
+  def close(self):
+    """ close the database """
+    self._db.close()
+
+# --- watch a directory   ----------------------------------------------------
+
+class Watcher(object):
+  """ Watch a data-directory for changed sessions using inotify """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,path):
+    """ Constructor - raises OSError if inotify is not available """
+
+    libc     = ctypes.CDLL(ctypes.util.find_library("c"),use_errno=True)
+    self._fd = libc.inotify_init1(os.O_NONBLOCK)
+    if self._fd < 0:
+      raise OSError(ctypes.get_errno(),"inotify_init1 failed")
+    mask = IN_CLOSE_WRITE|IN_MOVED_FROM|IN_MOVED_TO|IN_CREATE|IN_DELETE
+    if libc.inotify_add_watch(self._fd,path,mask) < 0:
+      err = ctypes.get_errno()
+      os.close(self._fd)
+      raise OSError(err,"inotify_add_watch failed for %s" % path)
+
+  # --- file-descriptor (for select)   ---------------------------------------
+
+  def fileno(self):
+    """ return file-descriptor of the inotify-instance """
+    return self._fd
+
+  # --- read events   --------------------------------------------------------
+
+  def read(self):
+    """ return names of changed sessions. Summary-files are watched for all
+        events, databases only for creation, deletion and renames (updates
+        of the database are too frequent) """
+
+    try:
+      data = os.read(self._fd,65536)
+    except OSError as e:
+      if e.errno == errno.EAGAIN:
+        return set()
+      raise
+
+    names = set()
+    pos   = 0
+    while pos + IN_EVENT_LEN <= len(data):
+      _,mask,_,length = struct.unpack_from(IN_EVENT_FMT,data,pos)
+      fname = data[pos+IN_EVENT_LEN:pos+IN_EVENT_LEN+length].rstrip("\0")
+      pos  += IN_EVENT_LEN + length
+      (name,ext) = os.path.splitext(fname)
+      if ext == ".summary" or (ext == ".rrd" and mask & ~IN_CLOSE_WRITE):
+        names.add(name)
+    return names
+
+  # --- close watcher   ------------------------------------------------------
+
+  def close(self):
+    """ close the inotify-instance """
+    os.close(self._fd)
@@ -0,0 +1,292 @@
+# ----------------------------------------------------------------------------
+# Read the data of a session of pi-vameter.
+#
+# Data with full resolution is read from the session-store (if available),
+# otherwise from the round-robin-database. Rows are returned by generators
+# which read the data in chunks, so memory does not grow with the length
+# of a session.
+#
+# Author: Bernhard Bablok, Lothar Hiller
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-vameter
+#
+# ----------------------------------------------------------------------------
+
+import os
+import rrdtool
+import vamstore
+
+FETCH_ROWS    = 3600          # rows of the database read with a single fetch
+DOWNSAMPLE    = ["minmax","lttb"]
+TIMESTAMP_FMT = "%Y-%m-%d %H:%M:%S"
+
+# --- time-axis of the database   --------------------------------------------
+
+def get_rrd_step(interval):
+  """ return step of the database for the given interval """
+  return 1 if interval < 1 else int(interval)
+
+def to_rrd_time(t,ts_start,interval):
+  """ convert unix-time to the time-axis of the database
+
+  rrdtool only supports steps of whole seconds. For intervals below one
+  second, every interval is stored as one (virtual) second counted from
+  the start of the measurement (high-resolution mode).
+  """
+  if interval >= 1:
+    return int(round(t))
+  return ts_start + int(round((t-ts_start)/interval))
+
+def from_rrd_time(v,ts_start,interval):
+  """ convert time of the database to unix-time """
+  if interval >= 1:
+    return v
+  return ts_start + (v-ts_start)*interval
+
+# --- data-sources of a database   -------------------------------------------
+
+def get_db_ds(info):
+  """ return names of the data-sources of a database in database-order """
+
+  ds = sorted((v,k[3:-len("].index")]) for k,v in info.items()
+                      if k.startswith("ds[") and k.endswith("].index"))
+  return [name for _,name in ds]
+
+def get_db_rails(dbfile):
+  """ return names of the rails of a database ("" for the primary rail) """
+
+  return [name[2:] for name in get_db_ds(rrdtool.info(dbfile))
+                                                    if name.startswith("U")]
+
+# --- archives of a database   -----------------------------------------------
+
+def get_db_archives(info):
+  """ return (step,start) of all AVERAGE-archives of a database, finest
+      first. Step and start of the oldest row are in database-time """
+
+  archives = []
+  k = 0
+  while "rra[%d].cf" % k in info:
+    if info["rra[%d].cf" % k] == "AVERAGE":
+      step = info["step"]*info["rra[%d].pdp_per_row" % k]
+      last = info["last_update"] - info["last_update"] % step
+      archives.append((step,last-step*(info["rra[%d].rows" % k]-1)))
+    k += 1
+  return sorted(archives)
+
+def select_archive(archives,first,resolution):
+  """ return step and end of the finest archive with at least the given
+      resolution which still holds data at first. The end is the start
+      of a finer archive (or None) """
+
+  candidates = [a for a in archives if a[0] >= resolution] or archives[-1:]
+  for k,(step,start) in enumerate(candidates):
+    if start <= first or k == len(candidates)-1:
+      finer = [a[1] for a in candidates[:k] if a[1] > first]
+      return (step,min(finer) if finer else None)
+
+def get_db_resolution(info,interval,width):
+  """ return the resolution (seconds) of the coarsest archive which has at
+      least one row for every width seconds """
+
+  scale = interval if interval < 1 else 1
+  steps = [step*scale for step,_ in get_db_archives(info)]
+  return max([s for s in steps if s <= width] or steps[:1])
+
+# --- read a session   -------------------------------------------------------
+
+def fetch_session(dbfile,summary,start=None,end=None,resolution=0,
+                  daemon_args=[]):
+  """ return titles and a generator for the rows (ts,values) of a session.
+      The session-store is used unless the resolution is coarser than the
+      interval of the session """
+
+  interval = summary.get("interval",1)
+  path     = vamstore.get_store_path(dbfile)
+  if os.path.isdir(path) and resolution <= interval:
+    store = vamstore.StoreReader(path)
+    return store.columns, fetch_store(store,start,end)
+
+  info = rrdtool.info(dbfile)
+  return get_db_ds(info), fetch_rrd(dbfile,summary,get_db_archives(info),
+                                    start,end,resolution,daemon_args)
+
+def fetch_store(store,start,end):
+  """ return rows of the session-store """
+
+  try:
+    for row in store.iter_rows(start,end):
+      yield row
+  finally:
+    store.close()
+
+def fetch_rrd(dbfile,summary,archives,start,end,resolution,daemon_args):
+  """ return rows of the database, fetched in chunks of FETCH_ROWS from
+      the finest archive available (NaNs are deleted) """
+
+  ts_start = summary["ts_start"]
+  ts_end   = summary["ts_end"]
+  interval = summary.get("interval",1)
+  first    = to_rrd_time(max(start or ts_start,ts_start),ts_start,interval)
+  last     = to_rrd_time(min(end or ts_end,ts_end),ts_start,interval)
+  res      = max(1,int(round(resolution/min(interval,1))))   # db-time
+  done     = None                      # time of the last row returned
+
+  while first <= last:
+    # select archive, read at most up to the start of a finer archive
+    (step,finer) = select_archive(archives,first,res)
+    stop = min(last,first - first % step + (FETCH_ROWS-1)*step)
+    if finer:
+      stop = min(stop,finer-1)
+    time_span, _, values = rrdtool.fetch(dbfile,"AVERAGE",
+                                         "--start", str(first),
+                                         "--end", str(stop),
+                                         "--resolution", str(step),
+                                         *daemon_args)
+
+    # extract valid values (the first row may start before first)
+    t0, t1, t_res = time_span
+    for ts,row in zip(range(t0,t1,t_res),values):
+      if ts+t_res <= first or ts > last or (done is not None and ts <= done):
+        continue
+      done = ts
+      if any(x is not None for x in row):
+        yield from_rrd_time(ts,ts_start,interval), row
+    first = max(t1,stop+1)
+
+# --- downsample a session   -------------------------------------------------
+
+def downsample_session(dbfile,summary,start=None,end=None,points=800,
+                       mode="minmax",columns=None,daemon_args=[]):
+  """ return a session or time-range reduced to about the given number
+      of points per column. Data is read from the coarsest archive which
+      still has a row for every point (see downsample) """
+
+  start = max(start or summary["ts_start"],summary["ts_start"])
+  end   = max(min(end or summary["ts_end"],summary["ts_end"]),start)
+  width = max(float(end-start)/points,1e-6)
+
+  info       = rrdtool.info(dbfile)
+  resolution = get_db_resolution(info,summary.get("interval",1),width)
+  titles,rows = fetch_session(dbfile,summary,start,end,resolution,
+                              daemon_args)
+  columns = [c for c in columns or titles if c in titles]
+  index   = [titles.index(c) for c in columns]
+  series  = downsample(((ts,[row[k] for k in index]) for ts,row in rows),
+                       len(columns),start,width,mode)
+  return {"start": start, "end": end, "resolution": resolution,
+          "mode": mode, "series": dict(zip(columns,series))}
+
+def downsample(rows,n,start,width,mode="minmax"):
+  """ downsample rows (ts,values) with n columns into buckets of width
+      seconds. Mode minmax returns average, minimum and maximum of every
+      bucket, mode lttb selects one point of every bucket with the
+      largest-triangle-three-buckets algorithm. Only two buckets are kept
+      in memory """
+
+  samplers = [MinMaxSampler() if mode == "minmax" else LTTBSampler()
+                                                          for _ in range(n)]
+  for ts,row in rows:
+    bucket = int((ts-start)/width)
+    for sampler,v in zip(samplers,row):
+      if v is not None and v == v:                        # skip NaN
+        sampler.add(bucket,ts,v)
+  return [sampler.result() for sampler in samplers]
+
+class MinMaxSampler(object):
+  """ average, minimum and maximum of every bucket """
+
+  def __init__(self):
+    """ Constructor """
+    self._bucket = None
+    self._result = {"ts": [], "values": [], "min": [], "max": []}
+
+  def add(self,bucket,ts,v):
+    """ add a value """
+    if bucket != self._bucket:
+      self._flush()
+      self._bucket = bucket
+      self._stats  = [0,0.0,0.0,v,v]            # count,sum(ts),sum(v),min,max
+    stats     = self._stats
+    stats[0] += 1
+    stats[1] += ts
+    stats[2] += v
+    stats[3]  = min(stats[3],v)
+    stats[4]  = max(stats[4],v)
+
+  def _flush(self):
+    """ add the statistics of the current bucket to the result """
+    if self._bucket is None:
+      return
+    count,ts_sum,v_sum,v_min,v_max = self._stats
+    self._result["ts"].append(round(ts_sum/count,3))
+    self._result["values"].append(round(v_sum/count,4))
+    self._result["min"].append(round(v_min,4))
+    self._result["max"].append(round(v_max,4))
+
+  def result(self):
+    """ return the result """
+    self._flush()
+    self._bucket = None
+    return self._result
+
+class LTTBSampler(object):
+  """ largest-triangle-three-buckets: one point per bucket. The first and
+      the last bucket are represented by the first and the last point, every
+      other bucket by the point which spans the largest triangle with the
+      previously selected point and the average of the next bucket """
+
+  def __init__(self):
+    """ Constructor """
+    self._first    = None                    # bucket of the first point
+    self._bucket   = None
+    self._cur      = []                      # points of the current bucket
+    self._next     = []                      # points of the next bucket
+    self._selected = None                    # previously selected point
+    self._result   = {"ts": [], "values": []}
+
+  def add(self,bucket,ts,v):
+    """ add a value """
+    if self._selected is None:
+      self._first = bucket
+      self._select((ts,v))
+      return
+    if bucket == self._first:
+      return
+    if bucket != self._bucket:
+      if self._cur and self._next:
+        self._select_from(self._cur,self._average(self._next))
+      if self._next:
+        self._cur = self._next
+      self._next   = []
+      self._bucket = bucket
+    self._next.append((ts,v))
+
+  def _average(self,points):
+    """ return the average point of a bucket """
+    return (sum(p[0] for p in points)/len(points),
+            sum(p[1] for p in points)/len(points))
+
+  def _select_from(self,points,c):
+    """ select the point with the largest triangle between the selected
+        point and c """
+    a  = self._selected
+    dx = c[0]-a[0]
+    dy = c[1]-a[1]
+    self._select(max(points,key=lambda b: abs(dx*(b[1]-a[1])-dy*(b[0]-a[0]))))
+
+  def _select(self,point):
+    """ add a point to the result """
+    self._selected = point
+    self._result["ts"].append(round(point[0],3))
+    self._result["values"].append(round(point[1],4))
+
+  def result(self):
+    """ return the result (the last point is always selected) """
+    if self._cur and self._next:
+      self._select_from(self._cur,self._average(self._next))
+    if self._next:
+      self._select(self._next[-1])
+    self._cur = self._next = []
+    return self._result
@@ -12,23 +12,124 @@
 
 DEFAULT_PORT = 8026
 DATA_ROOT    = "/var/lib/vameter/data"
+CONFIG_FILE  = "/etc/vameter.conf"
+
+EXPORT_MAGIC = "VAMEXP01"     # binary export (see export_bin)
+EXPORT_ROWS  = 1024           # rows per block of the binary export
+EXPORT_CHUNK = 65536          # minimal size of chunks sent to the client
+CATALOG_POLL = 30             # seconds between full syncs of the catalog
+GRAPH_CACHE  = ".graphs"      # cache of rendered graphs (in the data-root)
+GRAPH_SIZE   = 32*1024*1024   # max. size of the cache
+SSE_BUFFER   = 50             # events buffered per client (slow clients
+                              # are dropped and resume with Last-Event-ID)
+SSE_HISTORY  = 600            # events kept for clients resuming a stream
+SSE_PING     = 15            # seconds between keepalive-comments
+STATIC_AGE   = 7*86400       # browsers cache css, js and images for a week
+STATIC_GZIP  = [".css",".js",".html",".svg"]    # precompressed at start-up
+RESULTS_CACHE = 16            # serialized responses of /results
+WAVE_MAGIC   = "VAMW"         # binary frames of live waveforms (see /wave)
+WAVE_HDR_FMT = "<4sBBHIdf"    # magic,bits,channels,decimation,scans,ts,rate
+WAVE_CLIENTS = 8              # max. number of waveform-clients
+WAVE_BANDWIDTH = 256*1024     # bytes/s of waveforms for all clients together
+WAVE_BUFFER  = 4              # frames buffered per client (slow clients
+                              # skip frames)
+WAVE_MAX_DEC = 1024           # max. decimation requested by a client
+JOB_DIR      = ".jobs"        # results of background jobs (in the data-root)
+JOB_WORKERS  = 2              # jobs running at the same time
+JOB_KEEP     = 20             # finished jobs kept for status-requests
 
 # --- System-Imports   ------------------------------------------------------
 
-import sys, os, json, subprocess
+import sys, os, json, subprocess, ConfigParser, shutil, struct, zlib, urllib
+import collections, hashlib, mimetypes, array, math, time
 from argparse import ArgumentParser
 
 import rrdtool
+import vamstore, vamdata, vamcatalog, vamgraph
 
-import bottle
-from bottle import route
-from gevent import monkey; monkey.patch_all()
+import vameter
 
 # --- helper class for options   --------------------------------------------
 
 class Options(object):
   pass
 
+# --- commandline-parser   --------------------------------------------------
+
+def get_parser():
+  parser = ArgumentParser(add_help=False,
+    description='Simple webserver for pi-vameter')
+
+  parser.add_argument('-H', '--host', nargs=1,
+    metavar='host', default=['0.0.0.0'],
+    dest='host',
+    help='host-mask')
+  parser.add_argument('-P', '--port', nargs=1,
+    metavar='port', default=[DEFAULT_PORT],
+    dest='port',
+    help='port the server is listening on (default: %d)' % DEFAULT_PORT)
+
+  parser.add_argument('-D', '--dir', nargs=1,
+    metavar='data-root', default=[DATA_ROOT],
+    dest='data_root',
+    help='directory with RRDs and graphics')
+
+  parser.add_argument('-d', '--debug',
+    dest='debug', default=False, action='store_true',
+    help='start in debug-mode')
+
+  parser.add_argument('-h', '--hilfe', action='help',
+    help='display this help')
+  return parser
+
+# --- collector-engine   ----------------------------------------------------
+
+# The collector-engine needs real threads, so its process is started before
+# gevent patches the standard-library. Patching must precede the import of
+# bottle (bottle creates its thread-locals at import), so the engine cannot
+# be started in the main program. The command-line is parsed first: help and
+# invalid arguments exit without an engine, and with the reloader (debug-mode)
+# only the child-process serving the requests starts one.
+
+engine = None
+if __name__ == '__main__':
+  options = get_parser().parse_args(namespace=Options)
+  if not options.debug or 'BOTTLE_CHILD' in os.environ:
+    engine = vameter.EngineProcess()
+
+import bottle
+from bottle import route
+import gevent, gevent.select, gevent.event, gevent.socket, gevent.lock
+import gevent.queue
+from gevent import monkey; monkey.patch_all()
+
+# websockets are optional (live waveforms)
+try:
+  from geventwebsocket.handler import WebSocketHandler
+  from geventwebsocket import WebSocketError
+  have_websocket = True
+except ImportError:
+  have_websocket = False
+
+# --- options for rrdcached   -----------------------------------------------
+
+def get_daemon_args():
+  """ return arguments to route rrdtool-calls through rrdcached """
+
+  global options
+  return ["--daemon", options.rrd_daemon] if options.rrd_daemon else []
+
+def flush_cached(rrd):
+  """ write pending updates of rrdcached to the database """
+
+  global options
+  if options.rrd_daemon:
+    try:
+      rrdtool.flushcached(rrd,*get_daemon_args())
+    except:
+      if options.debug:
+        print("DEBUG: flushing %s failed" % rrd)
+
 # --- get values   ----------------------------------------------------------
 
 def get_values(rrd):
@@ -42,33 +143,55 @@ def get_values(rrd):
 
 # --- get result list   -----------------------------------------------------
 
+def get_item(item):
+  """ add links of the database and images to a result """
+
+  name = item['name']
+  item['rrd'] = "/data/%s.rrd" % name
+  for m in vamgraph.GRAPH_TYPES:
+    item["%s_img" % m] = "/graph?name=%s&type=%s" % (urllib.quote(name),m)
+  return item
+
 def get_results():
-  """ query results from filesystem """
+  """ query all results from the catalog """
 
   global options
-  data_root = options.data_root[0]
+  (_,_,rows) = options.catalog.query(order="ts_start",desc=True)
+  return [get_item(item) for item in rows]
+
+# --- keep catalog up to date   ---------------------------------------------
 
-  # sanity check
-  if not os.path.isdir(data_root):
-    return []
+def watch_catalog():
+  """ update the catalog with changed sessions (inotify), with a full
+      sync every CATALOG_POLL seconds (and if inotify is not available) """
+
+  global options
+  data_root = options.data_root[0]
+  try:
+    watcher = vamcatalog.Watcher(data_root)
+  except OSError as e:
+    print("WARN: inotify not available (%s), polling data-directory" % e)
+    watcher = None
 
-  # build list of rrd-databases
-  results = []
-  for f in os.listdir(data_root):
-    (name,ext) = os.path.splitext(f)
-    if not ext == ".rrd":
-      continue
+  while True:
     try:
-      item = get_values(os.path.join(data_root,f))
-      item['name'] = name
-      item['rrd'] = "/data/%s" % f
-      for m in ['I','U','P']:
-        item["%s_img" % m] = "/data/%s-%s.png" % (name,m)
-      results.append(item)
+      if watcher:
+        (ready,_,_) = gevent.select.select([watcher],[],[],CATALOG_POLL)
+        if ready:
+          for name in watcher.read():
+            if options.debug:
+              print("DEBUG: updating catalog for %s" % name)
+            options.catalog.refresh(data_root,name)
+          continue
+      else:
+        gevent.sleep(CATALOG_POLL)
+      changes = options.catalog.sync(data_root)
+      if options.debug and changes:
+        print("DEBUG: catalog-sync: %d changes" % changes)
     except:
-      # get_values fails if no summary-file is present - so ignore rrd
-      pass
-  return results
+      if options.debug:
+        print("DEBUG: updating catalog failed")
+      gevent.sleep(CATALOG_POLL)
 
 # --- query webroot   -------------------------------------------------------
 
@@ -78,19 +201,90 @@ def get_webroot(pgm_dir):
 def get_webpath(path):
   return os.path.join(WEB_ROOT,path)
 
+# --- conditional requests   ------------------------------------------------
+
+def not_modified(etag,modified):
+  """ set ETag and Last-Modified of the response - returns True if the
+      copy of the client is current (If-None-Match, If-Modified-Since) """
+
+  bottle.response.set_header('ETag',etag)
+  bottle.response.set_header('Last-Modified',bottle.http_date(modified))
+  headers = bottle.request.headers
+  if headers.get('If-None-Match') is not None:
+    tags = [t.strip() for t in headers.get('If-None-Match').split(",")]
+    return etag in tags or "*" in tags
+  since = bottle.parse_date(headers.get('If-Modified-Since','').split(";")[0])
+  return since is not None and since >= int(modified)
+
+# --- precompressed static files   ------------------------------------------
+
+def gzip_data(data):
+  """ compress data with gzip """
+
+  z = zlib.compressobj(9,zlib.DEFLATED,16+zlib.MAX_WBITS)
+  return z.compress(data) + z.flush()
+
+def compress_static(web_root):
+  """ compress static files once - returns a dict with path and
+      (data,mtime,etag,mimetype) of all files which get smaller """
+
+  static = {}
+  for path in ['css','js','images']:
+    for root,_,files in os.walk(os.path.join(web_root,path)):
+      for f in files:
+        if not os.path.splitext(f)[1] in STATIC_GZIP:
+          continue
+        fname = os.path.join(root,f)
+        with open(fname,"rb") as fp:
+          data = fp.read()
+        gzdata   = gzip_data(data)
+        mtime    = os.path.getmtime(fname)
+        mimetype = mimetypes.guess_type(fname)[0] or 'text/plain'
+        if mimetype.startswith('text/') or mimetype.endswith('javascript'):
+          mimetype += '; charset=UTF-8'
+        if len(gzdata) < len(data):
+          static[fname] = (gzdata,mtime,
+                           '"%x-%x-gz"' % (int(mtime),len(data)),mimetype)
+  return static
+
 # --- static routes   -------------------------------------------------------
 
+def serve_static(filepath,root):
+  """ return a static file (precompressed if possible), browsers may
+      cache it for STATIC_AGE seconds """
+
+  global options
+  cache = 'public, max-age=%d' % STATIC_AGE
+  entry = options.static.get(os.path.abspath(os.path.join(root,filepath)))
+  if entry and 'gzip' in bottle.request.headers.get('Accept-Encoding',''):
+    (data,mtime,etag,mimetype) = entry
+    bottle.response.set_header('Cache-Control',cache)
+    bottle.response.set_header('Vary','Accept-Encoding')
+    if not_modified(etag,mtime):
+      bottle.response.status = 304                 # not modified
+      return ""
+    bottle.response.content_type = mimetype
+    bottle.response.set_header('Content-Encoding','gzip')
+    return data
+
+  response = bottle.static_file(filepath,root=root)
+  if response.status_code in [200,304]:
+    response.set_header('Cache-Control',cache)
+    if entry:
+      response.set_header('Vary','Accept-Encoding')
+  return response
+
 @route('/css/<filepath:path>')
 def css_pages(filepath):
-    return bottle.static_file(filepath, root=get_webpath('css'))
-  
+  return serve_static(filepath,get_webpath('css'))
+
 @route('/images/<filepath:path>')
 def images(filepath):
-    return bottle.static_file(filepath, root=get_webpath('images'))
+  return serve_static(filepath,get_webpath('images'))
 
 @route('/js/<filepath:path>')
 def js_pages(filepath):
-    return bottle.static_file(filepath, root=get_webpath('js'))
+  return serve_static(filepath,get_webpath('js'))
 
 @route('/data/<filepath:path>')
 def data_pages(filepath):
@@ -106,31 +300,82 @@ def main_page():
 
 # --- results   -------------------------------------------------------------
 
-@route('/results',method='POST')
+@route('/results',method=['GET','POST'])
 def results():
-  """ lookup results in the filesystem """
+  """ lookup results in the catalog. With the parameters of DataTables
+      (server-side processing) only the requested page is returned.
+      Responses are cached until the catalog changes (see ETag) """
 
   global options
-
-  rows = get_results()
-  if options.debug:
-    print("DEBUG: rows: %r" % rows)
-    print("DEBUG: number of results: %d" % len(rows))
   bottle.response.content_type = 'application/json'
-  return json.dumps(rows)
+  forms = bottle.request.params
+  draw  = forms.get('draw')
+  try:
+    if draw is not None:
+      draw   = int(draw)
+      start  = int(forms.get('start',0))
+      length = int(forms.get('length',-1))
+      column = forms.get('order[0][column]')
+      order  = forms.get('columns[%s][data]' % column) if column else None
+      desc   = forms.get('order[0][dir]') == 'desc'
+  except ValueError:
+    bottle.response.status       = 400                 # bad request
+    return '{"msg": "invalid argument"}'
+
+  # the response only depends on the parameters and the generation of the
+  # catalog (also changed by vameter.py). The draw-counter of DataTables
+  # changes with every request, so it is not part of the key (it is only
+  # echoed in the body) and the UI always sends draw=0, which keeps the
+  # url of a page stable for the browser-cache (content_data.tpl restores
+  # the counter). '_' is the cache-buster of jQuery (cache: false)
+  catalog = options.catalog
+  (generation,modified) = catalog.get_changes()
+  key     = repr(sorted((k,v) for k,v in forms.iteritems()
+                                              if not k in ['draw','_']))
+  etag    = '"%d-%s"' % (generation,hashlib.sha1(key).hexdigest()[:16])
+  bottle.response.set_header('Cache-Control','no-cache')
+  if not_modified(etag,modified):
+    bottle.response.status = 304                 # not modified
+    return ""
+
+  if options.results_generation != generation:
+    options.results_generation = generation
+    options.results = {}
+  cached = options.results.get(key)
+
+  if draw is None:
+    if cached is None:
+      cached = json.dumps(get_results())
+    body = cached
+  else:
+    if cached is None:
+      (total,count,rows) = catalog.query(forms.get('search[value]'),
+                                         order,desc,start,length)
+      if options.debug:
+        print("DEBUG: results %d-%d of %d (total: %d)" %
+              (start,start+len(rows),count,total))
+      cached = (total,count,json.dumps([get_item(item) for item in rows]))
+    body = ('{"draw": %d, "recordsTotal": %d, "recordsFiltered": %d, '
+            '"data": %s}') % ((draw,) + cached)
+
+  if len(options.results) >= RESULTS_CACHE:
+    options.results = {}
+  options.results[key] = cached
+  return body
 
-# --- download database   ---------------------------------------------------
+# --- download database (xml-dump)   ----------------------------------------
 
 @route('/download',method='GET')
-def delete():
-  """ download data """
+def download():
+  """ download the database as xml (rrdtool dump, e.g. for rrdtool restore),
+      the data of a session is downloaded with /export """
 
   global options
   # get name-parameter
   name = bottle.request.query.get('name')
 
   if options.debug:
-    print("DEBUG: processing delete (name: %s)" % name)
+    print("DEBUG: processing download (name: %s)" % name)
 
   if name is None:
     msg = '"missing argument"'
@@ -158,10 +403,647 @@ def delete():
     bottle.response.status       = 404                # not found
     return '{"msg": ' + msg +'}'
 
-  # convert to xml and download result
+  # convert to xml and stream result (compressed if supported)
   bottle.response.content_type = 'application/xml'
   bottle.response.set_header('Content-Disposition','attachment; filename=%s.xml' % name)
-  return subprocess.check_output(['rrdtool','dump',f])
+  bottle.response.set_header('Vary','Accept-Encoding')
+  proc = subprocess.Popen(['rrdtool','dump']+get_daemon_args()+[f],
+                          stdout=subprocess.PIPE)
+  chunks = pipe_chunks(proc)
+  if 'gzip' in bottle.request.headers.get('Accept-Encoding',''):
+    bottle.response.set_header('Content-Encoding','gzip')
+    chunks = gzip_chunks(chunks)
+  return chunks
+
+# --- read slice of a session   ---------------------------------------------
+
+@route('/slice',method='GET')
+def read_slice():
+  """ return a time-range of a session with full resolution (session-store) """
+
+  global options
+  name    = bottle.request.query.get('name')
+  start   = bottle.request.query.get('start')
+  end     = bottle.request.query.get('end')
+  columns = bottle.request.query.get('columns')
+
+  if options.debug:
+    print("DEBUG: processing slice (name: %s, %s-%s)" % (name,start,end))
+
+  bottle.response.content_type = 'application/json'
+  if name is None or len(name.split(os.sep)) > 1:
+    bottle.response.status       = 400                 # bad request
+    return '{"msg": "invalid argument"}'
+
+  path = vamstore.get_store_path(os.path.join(options.data_root[0],
+                                              "%s.rrd" % name))
+  if not os.path.isdir(path):
+    bottle.response.status       = 404                 # not found
+    return '{"msg": "session-store does not exist"}'
+
+  try:
+    store = vamstore.StoreReader(path)
+    if columns:
+      columns = [c for c in columns.split(",") if c in store.columns]
+    times,values = store.read(float(start) if start else None,
+                              float(end) if end else None,columns)
+    result = {'ts': [round(t,3) for t in times]}
+    for c,v in values.items():
+      result[c] = [round(x,4) for x in v]
+    store.close()
+  except ValueError:
+    bottle.response.status       = 400                 # bad request
+    return '{"msg": "invalid argument"}'
+  return json.dumps(result)
+
+# --- downsampled data for charts   -----------------------------------------
+
+@route('/chart',method='GET')
+def chart():
+  """ return a session or time-range downsampled to about the given number
+      of points (the width of the chart in pixels) """
+
+  global options
+  query   = bottle.request.query
+  name    = query.get('name')
+  mode    = query.get('mode','minmax')
+  columns = query.get('columns')
+
+  if options.debug:
+    print("DEBUG: processing chart (name: %s, mode: %s)" % (name,mode))
+
+  bottle.response.content_type = 'application/json'
+  if (name is None or len(name.split(os.sep)) > 1 or
+      not mode in vamdata.DOWNSAMPLE):
+    bottle.response.status       = 400                 # bad request
+    return '{"msg": "invalid argument"}'
+  try:
+    start  = float(query.get('start')) if query.get('start') else None
+    end    = float(query.get('end')) if query.get('end') else None
+    points = min(max(int(query.get('points',800)),10),4000)
+  except ValueError:
+    bottle.response.status       = 400                 # bad request
+    return '{"msg": "invalid argument"}'
+
+  f = os.path.join(options.data_root[0],"%s.rrd" % name)
+  try:
+    summary = get_values(f)
+  except:
+    bottle.response.status       = 404                 # not found
+    return '{"msg": "session does not exist"}'
+
+  # reading and downsampling runs in a thread to keep the server responsive
+  flush_cached(f)
+  result = gevent.get_hub().threadpool.apply(vamdata.downsample_session,
+                      (f,summary,start,end,points,mode,
+                       columns.split(",") if columns else None,
+                       get_daemon_args()))
+  result['name'] = name
+  return json.dumps(result,separators=(',',':'))
+
+# --- render graphs on demand   ---------------------------------------------
+
+@route('/graph',method='GET')
+def graph():
+  """ return a graph of a session (rendered on the first request) """
+
+  global options
+  query = bottle.request.query
+  name  = query.get('name')
+  gtype = query.get('type','C')
+
+  if options.debug:
+    print("DEBUG: processing graph (name: %s, type: %s)" % (name,gtype))
+
+  bottle.response.content_type = 'application/json'
+  if (name is None or len(name.split(os.sep)) > 1 or len(gtype) != 1 or
+      not gtype in vamgraph.GRAPH_TYPES):
+    bottle.response.status       = 400                 # bad request
+    return '{"msg": "invalid argument"}'
+  try:
+    start  = float(query.get('start')) if query.get('start') else None
+    end    = float(query.get('end')) if query.get('end') else None
+    width  = min(max(int(query.get('width',800)),100),2000)
+    height = min(max(int(query.get('height',400)),100),1200)
+  except ValueError:
+    bottle.response.status       = 400                 # bad request
+    return '{"msg": "invalid argument"}'
+
+  f = os.path.join(options.data_root[0],"%s.rrd" % name)
+  try:
+    summary = get_values(f)
+  except:
+    bottle.response.status       = 404                 # not found
+    return '{"msg": "session does not exist"}'
+
+  flush_cached(f)
+  try:
+    path = get_graph(name,f,summary,gtype,start,end,width,height)
+  except Exception as e:
+    bottle.response.status       = 500               # internal error
+    return json.dumps({"msg": "rendering failed: %s" % e})
+  return bottle.static_file(os.path.basename(path),
+                            root=options.graph_cache.path,
+                            mimetype='image/png')
+
+def get_graph(name,f,summary,gtype,start=None,end=None,width=800,height=400):
+  """ return path of a graph, graphs are cached until the database changes
+      (rendering runs in a thread, so the session may be deleted meanwhile) """
+
+  global options
+  cache = options.graph_cache
+  key   = cache.get_key(name,gtype,start,end,width,height,
+                        os.path.getmtime(f),summary.get('ts_end'))
+  path  = cache.get(key)
+  if not path:
+    if options.debug:
+      print("DEBUG: rendering %s" % key)
+    args = vamgraph.get_graph_args(f,summary,gtype,start,end,
+                                   width,height) + get_daemon_args()
+    path = cache.render(key,args,gevent.get_hub().threadpool.apply)
+    if not os.path.exists(f):
+      cache.purge(name)                        # deleted or renamed
+      raise IOError("session %s does not exist" % name)
+  return path
+
+# --- export formats   ------------------------------------------------------
+
+def export_csv(titles,rows):
+  """ rows as csv with a header-line """
+
+  yield "ts,%s\n" % ",".join(titles)
+  for ts,values in rows:
+    yield "%.3f,%s\n" % (ts,",".join("" if v is None else "%.4f" % v
+                                                           for v in values))
+
+def export_ndjson(titles,rows):
+  """ one json-object per row """
+
+  for ts,values in rows:
+    row = {'ts': round(ts,3)}
+    for c,v in zip(titles,values):
+      row[c] = None if v is None else round(v,4)
+    yield json.dumps(row,sort_keys=True) + "\n"
+
+def export_bin(titles,rows):
+  """ header (magic, number of columns, names of the columns with a
+      length-byte) followed by blocks with at most EXPORT_ROWS rows: number
+      of rows (uint32), timestamps (float64) and one array per column
+      (float32, NaN for missing values). All values are little-endian """
+
+  yield (struct.pack("<8sI",EXPORT_MAGIC,len(titles)) +
+         "".join(struct.pack("B",len(str(c))) + str(c) for c in titles))
+  block = []
+  for row in rows:
+    block.append(row)
+    if len(block) == EXPORT_ROWS:
+      yield export_block(titles,block)
+      block = []
+  if block:
+    yield export_block(titles,block)
+
+def export_block(titles,block):
+  """ return a block of the binary export """
+
+  n    = len(block)
+  data = [struct.pack("<I%dd" % n,n,*[ts for ts,_ in block])]
+  for k in range(len(titles)):
+    data.append(struct.pack("<%df" % n,*[float('nan') if v[k] is None
+                                                else v[k] for _,v in block]))
+  return "".join(data)
+
+EXPORT_FORMATS = {
+  'csv':    ('text/csv',export_csv),
+  'ndjson': ('application/x-ndjson',export_ndjson),
+  'bin':    ('application/octet-stream',export_bin)
+  }
+
+# --- chunks and compression of streams   -----------------------------------
+
+def join_chunks(parts):
+  """ join small parts to chunks of at least EXPORT_CHUNK bytes """
+
+  chunk = []
+  size  = 0
+  for part in parts:
+    chunk.append(part)
+    size += len(part)
+    if size >= EXPORT_CHUNK:
+      yield "".join(chunk)
+      chunk = []
+      size  = 0
+  if chunk:
+    yield "".join(chunk)
+
+def pipe_chunks(proc):
+  """ read the output of a process in chunks of EXPORT_CHUNK bytes """
+
+  try:
+    while True:
+      chunk = proc.stdout.read(EXPORT_CHUNK)
+      if not chunk:
+        break
+      yield chunk
+  finally:
+    proc.stdout.close()
+    proc.wait()
+
+def pool_chunks(chunks):
+  """ produce the chunks of a stream in the threadpool (reading a session
+      blocks) """
+
+  pool = gevent.get_hub().threadpool
+  try:
+    while True:
+      chunk = pool.apply(next,(chunks,None))
+      if chunk is None:
+        break
+      yield chunk
+  finally:
+    chunks.close()
+
+def gzip_chunks(chunks):
+  """ compress a stream of chunks with gzip """
+
+  z = zlib.compressobj(6,zlib.DEFLATED,16+zlib.MAX_WBITS)
+  for chunk in chunks:
+    data = z.compress(chunk)
+    if data:
+      yield data
+  yield z.flush()
+
+# --- export a session   ----------------------------------------------------
+
+@route('/export',method='GET')
+def export():
+  """ stream a session as csv, ndjson or binary (optionally compressed) """
+
+  global options
+  name       = bottle.request.query.get('name')
+  fmt        = bottle.request.query.get('format','csv')
+  start      = bottle.request.query.get('start')
+  end        = bottle.request.query.get('end')
+  resolution = bottle.request.query.get('resolution')
+
+  if options.debug:
+    print("DEBUG: processing export (name: %s, format: %s)" % (name,fmt))
+
+  bottle.response.content_type = 'application/json'
+  if name is None or len(name.split(os.sep)) > 1 or not fmt in EXPORT_FORMATS:
+    bottle.response.status       = 400                 # bad request
+    return '{"msg": "invalid argument"}'
+
+  f = os.path.join(options.data_root[0],"%s.rrd" % name)
+  try:
+    summary = get_values(f)
+  except:
+    bottle.response.status       = 404                 # not found
+    return '{"msg": "session does not exist"}'
+
+  try:
+    flush_cached(f)
+    titles,rows = gevent.get_hub().threadpool.apply(vamdata.fetch_session,
+                                  (f,summary,float(start) if start else None,
+                                   float(end) if end else None,
+                                   float(resolution or 0),get_daemon_args()))
+  except ValueError:
+    bottle.response.status       = 400                 # bad request
+    return '{"msg": "invalid argument"}'
+
+  # stream data (chunked), compressed if the client supports it. The
+  # chunks are produced in the threadpool, since reading blocks
+  (content_type,writer) = EXPORT_FORMATS[fmt]
+  bottle.response.content_type = content_type
+  bottle.response.set_header('Content-Disposition',
+                             'attachment; filename=%s.%s' % (name,fmt))
+  bottle.response.set_header('Vary','Accept-Encoding')
+  chunks = join_chunks(writer(titles,rows))
+  if 'gzip' in bottle.request.headers.get('Accept-Encoding',''):
+    bottle.response.set_header('Content-Encoding','gzip')
+    chunks = gzip_chunks(chunks)
+  return pool_chunks(chunks)
+
+# --- background jobs   -----------------------------------------------------
+
+class JobCancelled(Exception):
+  """ raised by Job.check if the job was cancelled """
+  pass
+
+class Job(object):
+  """ Background job of a session: func(job,name,*args) runs in a worker
+      of the job-queue, reports its progress with job.check() and returns
+      the path of a result-file (or None) """
+
+  def __init__(self,job_id,kind,name,func,args):
+    """ Constructor """
+
+    self.id        = job_id
+    self.kind      = kind
+    self.name      = name                # name of the session
+    self.args      = args
+    self.state     = "queued"            # running, done, failed, cancelled
+    self.progress  = 0.0
+    self.msg       = None
+    self.result    = None
+    self.created   = time.time()
+    self.started   = None
+    self.finished  = None
+    self.cancelled = False
+    self._func     = func
+
+  @property
+  def active(self):
+    """ True if the job is queued or running """
+    return self.state in ["queued","running"]
+
+  def check(self,progress=None):
+    """ update the progress (0-1) - raises JobCancelled if the job was
+        cancelled. Jobs may call this method from a thread """
+
+    if progress is not None:
+      self.progress = min(max(progress,0.0),1.0)
+    if self.cancelled:
+      raise JobCancelled()
+
+  def run(self):
+    """ execute the job """
+
+    self.state   = "running"
+    self.started = time.time()
+    try:
+      self.result   = self._func(self,self.name,*self.args)
+      self.state    = "done"
+      self.progress = 1.0
+    except JobCancelled:
+      self.state = "cancelled"
+    except Exception as e:
+      if self.cancelled:
+        self.state = "cancelled"         # e.g. session deleted meanwhile
+      else:
+        self.state = "failed"
+        self.msg   = str(e)
+    self.finished = time.time()
+
+  def get_status(self):
+    """ return the status of the job """
+
+    return {"id": self.id, "kind": self.kind, "name": self.name,
+            "state": self.state, "progress": round(self.progress,3),
+            "msg": self.msg, "result": self.result is not None,
+            "created": self.created, "started": self.started,
+            "finished": self.finished}
+
+class JobQueue(object):
+  """ Queue of background jobs executed by a pool of workers (greenlets,
+      the jobs run blocking calls in the threadpool). Finished jobs are
+      kept until keep newer jobs have finished """
+
+  def __init__(self,path,workers,keep):
+    """ Constructor - removes the results of old jobs """
+
+    self.path   = path
+    self._keep  = keep
+    self._id    = 0
+    self._jobs  = collections.OrderedDict()
+    self._queue = gevent.queue.Queue()
+    if os.path.isdir(path):
+      shutil.rmtree(path)
+    os.makedirs(path)
+    for _ in range(workers):
+      gevent.spawn(self._work)
+
+  def submit(self,kind,name,func,*args):
+    """ add a job - returns the job. If a job of the same kind and session
+        with the same arguments is still active, it is returned instead """
+
+    for job in self._jobs.values():
+      if job.active and (job.kind,job.name,job.args) == (kind,name,args):
+        return job
+    self._id += 1
+    job = Job(self._id,kind,name,func,args)
+    self._jobs[job.id] = job
+    self._queue.put(job)
+    return job
+
+  def get(self,job_id):
+    """ return a job (or None) """
+    return self._jobs.get(job_id)
+
+  def status(self):
+    """ return the status of all jobs, oldest first """
+    return [job.get_status() for job in self._jobs.values()]
+
+  def cancel(self,job):
+    """ cancel a job, running jobs stop at their next check """
+
+    if not job.active:
+      return
+    if job.state == "queued":
+      job.state    = "cancelled"
+      job.finished = time.time()
+    job.cancelled = True
+
+  def cancel_session(self,name):
+    """ cancel all active jobs of a session """
+
+    for job in self._jobs.values():
+      if job.active and job.name == name:
+        self.cancel(job)
+
+  def _work(self):
+    """ execute jobs (worker) """
+
+    while True:
+      job = self._queue.get()
+      if job.state != "queued":
+        continue                                   # cancelled while queued
+      if options.debug:
+        print("DEBUG: starting job %d (%s %s)" % (job.id,job.kind,job.name))
+      job.run()
+      if options.debug:
+        print("DEBUG: job %d %s" % (job.id,job.state))
+      self._expire()
+
+  def _expire(self):
+    """ remove the oldest finished jobs and their results """
+
+    finished = [job for job in self._jobs.values() if not job.active]
+    for job in finished[:max(len(finished)-self._keep,0)]:
+      del self._jobs[job.id]
+      if job.result:
+        try:
+          os.unlink(job.result)
+        except OSError:
+          pass
+
+# --- jobs   ----------------------------------------------------------------
+
+def job_graph(job,name):
+  """ render the graphs of a session into the cache """
+
+  global options
+  f = os.path.join(options.data_root[0],"%s.rrd" % name)
+  summary = get_values(f)
+  flush_cached(f)
+  for k,gtype in enumerate(vamgraph.GRAPH_TYPES):
+    job.check(float(k)/len(vamgraph.GRAPH_TYPES))
+    get_graph(name,f,summary,gtype)
+
+def job_summary(job,name):
+  """ create the summary of a session again """
+
+  global options
+  f = os.path.join(options.data_root[0],"%s.rrd" % name)
+  flush_cached(f)
+  job.check()
+  gevent.get_hub().threadpool.apply(vameter.rebuild_summary,(f,))
+  options.catalog.refresh(options.data_root[0],name)
+
+def job_export(job,name,fmt,start,end,resolution):
+  """ export a session into a file (see /export) - returns the path """
+
+  global options
+  f = os.path.join(options.data_root[0],"%s.rrd" % name)
+  summary = get_values(f)
+  flush_cached(f)
+  first = max(start or summary["ts_start"],summary["ts_start"])
+  last  = min(end or summary["ts_end"],summary["ts_end"])
+  path  = os.path.join(options.jobs.path,"%d.%s" % (job.id,fmt))
+
+  def check_rows(rows):
+    for n,row in enumerate(rows):
+      if not n % EXPORT_ROWS:
+        job.check((row[0]-first)/max(last-first,1e-3))
+      yield row
+
+  def write():
+    titles,rows = vamdata.fetch_session(f,summary,start,end,resolution,
+                                        get_daemon_args())
+    out = open(path,"wb")
+    try:
+      writer = EXPORT_FORMATS[fmt][1]
+      for chunk in join_chunks(writer(titles,check_rows(rows))):
+        out.write(chunk)
+    finally:
+      out.close()
+
+  # reading and writing runs in a thread
+  try:
+    gevent.get_hub().threadpool.apply(write)
+  except:
+    if os.path.exists(path):
+      os.unlink(path)
+    raise
+  return path
+
+JOB_KINDS = {
+  'graph':   job_graph,
+  'summary': job_summary,
+  'export':  job_export
+  }
+
+# --- submit and query jobs   ----------------------------------------------
+
+@route('/jobs',method='GET')
+def jobs():
+  """ return the status of all jobs """
+
+  global options
+  bottle.response.content_type = 'application/json'
+  return json.dumps({"jobs": options.jobs.status()})
+
+@route('/jobs',method='POST')
+def submit_job():
+  """ add a job (kind: graph, summary or export) """
+
+  global options
+  forms = bottle.request.forms
+  kind  = forms.get('kind')
+  name  = forms.get('name')
+
+  if options.debug:
+    print("DEBUG: processing job (kind: %s, name: %s)" % (kind,name))
+
+  bottle.response.content_type = 'application/json'
+  if not kind in JOB_KINDS or name is None or len(name.split(os.sep)) > 1:
+    bottle.response.status       = 400                 # bad request
+    return '{"msg": "invalid argument"}'
+  if not os.path.exists(os.path.join(options.data_root[0],"%s.rrd" % name)):
+    bottle.response.status       = 404                 # not found
+    return '{"msg": "session does not exist"}'
+
+  # exports take the arguments of /export
+  args = []
+  if kind == 'export':
+    fmt = forms.get('format','csv')
+    try:
+      if not fmt in EXPORT_FORMATS:
+        raise ValueError(fmt)
+      args = [fmt,
+              float(forms.get('start')) if forms.get('start') else None,
+              float(forms.get('end')) if forms.get('end') else None,
+              float(forms.get('resolution') or 0)]
+    except ValueError:
+      bottle.response.status       = 400                 # bad request
+      return '{"msg": "invalid argument"}'
+
+  job = options.jobs.submit(kind,name,JOB_KINDS[kind],*args)
+  bottle.response.status = 202                         # accepted
+  return json.dumps({"msg": "job %d queued" % job.id,
+                     "job": job.get_status()})
+
+@route('/jobs/<job_id:int>',method='GET')
+def job_status(job_id):
+  """ return the status of a job """
+
+  global options
+  job = options.jobs.get(job_id)
+  bottle.response.content_type = 'application/json'
+  if not job:
+    bottle.response.status       = 404                 # not found
+    return '{"msg": "job does not exist"}'
+  return json.dumps(job.get_status())
+
+@route('/jobs/<job_id:int>/cancel',method='POST')
+def cancel_job(job_id):
+  """ cancel a job """
+
+  global options
+  job = options.jobs.get(job_id)
+  bottle.response.content_type = 'application/json'
+  if not job:
+    bottle.response.status       = 404                 # not found
+    return '{"msg": "job does not exist"}'
+  if options.debug:
+    print("DEBUG: cancelling job %d" % job_id)
+  options.jobs.cancel(job)
+  return json.dumps(job.get_status())
+
+@route('/jobs/<job_id:int>/result',method='GET')
+def job_result(job_id):
+  """ download the result of a job (e.g. an export) """
+
+  global options
+  job = options.jobs.get(job_id)
+  if not job or not job.result:
+    bottle.response.content_type = 'application/json'
+    bottle.response.status       = 404                 # not found
+    return '{"msg": "no result"}'
+  fmt = os.path.splitext(job.result)[1][1:]
+  return bottle.static_file(os.path.basename(job.result),
+                            root=options.jobs.path,
+                            mimetype=EXPORT_FORMATS[fmt][0],
+                            download="%s.%s" % (job.name,fmt))
+
+# --- files of a session   -------------------------------------------------
+
+def get_session_files():
+  """ return the suffixes of all files of a session, including the
+      capture-file and the database created from it """
+
+  suffixes = ['.rrd','.summary','.xml','-I.png','-U.png','-P.png','-C.png']
+  return (suffixes + [vamstore.STORE_EXT,vameter.CAPTURE_EXT] +
+          [vamcatalog.CAPTURE_SUFFIX + s for s in suffixes])
 
 # --- delete entry   --------------------------------------------------------
 
@@ -188,17 +1070,25 @@ def delete():
     return '{"msg": ' + msg +'}'
 
   # find and delete all matching files
+  options.jobs.cancel_session(name)
+  flush_cached(os.path.join(options.data_root[0],"%s.rrd" % name))
   count = 0
-  for suffix in ['.rrd','.summary','.xml','-I.png','-U.png','-P.png']:
+  for suffix in get_session_files():
     f = os.path.join(options.data_root[0],"%s%s" % (name,suffix))
     if options.debug:
       print("DEBUG: checking %s" % f)
-    if os.path.exists(f):
+    if os.path.isdir(f):
+      count += 1
+      shutil.rmtree(f)
+    elif os.path.exists(f):
       count += 1
       os.unlink(f);
       if options.debug:
         print("DEBUG: deleted %s" % f)
 
+  options.catalog.remove(name)
+  options.graph_cache.purge(name)
+
   # return number of deleted files
   msg = '"deleted %d files"' % count
   print "DEBUG: count: %d, msg: %s" % (count,msg)
@@ -230,8 +1120,10 @@ def rename():
     return '{"msg": ' + msg +'}'
 
   # find and rename all matching files
+  options.jobs.cancel_session(name)
+  flush_cached(os.path.join(options.data_root[0],"%s.rrd" % name))
   count = 0
-  for suffix in ['.rrd','.summary','.xml','-I.png','-U.png','-P.png']:
+  for suffix in get_session_files():
     f_old = os.path.join(options.data_root[0],"%s%s" % (name,suffix))
     f_new = os.path.join(options.data_root[0],"%s%s" % (new_name,suffix))
     if options.debug:
@@ -242,16 +1134,9 @@ def rename():
       if options.debug:
         print("DEBUG: renamed %s to %s" % (f_old,f_new))
 
-  # recreate img-files
-  args = [
-    os.path.join(options.pgm_dir,"vameter.py"),
-    "-D",
-    options.data_root[0],
-    "-g",
-    "UIP",
-    os.path.join(options.data_root[0],"%s.rrd" % new_name)
-    ]
-  subprocess.check_output(args)
+  options.catalog.remove(name)
+  options.catalog.refresh(options.data_root[0],new_name)
+  options.graph_cache.purge(name)
 
   # return number of deleted files
   msg = '"renamed %d files"' % count
@@ -272,23 +1157,162 @@ def start():
   if options.debug:
     print("DEBUG: starting data collection (name: %s)" % name)
   args = [
-    os.path.join(options.pgm_dir,"vameter.py"),
     "-D",
     options.data_root[0],
-    "-O",
-    "json",
-    "-g",
-    "UIP",
-    "-r"
+    "-l",
+    "DEBUG" if options.debug else "ERROR"
     ]
+  dbfile = None
   if len(name):
-    args.append(os.path.join(options.data_root[0],"%s.rrd" % name))
+    dbfile = os.path.join(options.data_root[0],"%s.rrd" % name)
+
+  # only one run at a time (it owns the event-hub)
+  bottle.response.content_type = 'application/json'
+  try:
+    with options.engine_lock:
+      options.run = options.engine.start(dbfile,args)
+  except RuntimeError as e:
+    bottle.response.status       = 409                 # conflict
+    return json.dumps({"msg": str(e)})
+  except ValueError as e:
+    bottle.response.status       = 400                 # bad request
+    return json.dumps({"msg": str(e)})
+  options.events.open()
+  return json.dumps({"msg": "started run %d" % options.run})
+
+# --- broadcast of server-side-events   ------------------------------------
+
+class Subscriber(object):
+  """ client of the event-hub with a bounded buffer of events """
+
+  def __init__(self,size):
+    """ Constructor """
+
+    self.events  = collections.deque(maxlen=size)
+    self.closed  = False
+    self._ready  = gevent.event.Event()
+
+  def put(self,event):
+    """ buffer an event - returns False if the buffer is full """
+
+    if len(self.events) == self.events.maxlen:
+      return False
+    self.events.append(event)
+    self._ready.set()
+    return True
+
+  def close(self):
+    """ end the stream of the client """
+
+    self.closed = True
+    self._ready.set()
+
+  def get(self,timeout):
+    """ wait for events - returns all buffered events (maybe none) """
+
+    self._ready.wait(timeout)
+    self._ready.clear()
+    events = list(self.events)
+    self.events.clear()
+    return events
+
+class EventHub(object):
+  """ Fan out the events of the collector to all clients. Events are
+      numbered and the last events are kept for clients resuming with
+      Last-Event-ID """
+
+  def __init__(self,size,history):
+    """ Constructor """
+
+    self.active       = False
+    self._size        = size
+    self._id          = 0
+    self._history     = collections.deque(maxlen=history)
+    self._subscribers = set()
+
+  def open(self):
+    """ start a new stream (event-ids continue) """
 
-  # start process
-  options.collect_process = subprocess.Popen(args,
-                                             bufsize=-1,
-                                             stdout=subprocess.PIPE,
-                                             stderr=options.devnull)
+    self._history.clear()
+    self.active = True
+
+  def publish(self,data):
+    """ send data to all clients, slow clients are dropped """
+
+    self._id += 1
+    event = (self._id,"id: %d\ndata: %s\n\n" % (self._id,data))
+    self._history.append(event)
+    for sub in list(self._subscribers):
+      if not sub.put(event[1]):
+        if options.debug:
+          print("DEBUG: dropping slow client")
+        sub.events.clear()
+        self.unsubscribe(sub)
+
+  def subscribe(self,last_id=None):
+    """ add a client, events after last_id are sent again """
+
+    sub = Subscriber(self._size)
+    if last_id is not None:
+      for event_id,event in self._history:
+        if event_id > last_id and not sub.put(event):
+          # too many missed events: start with the latest ones
+          sub.events.popleft()
+          sub.events.append(event)
+    self._subscribers.add(sub)
+    return sub
+
+  def unsubscribe(self,sub):
+    """ remove a client and end its stream """
+
+    self._subscribers.discard(sub)
+    sub.close()
+
+  def close(self):
+    """ end the stream of all clients """
+
+    self.active = False
+    for sub in list(self._subscribers):
+      self.unsubscribe(sub)
+
+def read_engine():
+  """ publish the records of the collector-engine (single reader) """
+
+  global options
+  while True:
+    try:
+      record = options.engine.get()
+    except EOFError:
+      print("ERROR: collector-engine terminated")
+      options.events.close()
+      break
+    if record['type'] == 'data':
+      options.events.publish(json.dumps(record,sort_keys=True))
+    elif record['type'] == 'wave':
+      options.waves.publish(record)
+    elif record['state'] != 'running' and record['run'] == options.run:
+      # end of the current run
+      if options.debug:
+        print("DEBUG: run %d %s" % (record['run'],record['state']))
+      options.events.close()
+      if 'name' in record:
+        options.catalog.refresh(options.data_root[0],record['name'])
+
+def stream_events(sub):
+  """ send the events of a client (with keepalive-comments) """
+
+  global options
+  try:
+    while True:
+      events = sub.get(SSE_PING)
+      if events:
+        yield "".join(events)
+      elif sub.closed:
+        break
+      else:
+        yield ": keepalive\n\n"
+  finally:
+    options.events.unsubscribe(sub)
 
 # --- send server-side-events   --------------------------------------------
 
@@ -297,27 +1321,162 @@ def update():
   """ send server side event data """
 
   global options
-  p = options.collect_process
-  if not p:
+  if not options.events.active:
     bottle.response.content_type = 'text/plain'
     bottle.response.status = 404                 # not found
+    return ""
+
+  try:
+    last_id = int(bottle.request.headers.get('Last-Event-ID'))
+  except (TypeError,ValueError):
+    last_id = None
+  if options.debug:
+    print("DEBUG: new event-client (last id: %r)" % last_id)
+
+  bottle.response.content_type = 'text/event-stream'
+  bottle.response.set_header('Cache-Control','no-cache')
+  bottle.response.set_header('Connection','keep-alive')
+  return stream_events(options.events.subscribe(last_id))
+
+# --- broadcast of live waveforms   ----------------------------------------
+
+def encode_wave(record,decimation):
+  """ return a binary frame (header and codes of every channel) of a
+      waveform-record with every decimation-th scan. The codes are passed
+      unchanged (uint16, little-endian) """
+
+  codes = array.array('H')
+  codes.fromstring(record['data'])
+  n     = record['scans']
+  data  = array.array('H')
+  for k in range(len(record['names'])):
+    data.extend(codes[k*n:(k+1)*n:decimation])
+  return struct.pack(WAVE_HDR_FMT,WAVE_MAGIC,record['bits'],
+                     len(record['names']),record['step']*decimation,
+                     len(data)//len(record['names']),record['ts'],
+                     record['rate']/decimation) + data.tostring()
+
+def get_decimation(value):
+  """ return a valid decimation (raises ValueError or TypeError) """
+  return max(1,min(int(value),WAVE_MAX_DEC))
+
+class WaveHub(object):
+  """ Fan out the waveforms of the collector to websocket-clients. All
+      clients together receive at most bandwidth bytes/s: the decimation
+      requested by a client is raised if necessary. Every frame is encoded
+      once per decimation """
+
+  def __init__(self,bandwidth,clients):
+    """ Constructor """
+
+    self._bandwidth   = bandwidth
+    self._max_clients = clients
+    self._subscribers = set()
+
+  def _watch(self,enable):
+    """ enable or disable waveform-records of the engine """
+
+    with options.engine_lock:
+      options.engine.watch(enable)
+
+  def subscribe(self,decimation):
+    """ add a client (returns None if there are too many clients) """
+
+    if len(self._subscribers) >= self._max_clients:
+      return None
+    sub = Subscriber(WAVE_BUFFER)
+    sub.decimation = decimation
+    sub.names      = None                 # channels of the last frame
+    self._subscribers.add(sub)
+    if len(self._subscribers) == 1:
+      self._watch(True)
+    return sub
+
+  def unsubscribe(self,sub):
+    """ remove a client """
+
+    if not sub in self._subscribers:
+      return
+    self._subscribers.discard(sub)
+    sub.close()
+    if not self._subscribers:
+      self._watch(False)
+
+  def publish(self,record):
+    """ send a frame to all clients, slow clients skip frames """
+
+    if not self._subscribers:
+      return
+    size    = 2*len(record['names'])*record['rate']      # bytes/s per client
+    min_dec = int(math.ceil(len(self._subscribers)*size/self._bandwidth))
+    frames  = {}
+    for sub in self._subscribers:
+      if sub.names != record['names']:
+        # channels (and resolution) are sent as text before the first frame
+        if sub.put((json.dumps({"channels": record['names'],
+                                "bits": record['bits']}),False)):
+          sub.names = record['names']
+      decimation = max(sub.decimation,min_dec)
+      if not decimation in frames:
+        frames[decimation] = encode_wave(record,decimation)
+      sub.put((frames[decimation],True))
+
+def receive_wave(ws,sub):
+  """ read messages of a websocket-client (e.g. {"decimation": 4}) """
 
   try:
-    bottle.response.content_type = 'text/event-stream'
-    bottle.response.set_header('Cache-Control','no-cache')
-    bottle.response.set_header('Connection','keep-alive')
     while True:
-      data = p.stdout.readline()
-      if data == '' and p.poll() is not None:
+      msg = ws.receive()
+      if msg is None:
         break
-      if data:
-        # send data using SSE
-        bottle.response.status = 200                 # OK
-        yield "data: %s\n\n" % data
-  except:
+      try:
+        sub.decimation = get_decimation(json.loads(msg)['decimation'])
+      except (ValueError,TypeError,KeyError):
+        pass
+  except WebSocketError:
     pass
-  bottle.response.content_type = 'text/plain'
-  bottle.response.status = 404
+  sub.close()
+
+# --- send live waveforms   ------------------------------------------------
+
+@route('/wave',method='GET')
+def wave():
+  """ send binary frames of live waveforms to a websocket-client """
+
+  global options
+  bottle.response.content_type = 'application/json'
+  if not have_websocket:
+    bottle.response.status = 501                 # not implemented
+    return json.dumps({"msg": "websockets not available"})
+  ws = bottle.request.environ.get('wsgi.websocket')
+  if not ws:
+    bottle.response.status = 400                 # bad request
+    return json.dumps({"msg": "websocket expected"})
+
+  try:
+    decimation = get_decimation(bottle.request.query.get('decimation',1))
+  except ValueError:
+    bottle.response.status = 400                 # bad request
+    return json.dumps({"msg": "invalid decimation"})
+  sub = options.waves.subscribe(decimation)
+  if not sub:
+    bottle.response.status = 503                 # service unavailable
+    return json.dumps({"msg": "too many clients"})
+  if options.debug:
+    print("DEBUG: new waveform-client (decimation: %d)" % decimation)
+
+  receiver = gevent.spawn(receive_wave,ws,sub)
+  try:
+    while not sub.closed:
+      for data,binary in sub.get(SSE_PING):
+        ws.send(data,binary=binary)
+  except WebSocketError:
+    pass
+  finally:
+    receiver.kill()
+    options.waves.unsubscribe(sub)
+    if options.debug:
+      print("DEBUG: waveform-client closed")
 
 # --- stop data collection   -----------------------------------------------
 
@@ -328,9 +1487,22 @@ def stop():
   global options
   if options.debug:
     print("DEBUG: stopping data collection")
-  if options.collect_process:
-    options.collect_process.terminate()
-    options.collect_process = None
+  with options.engine_lock:
+    state = options.engine.stop()
+  bottle.response.content_type = 'application/json'
+  return json.dumps(state)
+
+# --- state of data collection   -------------------------------------------
+
+@route('/status',method='GET')
+def status():
+  """ return state and statistics of the current (or last) run """
+
+  global options
+  with options.engine_lock:
+    state = options.engine.status()
+  bottle.response.content_type = 'application/json'
+  return json.dumps(state)
 
 # --- shutdown system   ----------------------------------------------------
 
@@ -354,57 +1526,76 @@ def reboot():
     print("DEBUG: rebooting the system")
   os.system("sudo /sbin/reboot &")
 
-# --- commandline-parser   --------------------------------------------------
-
-def get_parser():
-  parser = ArgumentParser(add_help=False,
-    description='Simple webserver for pi-vameter')
-
-  parser.add_argument('-H', '--host', nargs=1,
-    metavar='host', default=['0.0.0.0'],
-    dest='host',
-    help='host-mask')
-  parser.add_argument('-P', '--port', nargs=1,
-    metavar='port', default=[DEFAULT_PORT],
-    dest='port',
-    help='port the server is listening on (default: %d)' % DEFAULT_PORT)
-
-  parser.add_argument('-D', '--dir', nargs=1,
-    metavar='data-root', default=[DATA_ROOT],
-    dest='data_root',
-    help='directory with RRDs and graphics')
-
-  parser.add_argument('-d', '--debug',
-    dest='debug', default=False, action='store_true',
-    help='start in debug-mode')
-
-  parser.add_argument('-h', '--hilfe', action='help',
-    help='display this help')
-  return parser
-
 # --- main program   --------------------------------------------------------
 
 if __name__ == '__main__':
-  # read options
-  opt_parser = get_parser()
-  options = opt_parser.parse_args(namespace=Options)
-  options.collect_process = None
-  options.devnull = open(os.devnull)
+  # options were read before the engine was started
+  options.events  = EventHub(SSE_BUFFER,SSE_HISTORY)
+  options.waves   = WaveHub(WAVE_BANDWIDTH,WAVE_CLIENTS)
   options.pgm_dir = os.path.dirname(os.path.abspath(__file__))
+
+  # rrdcached (shared with vameter.py)
+  parser = ConfigParser.RawConfigParser()
+  parser.read(CONFIG_FILE)
+  try:
+    options.rrd_daemon = parser.get('RRD','DAEMON')
+  except:
+    options.rrd_daemon = ''
+  if options.debug:
+    print("DEBUG: rrdcached: %r" % options.rrd_daemon)
   if options.debug:
     print("DEBUG: pgm_dir directory: %s" % options.pgm_dir)
 
+  # catalog of all sessions
+  if not os.path.isdir(options.data_root[0]):
+    os.makedirs(options.data_root[0])
+  options.catalog = vamcatalog.Catalog(
+                      vamcatalog.get_catalog_path(options.data_root[0]))
+  changes = options.catalog.sync(options.data_root[0])
+  if options.debug:
+    print("DEBUG: catalog-sync: %d changes" % changes)
+  gevent.spawn(watch_catalog)
+
+  # data collection (commands are serialized, records read by a greenlet).
+  # The watcher-process of the reloader has no engine
+  options.engine      = engine
+  options.engine_lock = gevent.lock.Semaphore()
+  options.run         = 0
+  if engine:
+    engine.wait = gevent.socket.wait_read
+    gevent.spawn(read_engine)
+
+  # graphs are rendered on demand
+  options.graph_cache = vamgraph.GraphCache(
+                          os.path.join(options.data_root[0],GRAPH_CACHE),
+                          GRAPH_SIZE)
+
+  # graphs, summaries and exports as background jobs
+  options.jobs = JobQueue(os.path.join(options.data_root[0],JOB_DIR),
+                          JOB_WORKERS,JOB_KEEP)
+
+  # responses of /results are cached until the catalog changes
+  options.results            = {}
+  options.results_generation = None
+
   # start server
   WEB_ROOT = get_webroot(options.pgm_dir)
   if options.debug:
     print("DEBUG: web-root directory: %s" % WEB_ROOT)
+  options.static = compress_static(WEB_ROOT)
+  server_args = {'server': 'gevent'}
+  if have_websocket:
+    server_args['handler_class'] = WebSocketHandler
+  if options.debug:
+    print("DEBUG: precompressed %d static files" % len(options.static))
+    print("DEBUG: websockets: %s" % have_websocket)
     print("DEBUG: starting the webserver in debug-mode")
     bottle.run(host='localhost',
                port=options.port[0],
                debug=True,reloader=True,
-               server='gevent')
+               **server_args)
   else:
     bottle.run(host=options.host[0],
                port=options.port[0],
                debug=False,reloader=False,
-               server='gevent')
+               **server_args)
@@ -17,11 +17,21 @@ try:
 except:
   have_spi = False
 
+try:
+  import numpy
+  have_numpy = True
+except ImportError:
+  have_numpy = False
+
 import os, sys, signal, signal, time, datetime, traceback
-import subprocess, syslog
-from argparse import ArgumentParser
+import subprocess, syslog, struct, fcntl, ctypes, array, random, mmap
+import multiprocessing
+from argparse import ArgumentParser, ArgumentTypeError
 from threading import Thread, Event, Lock
-import json, rrdtool, math, statistics, ConfigParser
+import json, rrdtool, math, ConfigParser, Queue
+import vamstore, vamdata, vamcatalog, vamgraph
+from vamdata import get_rrd_step, to_rrd_time, from_rrd_time, get_db_rails
+from vamdata import TIMESTAMP_FMT
 
 # --- read configuration-value   ---------------------------------------------
 
@@ -36,12 +46,53 @@ def get_config(parser,section,option,default):
     value = default
   return value
 
+# --- measurement rail   -----------------------------------------------------
+
+class Rail(object):
+  """ A pair of ADC-channels (U and I) with the calibration of its sensor.
+
+  The primary rail has no name, additional rails add their name as suffix
+  to the data-sources of the database and to the keys of the records.
+  """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,name,u_channel,i_channel,u_cc_2,conv_value):
+    """ Constructor """
+
+    self.name       = name
+    self.u_channel  = u_channel
+    self.i_channel  = i_channel
+    self.u_cc_2     = u_cc_2
+    self.conv_value = conv_value
+    self.reset()
+
+  # --- reset running maxima and total energy   ------------------------------
+
+  def reset(self):
+    """ reset running maxima and total energy """
+
+    self.u_max = 0.0
+    self.i_max = 0.0
+    self.p_max = 0.0
+    self.p_sum = 0.0
+
+  # --- suffix of data-sources and keys   -------------------------------------
+
+  @property
+  def suffix(self):
+    """ suffix for data-sources and keys ("" for the primary rail) """
+    return "_" + self.name if self.name else ""
+
 # --- read configuration   ---------------------------------------------------
 
 def get_configuration():
   """ read complete configuration """
 
-  global ADC, U_CC_2, CONV_VALUE
+  global ADC, U_CC_2, CONV_VALUE, RAILS
+  global SPI_SPEED, SAMPLE_RATE, BURST_SIZE, RESERVOIR, INTERVAL, USE_NUMPY
+  global PRETRIGGER, BATCH_SIZE, RRD_DAEMON, USE_STORE
+  global RRD_PROFILE, RRD_TIERS, RRD_CF, CHECKPOINT
 
   parser = ConfigParser.RawConfigParser()
   parser.read('/etc/vameter.conf')
@@ -50,6 +101,45 @@ def get_configuration():
   U_CC_2     = float(get_config(parser,'HALL','U_CC_2','2.5'))
   CONV_VALUE = float(get_config(parser,'HALL','CONV_VALUE','0.185'))
 
+  # primary rail and additional rails [RAIL1] ... [RAIL3] (MCP3008 only)
+  RAILS = [Rail('',int(get_config(parser,'HALL','U_CHANNEL','0')),
+                   int(get_config(parser,'HALL','I_CHANNEL','1')),
+                   U_CC_2,CONV_VALUE)]
+  for n in range(1,4):
+    section = 'RAIL%d' % n
+    if not parser.has_section(section):
+      continue
+    RAILS.append(Rail(get_config(parser,section,'NAME',section),
+                      int(get_config(parser,section,'U_CHANNEL',str(2*n))),
+                      int(get_config(parser,section,'I_CHANNEL',str(2*n+1))),
+                      float(get_config(parser,section,'U_CC_2','2.5')),
+                      float(get_config(parser,section,'CONV_VALUE','0.185'))))
+
+  SPI_SPEED   = int(get_config(parser,'SPI','MAX_SPEED_HZ','50000'))
+  SAMPLE_RATE = int(get_config(parser,'SPI','SAMPLE_RATE','0'))
+  BURST_SIZE  = int(get_config(parser,'SPI','BURST_SIZE','0'))
+
+  RESERVOIR   = int(get_config(parser,'STATS','RESERVOIR','256'))
+  USE_NUMPY   = int(get_config(parser,'STATS','NUMPY','1')) == 1
+
+  # interval must be a multiple or a fraction (1/n) of a second
+  INTERVAL    = float(get_config(parser,'RRD','INTERVAL','1'))
+  if INTERVAL >= 1:
+    INTERVAL  = int(round(INTERVAL))
+  else:
+    INTERVAL  = 1.0/round(1.0/INTERVAL)
+  PRETRIGGER  = float(get_config(parser,'RRD','PRETRIGGER','10'))
+  BATCH_SIZE  = max(1,int(get_config(parser,'RRD','BATCH','10')))
+  RRD_DAEMON  = get_config(parser,'RRD','DAEMON','')
+  USE_STORE   = int(get_config(parser,'RRD','STORE','1')) == 1
+  CHECKPOINT  = float(get_config(parser,'RRD','CHECKPOINT','60'))
+
+  # retention of the round-robin-archives: profile, optionally replaced
+  # by explicit tiers (resolution:retention in seconds) and functions
+  RRD_PROFILE = get_config(parser,'RRD','PROFILE','longterm')
+  RRD_TIERS   = get_config(parser,'RRD','TIERS','')
+  RRD_CF      = get_config(parser,'RRD','CF','')
+
 # --- constants   ------------------------------------------------------------
 
 get_configuration()
@@ -58,7 +148,8 @@ get_configuration()
 
 ADC_VALUES = {
   'MCP3002': { 'CMD_BYTES': [[0,104,0],[0,120,0]], 'RESOLUTION': 10},
-  'MCP3008': { 'CMD_BYTES': [[1,128,0],[1,144,0]], 'RESOLUTION': 10},
+  'MCP3008': { 'CMD_BYTES': [[1,(8+ch)<<4,0] for ch in range(8)],
+                                                      'RESOLUTION': 10},
   'MCP3202': { 'CMD_BYTES': [[1,160,0],[1,224,0]], 'RESOLUTION': 12}
   }
 
@@ -67,13 +158,20 @@ ADC_BYTES  = ADC_VALUES[ADC]['CMD_BYTES']
 ADC_RES    = 2**ADC_VALUES[ADC]['RESOLUTION']
 ADC_MASK   = 2**(ADC_VALUES[ADC]['RESOLUTION']-8) - 1
 
-TIMESTAMP_FMT = "%Y-%m-%d %H:%M:%S"
-DT_UNIX_0     = datetime.datetime.fromtimestamp(0)
-INTERVAL      = 1
-KEEP_SEC      = 1           # number of hours to keep seconds-data
-KEEP_MIN      = 24          # number of hours to keep minute-data
-KEEP_HOUR     = 1           # number of month to keep hour-data
-KEEP_DAY      = 12          # number of month to keep day-data
+RRA_MAX_ROWS  = 100000      # limit for data with the native resolution
+
+# retention profiles: tiers are (resolution,retention) in seconds, a
+# resolution of 0 is the native resolution (INTERVAL)
+RRA_PROFILES = {
+  'bench':    {'tiers': [(0,2*3600),(1,2*3600)],
+               'cf':    ["AVERAGE","MAX"]},
+  'soak':     {'tiers': [(0,3600),(1,3600),(60,3*86400)],
+               'cf':    ["AVERAGE","MAX"]},
+  'longterm': {'tiers': [(0,3600),(1,3600),(60,86400),
+                         (3600,31*86400),(86400,12*31*86400)],
+               'cf':    ["AVERAGE","MIN","MAX"]}
+  }
+DISPLAY_EVERY = max(1,int(round(1.0/INTERVAL)))   # intervals per display-update
 
 U_MIN         = 0.5         # levels below indicate that the circuit has no power
 U_MAX         = 5.6         # max voltage (technically 5.5 with some headroom)
@@ -84,6 +182,39 @@ U_RES         = U_REF/ADC_RES
 
 I_SCALE       = 1000        # scale A to mA
 
+DISPLAY_QUEUE = 2           # queue-sizes of the workers (in intervals)
+LOG_QUEUE     = 10
+DB_QUEUE      = 60
+DB_TIMEOUT    = INTERVAL/2.0  # max. wait of the collector for the db-worker
+
+ENGINE_QUEUE  = 60          # records buffered for the client of the engine
+WAVE_RATE     = 5000        # max. samples/s per channel of live waveforms
+WAVE_BLOCK    = 1000        # max. scans of a waveform-record
+WAVE_LATENCY  = 0.1         # max. age of buffered scans of waveforms (s)
+
+# single reads stop 10ms (at most a tenth of an interval) before the deadline
+SAMPLE_MARGIN = int(min(0.01,INTERVAL/10.0)*1e9)   # ns
+SAMPLE_PAUSE  = 0.01 if INTERVAL >= 1 else 0      # pause between single reads
+WINDOW_FILL   = 0.95        # bursts are paced to fill 95% of an interval
+
+# constants of the spidev-interface (see linux/spi/spidev.h)
+SPI_IOC_XFER_FMT = "=QQIIHBBBBBB"   # struct spi_ioc_transfer
+SPI_IOC_XFER_LEN = struct.calcsize(SPI_IOC_XFER_FMT)
+SPI_IOC_MAX_XFER = 511              # message-size must fit into 14 bits
+SPI_IOC_BUF_SIZE = 4096             # default bufsiz of the spidev-driver
+
+# layout of capture-files (little-endian, see CaptureWriter)
+CAPTURE_EXT      = ".cap"
+CAPTURE_MAGIC    = "VAMCAP01"
+CAPTURE_HDR_FMT  = "<8sI8sHHIddddQ"    # magic,header-size,adc,bits,channels,
+                                      # block-scans,rate,start,U_RES,U_FAC,
+                                      # blocks
+CAPTURE_CNT_POS  = struct.calcsize(CAPTURE_HDR_FMT) - 8
+CAPTURE_CHN_FMT  = "<8scBdd"           # rail,kind (U/I),channel,U_CC_2,CONV
+CAPTURE_BLK_FMT  = "<d"                # timestamp of a block
+CAPTURE_CHUNK    = 4*1024*1024         # file grows in chunks of this size
+CAPTURE_POINTS   = 1000                # max. number of points of graphs
+
 # output format-templates
 LINE0  = "----------------------"
 
@@ -97,6 +228,27 @@ LINE2V = "{0} {1:6.4f}   {2:6.4f} "
 LINE3V = "max {0:6.4f}   {1:6.4f} "
 LINE4V = "tot {0:02d}:{1:02d}:{2:02d}        "
 
+# --- lookup-tables for ADC-codes   ------------------------------------------
+
+def build_luts(rail):
+  """ build lookup-tables (ADC-code -> value) of U and I of a rail for all
+      modes """
+
+  codes = range(ADC_RES)
+  u_lut = array.array('d',[c*U_RES*U_FAC for c in codes])
+  i_lut = array.array('d')
+  for c in codes:
+    i = max(0.0,(rail.u_cc_2 - c*U_RES)/rail.conv_value)*I_SCALE
+    i_lut.append(i if i <= A_MAX*I_SCALE else 0.0)   # ignore invalid values
+
+  return {
+    'normal':  (u_lut,i_lut),
+    'voltage': (u_lut,array.array('d',[c*U_RES for c in codes])),
+    'raw':     (array.array('d',codes),array.array('d',codes))
+    }
+
+LUTS = [build_luts(rail) for rail in RAILS]
+
 # --- helper class for options   --------------------------------------------
 
 class Options(object):
@@ -174,29 +326,717 @@ def query_output_opts(options):
   except:
     options.have_disp = False
 
+# --- burst-reader for the SPI-bus   -----------------------------------------
+
+class BurstReader(object):
+  """ Read a burst of scans (all channels) with a minimal number of syscalls.
+
+  The MCP3xxx-converters start a conversion with the falling edge of CS,
+  so every command-frame is a separate transfer with cs_change set. All
+  transfers are submitted as one SPI-message (or as few messages as the
+  spidev-driver allows) using the SPI_IOC_MESSAGE-ioctl. The sample-rate
+  is enforced by the driver using the delay after each transfer.
+  """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,spi,channels,count,speed,rate,logger,use_numpy=False):
+    """ Constructor """
+
+    self._spi      = spi
+    self._channels = channels
+    self.count     = count
+    self._numpy    = use_numpy
+    self._rate     = rate
+    self._logger   = logger
+    self._frames   = [list(ADC_BYTES[c]) for c in channels]
+    self._flen     = len(ADC_BYTES[0])
+    n_chan         = len(channels)
+
+    # time per frame and delay after each frame
+    f_usec = 8*self._flen*1000000.0/speed
+    if rate > 0:
+      delay = int(max(0,1000000.0/(n_chan*rate) - f_usec))
+    else:
+      delay = 0
+    self._delay    = min(delay,65535)
+    self.scan_sec  = n_chan*(f_usec+self._delay)/1000000.0
+    logger.msg("DEBUG", "burst: %d scans of %r, frame-time %.1fus, delay %dus" %
+                        (count,channels,f_usec,self._delay))
+
+    if spi is None:
+      self._msgs = None
+    else:
+      self._msgs = self._create_msgs(count,speed)
+
+  # --- create messages   ----------------------------------------------------
+
+  def _create_msgs(self,count,speed):
+    """ create buffers and transfer-structs for all messages of a burst """
+
+    # frames per message: complete scans within driver limits
+    n_chan = len(self._frames)
+    n_max  = min(SPI_IOC_MAX_XFER,SPI_IOC_BUF_SIZE//self._flen)
+    n_max  = n_max - n_max % n_chan
+    msgs   = []
+    scan   = "".join(chr(b) for frame in self._frames for b in frame)
+    todo   = n_chan*count
+    while todo > 0:
+      n     = min(todo,n_max)
+      todo -= n
+      tx    = ctypes.create_string_buffer(scan*(n//n_chan))
+      rx    = ctypes.create_string_buffer(n*self._flen)
+      xfers = array.array('B')
+      for i in range(n):
+        # cs_change on the last transfer would keep CS asserted
+        cs_change = 1 if i < n-1 else 0
+        xfers.fromstring(struct.pack(SPI_IOC_XFER_FMT,
+                           ctypes.addressof(tx)+i*self._flen,
+                           ctypes.addressof(rx)+i*self._flen,
+                           self._flen,speed,self._delay,0,cs_change,
+                           0,0,0,0))
+      req = 0x40000000 | ((n*SPI_IOC_XFER_LEN) << 16) | (ord('k') << 8)
+      msgs.append((req,xfers,tx,rx))
+    return msgs
+
+  # --- decode a received buffer   -------------------------------------------
+
+  def _decode(self,data):
+    """ decode a received buffer into a list of values """
+
+    f = self._flen
+    return [((data[k+1]&ADC_MASK) << 8) + data[k+2]
+                                       for k in range(0,len(data),f)]
+
+  def _decode_np(self,raw):
+    """ decode a received buffer into a numpy-array of values """
+
+    data = numpy.frombuffer(raw,dtype=numpy.uint8).reshape(-1,self._flen)
+    return ((data[:,1] & ADC_MASK).astype(numpy.int32) << 8) | data[:,2]
+
+  # --- split interleaved values   -------------------------------------------
+
+  def _split(self,values):
+    """ split interleaved values into one buffer per channel """
+
+    n_chan = len(self._channels)
+    return [values[k::n_chan] for k in range(n_chan)]
+
+  # --- read a burst   -------------------------------------------------------
+
+  def read(self):
+    """ read a burst - returns one buffer of raw values per channel """
+
+    if self._spi is None:
+      # simulation: pace using sleep, since there is no driver
+      values = [[read_spi(c,None,simulate=True)]*self.count
+                                                  for c in self._channels]
+      time.sleep(self.count*self.scan_sec)
+      if self._numpy:
+        return [numpy.array(v) for v in values]
+      return values
+
+    values = []
+    if self._msgs:
+      try:
+        fd = self._spi.fileno()
+        if self._numpy:
+          for req,xfers,tx,rx in self._msgs:
+            fcntl.ioctl(fd,req,xfers,True)
+            values.append(self._decode_np(rx.raw))
+          return self._split(numpy.concatenate(values))
+        for req,xfers,tx,rx in self._msgs:
+          fcntl.ioctl(fd,req,xfers,True)
+          values.extend(self._decode(bytearray(rx.raw)))
+      except:
+        # e.g. old spidev without fileno(): use xfer2 for each frame
+        self._logger.msg("WARN", "burst-ioctl failed, using xfer2")
+        self._logger.msg("TRACE", traceback.format_exc())
+        self._msgs = None
+        values     = []
+
+    if not self._msgs:
+      for _ in range(self.count):
+        for frame in self._frames:
+          values.extend(self._decode(self._spi.xfer2(list(frame))))
+      if self._numpy:
+        values = numpy.array(values)
+    return self._split(values)
+
+# --- online statistics   ----------------------------------------------------
+
+class Accumulator(object):
+  """ Online statistics of a stream of values.
+
+  Mean and variance are updated with Welford's algorithm (batches are
+  merged with Chan's formula), so memory is constant. Percentiles are
+  estimated from a fixed-size reservoir-sample (Algorithm L).
+  """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,size=0):
+    """ Constructor """
+    self._size = size
+    self.reset()
+
+  # --- reset accumulator   --------------------------------------------------
+
+  def reset(self):
+    """ reset all values """
+    self.count = 0
+    self.mean  = 0.0
+    self.min   = None
+    self.max   = None
+    self._m2   = 0.0
+    self._res  = []
+    self._w    = 1.0
+    self._next = 0
+
+  # --- add a single value   -------------------------------------------------
+
+  def add(self,x):
+    """ add a single value """
+    self.count += 1
+    d          = x - self.mean
+    self.mean += d/self.count
+    self._m2  += d*(x - self.mean)
+    if self.min is None or x < self.min:
+      self.min = x
+    if self.max is None or x > self.max:
+      self.max = x
+    self._sample([x])
+
+  # --- add a batch of values   ----------------------------------------------
+
+  def extend(self,values):
+    """ add a batch of values """
+    n = len(values)
+    if not n:
+      return
+    if have_numpy and isinstance(values,numpy.ndarray):
+      mean = float(values.mean())
+      d    = values - mean
+      self.merge(n,mean,float(numpy.dot(d,d)),
+                 values.min().item(),values.max().item())
+    else:
+      mean = float(sum(values))/n
+      m2   = sum((x-mean)*(x-mean) for x in values)
+      self.merge(n,mean,m2,min(values),max(values))
+    self._sample(values)
+
+  # --- merge statistics of a batch   ----------------------------------------
+
+  def merge(self,n,mean,m2,vmin,vmax):
+    """ merge count, mean, sum of squared deviations, min and max of a batch
+        (the reservoir is not updated) """
+    if not n:
+      return
+    total      = self.count + n
+    d          = mean - self.mean
+    self.mean += d*n/total
+    self._m2  += m2 + d*d*self.count*n/total
+    self.count = total
+    if self.min is None or vmin < self.min:
+      self.min = vmin
+    if self.max is None or vmax > self.max:
+      self.max = vmax
+
+  # --- update reservoir   ---------------------------------------------------
+
+  def _sample(self,values):
+    """ update reservoir with the last len(values) values (Algorithm L) """
+    if not self._size:
+      return
+    first = self.count - len(values)         # stream-index of values[0]
+
+    # fill reservoir
+    if len(self._res) < self._size:
+      k = min(len(values),self._size-len(self._res))
+      self._res.extend(values[:k])
+      if len(self._res) < self._size:
+        return
+      self._w    = math.exp(math.log(1.0-random.random())/self._size)
+      self._next = self._size + self._skip()
+
+    # replace random items at geometrically distributed positions
+    while self._next < self.count:
+      self._res[random.randrange(self._size)] = values[self._next-first]
+      self._w   *= math.exp(math.log(1.0-random.random())/self._size)
+      self._next = self._next + 1 + self._skip()
+
+  def _skip(self):
+    """ number of items to skip before the next replacement """
+    if self._w >= 1.0:
+      return 0
+    return int(math.log(1.0-random.random())/math.log(1.0-self._w))
+
+  # --- standard deviation   -------------------------------------------------
+
+  def stdev(self):
+    """ return sample standard-deviation """
+    if self.count < 2:
+      return 0.0
+    return math.sqrt(self._m2/(self.count-1))
+
+  # --- root mean square   ---------------------------------------------------
+
+  def rms(self):
+    """ return root mean square of all values """
+    if not self.count:
+      return 0.0
+    return math.sqrt(self.mean*self.mean + self._m2/self.count)
+
+  # --- percentiles   --------------------------------------------------------
+
+  def percentile(self,p):
+    """ return (estimated) percentile p (0-100), mean without reservoir """
+    if not self._res:
+      return self.mean
+    values = sorted(self._res)
+    return values[min(len(values)-1,int(p*len(values)/100.0))]
+
+  def median(self):
+    """ return (estimated) median """
+    return self.percentile(50)
+
+# --- ring-buffer   ----------------------------------------------------------
+
+class RingBuffer(object):
+  """ Ring-buffer for a fixed number of records with a fixed number of values.
+
+  All records are kept in a single preallocated array of doubles, so the
+  buffer neither grows nor creates objects while it is filled.
+  """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,size,width):
+    """ Constructor """
+
+    self.size   = size
+    self.width  = width
+    self.count  = 0
+    self._pos   = 0
+    self._data  = array.array('d',[0.0])*(size*width)
+
+  # --- add a record   -------------------------------------------------------
+
+  def append(self,values):
+    """ add a record, overwriting the oldest record if the buffer is full """
+
+    if not self.size:
+      return
+    k = self._pos*self.width
+    self._data[k:k+self.width] = array.array('d',values)
+    self._pos   = (self._pos+1) % self.size
+    self.count  = min(self.count+1,self.size)
+
+  # --- iterate records   ----------------------------------------------------
+
+  def items(self):
+    """ return records, oldest first """
+
+    start = (self._pos-self.count) % self.size if self.size else 0
+    for n in range(self.count):
+      k = ((start+n) % self.size)*self.width
+      yield self._data[k:k+self.width]
+
+  # --- clear buffer   -------------------------------------------------------
+
+  def clear(self):
+    """ remove all records """
+
+    self.count = 0
+    self._pos  = 0
+
+# --- capture-file for raw samples   -----------------------------------------
+
+class CaptureWriter(object):
+  """ Append-only binary file with every sample of all channels.
+
+  The file starts with a header (see CAPTURE_HDR_FMT) and a table with one
+  entry per channel (rail, kind, channel and calibration). Data follows in
+  blocks of fixed size: the timestamp of the block (unix-time, double) and
+  block_scans scans of n_chan codes (uint16, little-endian, interleaved).
+  The file is written through a memory-map, which is grown in chunks of
+  CAPTURE_CHUNK bytes and truncated to the used size when closed.
+  """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,fname,channels,block_scans,rate,logger):
+    """ Constructor """
+
+    self.fname   = fname
+    self.blocks  = 0
+    self._logger = logger
+    self._scans  = block_scans
+    self._n_chan = len(channels)
+    self._bsize  = struct.calcsize(CAPTURE_BLK_FMT) + 2*self._n_chan*block_scans
+
+    # channel table
+    table = ""
+    for c in channels:
+      for rail in RAILS:
+        if c in (rail.u_channel,rail.i_channel):
+          kind = 'U' if c == rail.u_channel else 'I'
+          table += struct.pack(CAPTURE_CHN_FMT,rail.name,kind,c,
+                               rail.u_cc_2,rail.conv_value)
+
+    # header, data starts aligned to 16 bytes
+    h_len = struct.calcsize(CAPTURE_HDR_FMT) + len(table)
+    h_len = (h_len+15) & ~15
+    self._offset = h_len
+    self._header = struct.pack(CAPTURE_HDR_FMT,CAPTURE_MAGIC,h_len,ADC,
+                               ADC_VALUES[ADC]['RESOLUTION'],self._n_chan,
+                               block_scans,rate,time.time(),U_RES,U_FAC,0)
+    self._header += table
+
+    logger.msg("INFO", "creating capture-file %s" % fname)
+    self._fd = os.open(fname,os.O_RDWR|os.O_CREAT|os.O_TRUNC,0644)
+    self._size = h_len + CAPTURE_CHUNK
+    os.ftruncate(self._fd,self._size)
+    self._map = mmap.mmap(self._fd,self._size)
+    self._map[0:len(self._header)] = self._header
+
+  # --- write a block   ------------------------------------------------------
+
+  def write(self,ts,scan):
+    """ write a block of codes (one buffer per channel) """
+
+    if self._n_chan == 1:
+      values = scan[0]
+    elif have_numpy and isinstance(scan[0],numpy.ndarray):
+      values = numpy.column_stack(scan).ravel()
+    else:
+      values = [v for codes in zip(*scan) for v in codes]
+    if have_numpy and isinstance(values,numpy.ndarray):
+      data = values.astype('<u2').tostring()
+    else:
+      data = array.array('H',values)
+      if sys.byteorder == 'big':
+        data.byteswap()
+      data = data.tostring()
+
+    # grow file by one chunk if necessary
+    pos = self._offset + self.blocks*self._bsize
+    if pos + self._bsize > self._size:
+      self._size += CAPTURE_CHUNK
+      self._map.resize(self._size)
+
+    self._map[pos:pos+self._bsize] = struct.pack(CAPTURE_BLK_FMT,ts) + data
+    self.blocks += 1
+    self._map[CAPTURE_CNT_POS:CAPTURE_CNT_POS+8] = struct.pack("<Q",
+                                                               self.blocks)
+
+  # --- close file   ---------------------------------------------------------
+
+  def close(self):
+    """ flush data and truncate file to the used size """
+
+    self._map.flush()
+    self._map.close()
+    os.ftruncate(self._fd,self._offset + self.blocks*self._bsize)
+    os.close(self._fd)
+    self._logger.msg("INFO", "capture-file: %d blocks of %d scans" %
+                     (self.blocks,self._scans))
+
+class CaptureReader(object):
+  """ Read-only access to a capture-file (see CaptureWriter) """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,fname):
+    """ Constructor """
+
+    f = open(fname,"rb")
+    self._map = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+    f.close()
+
+    h_size = struct.calcsize(CAPTURE_HDR_FMT)
+    (magic,self.h_len,adc,self.res_bits,self.n_chan,self.block_scans,
+     self.rate,self.ts_start,self.u_res,self.u_fac,
+     self.blocks) = struct.unpack(CAPTURE_HDR_FMT,self._map[0:h_size])
+    if magic != CAPTURE_MAGIC:
+      raise ValueError("%s is not a capture-file" % fname)
+    self.adc = adc.rstrip("\0")
+
+    # channel table: list of (rail,kind,channel,u_cc_2,conv_value)
+    c_size = struct.calcsize(CAPTURE_CHN_FMT)
+    self.channels = []
+    for k in range(self.n_chan):
+      pos = h_size + k*c_size
+      (rail,kind,c,u_cc_2,conv_value) = struct.unpack(CAPTURE_CHN_FMT,
+                                                 self._map[pos:pos+c_size])
+      self.channels.append((rail.rstrip("\0"),kind,c,u_cc_2,conv_value))
+    self.rails = [ch[0] for ch in self.channels if ch[1] == 'U']
+
+    self._t_size = struct.calcsize(CAPTURE_BLK_FMT)
+    self._bsize  = self._t_size + 2*self.n_chan*self.block_scans
+
+  # --- lookup-tables   ------------------------------------------------------
+
+  def get_luts(self,mode):
+    """ return lookup-tables (ADC-code -> value) of all channels """
+
+    codes = range(2**self.res_bits)
+    luts  = []
+    for (rail,kind,c,u_cc_2,conv_value) in self.channels:
+      if mode == 'raw':
+        luts.append(array.array('d',codes))
+      elif kind == 'U':
+        luts.append(array.array('d',[v*self.u_res*self.u_fac for v in codes]))
+      elif mode == 'voltage':
+        luts.append(array.array('d',[v*self.u_res for v in codes]))
+      else:
+        lut = array.array('d')
+        for v in codes:
+          i = max(0.0,(u_cc_2 - v*self.u_res)/conv_value)*I_SCALE
+          lut.append(i if i <= A_MAX*I_SCALE else 0.0)
+        luts.append(lut)
+    return luts
+
+  # --- read a block   -------------------------------------------------------
+
+  def block(self,k):
+    """ return timestamp and codes (interleaved) of block k """
+
+    pos   = self.h_len + k*self._bsize
+    ts,   = struct.unpack(CAPTURE_BLK_FMT,self._map[pos:pos+self._t_size])
+    codes = array.array('H')
+    codes.fromstring(self._map[pos+self._t_size:pos+self._bsize])
+    if sys.byteorder == 'big':
+      codes.byteswap()
+    return (ts,codes)
+
+  # --- numpy-view   ---------------------------------------------------------
+
+  def array(self):
+    """ return all blocks as a numpy-array with fields ts and codes """
+
+    dtype = [('ts','<f8'),('codes','<u2',(self.block_scans*self.n_chan,))]
+    return numpy.frombuffer(self._map,dtype=dtype,count=self.blocks,
+                            offset=self.h_len)
+
+  # --- iterate scans   ------------------------------------------------------
+
+  def scans(self):
+    """ iterate over all scans - yields timestamp and codes of a scan """
+
+    period = 1.0/self.rate if self.rate > 0 else 0.0
+    for k in range(self.blocks):
+      (ts,codes) = self.block(k)
+      for n in range(self.block_scans):
+        yield (ts+n*period,codes[n*self.n_chan:(n+1)*self.n_chan])
+
+  # --- close file   ---------------------------------------------------------
+
+  def close(self):
+    """ close memory-map """
+    self._map.close()
+
+# --- live waveforms   -------------------------------------------------------
+
+class WaveTap(object):
+  """ Decimated raw samples of all channels for live views.
+
+  Every step-th scan is kept (the decimation continues across bursts), so
+  at most WAVE_RATE scans per second are passed to the sink. Scans are
+  buffered and passed as waveform-records with the codes of every channel
+  (uint16, little-endian, one channel after the other).
+  """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,sink,names,rate):
+    """ Constructor - rate is the number of scans per second """
+
+    self.step    = max(1,int(math.ceil(float(rate)/WAVE_RATE)))
+    self.rate    = float(rate)/self.step
+    self._sink   = sink
+    self._names  = names
+    self._offset = 0                        # index of the next kept scan
+    self._ts     = None                     # time of the first buffered scan
+    self._data   = [array.array('H') for _ in names]
+
+  # --- add scans   ----------------------------------------------------------
+
+  def add(self,ts,scan):
+    """ add a burst (or a single scan) with one buffer of codes per channel """
+
+    n = len(scan[0])
+    if self._offset < n:
+      if self._ts is None:
+        self._ts = ts + self._offset/(self.rate*self.step)
+      for buf,codes in zip(self._data,scan):
+        codes = codes[self._offset::self.step]
+        buf.extend(codes.tolist() if hasattr(codes,'tolist') else codes)
+    self._offset = (self._offset-n) % self.step
+    if self._ts is not None and (len(self._data[0]) >= WAVE_BLOCK or
+                                 ts - self._ts >= WAVE_LATENCY):
+      self.flush()
+
+  # --- pass buffered scans   ------------------------------------------------
+
+  def flush(self):
+    """ pass buffered scans to the sink """
+
+    if self._ts is None:
+      return
+    data = array.array('H')
+    for buf in self._data:
+      data.extend(buf)
+    if sys.byteorder == 'big':
+      data.byteswap()
+    self._sink({'type': 'wave', 'ts': self._ts, 'rate': self.rate,
+                'step': self.step, 'names': self._names,
+                'bits': ADC_VALUES[ADC]['RESOLUTION'],
+                'scans': len(self._data[0]), 'data': data.tostring()})
+    self._ts   = None
+    self._data = [array.array('H') for _ in self._names]
+
+# --- monotonic clock   ------------------------------------------------------
+
+try:
+  from time import monotonic_ns
+except ImportError:
+  # python2: use clock_gettime(CLOCK_MONOTONIC) of the C-library
+  class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec',ctypes.c_long),('tv_nsec',ctypes.c_long)]
+
+  try:
+    _clock_gettime = ctypes.CDLL('libc.so.6',use_errno=True).clock_gettime
+  except AttributeError:
+    _clock_gettime = ctypes.CDLL('librt.so.1',use_errno=True).clock_gettime
+  _clock_gettime.argtypes = [ctypes.c_int,ctypes.POINTER(_Timespec)]
+
+  def monotonic_ns():
+    """ return the value of the monotonic clock in nanoseconds """
+    t = _Timespec()
+    if _clock_gettime(1,ctypes.byref(t)) != 0:        # 1: CLOCK_MONOTONIC
+      raise OSError(ctypes.get_errno(),"clock_gettime failed")
+    return t.tv_sec*1000000000 + t.tv_nsec
+
+# --- scheduler for the acquisition   ----------------------------------------
+
+class Scheduler(object):
+  """ Fixed-rate scheduler with absolute deadlines on the monotonic clock.
+
+  Deadlines are multiples of the interval from the first deadline, so
+  delays never accumulate. Changes of the wall-clock (e.g. NTP) do not
+  influence the schedule, the wall-clock is only used for stamp().
+  """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,interval):
+    """ Constructor """
+
+    self._step   = int(round(interval*1000000000))
+    self.count   = 0             # number of intervals
+    self.missed  = 0             # number of missed deadlines
+    self.jitter  = 0.0           # jitter of the current interval (ms)
+    self.jitters = Accumulator()
+
+    # first deadline: next multiple of the interval of the wall-clock
+    wall_ns    = int(time.time()*1000000000)
+    self._next = monotonic_ns() + self._step - wall_ns % self._step
+
+  # --- wait for next deadline   ---------------------------------------------
+
+  def wait(self,stop_event):
+    """ wait for the start of the next window - returns False if stopped """
+
+    # skip deadlines we already missed completely
+    now = monotonic_ns()
+    if now >= self._next + self._step:
+      n = (now - self._next)//self._step
+      self.missed += n
+      self._next  += n*self._step
+
+    # sleep instead of Event.wait(), which polls with a coarse resolution
+    while True:
+      if stop_event.is_set():
+        return False
+      remaining = self._next - monotonic_ns()
+      if remaining <= 0:
+        break
+      time.sleep(min(remaining/1000000000.0,0.1))
+
+    self.jitter  = (monotonic_ns() - self._next)/1000000.0
+    self.jitters.add(self.jitter)
+    self.count  += 1
+    self._next  += self._step
+    return True
+
+  # --- end of current window   ----------------------------------------------
+
+  def deadline(self):
+    """ return end of the current window (monotonic clock, ns) """
+    return self._next
+
+  # --- wall-clock time of the end of the window   ---------------------------
+
+  def stamp(self):
+    """ return the wall-clock time of the end of the current window """
+    return time.time() + (self._next - monotonic_ns())/1000000000.0
+
 # --- initialize SPI-bus   ---------------------------------------------------
 
-def init_spi(simulate):
+def init_spi(options):
   """ initialize SPI bus """
 
-  if not simulate:
+  if options.simulate:
+    spi = None
+  else:
     spi = spidev.SpiDev()
     spi.open(0,0)
-    spi.max_speed_hz = 50000
-    return spi
+    spi.max_speed_hz = SPI_SPEED
+
+  # create burst-reader, a scan reads all channels of all rails
+  if BURST_SIZE > 0:
+    options.burst = BurstReader(spi,options.channels,
+                                get_burst_size(len(options.channels)),
+                                SPI_SPEED,SAMPLE_RATE/WINDOW_FILL,
+                                options.logger,use_numpy=options.use_numpy)
+  else:
+    options.burst = None
+  return spi
+
+def get_burst_size(n_chan):
+  """ return the number of scans of a burst: at most BURST_SIZE, but a
+      burst must fit into the window of an interval (high-resolution) """
+
+  if SAMPLE_RATE > 0:
+    scans = SAMPLE_RATE*INTERVAL*WINDOW_FILL
+  else:
+    # unpaced: a scan takes n_chan frames at the SPI-clock
+    scans = INTERVAL*WINDOW_FILL*SPI_SPEED/(8.0*len(ADC_BYTES[0])*n_chan)
+  return max(1,min(BURST_SIZE,int(scans)))
+
+def get_burst_count(burst):
+  """ return the number of bursts of a window """
+
+  if SAMPLE_RATE > 0:
+    return max(1,int(round(float(SAMPLE_RATE*INTERVAL)/burst.count)))
+  # unpaced: fill the window using the time of a scan
+  return max(1,int(INTERVAL*WINDOW_FILL/(burst.count*burst.scan_sec)))
 
 # --- read SPI-bus   ---------------------------------------------------------
 
-def read_spi(channel,options):
+def read_spi(channel,options,simulate=False):
   """ read a value from the given channel """
 
-  if options.simulate:
+  if simulate or options.simulate:
     now = datetime.datetime.now().strftime("%s")
-    if channel == 0:
-      return int((5 + 0.5*math.sin(float(now)))/(U_RES*U_FAC))
-    else:
-      i = 0.5 + 0.5*math.cos(float(now))
-      return int((U_CC_2 - i*CONV_VALUE)/U_RES)
+    for rail in RAILS:
+      if channel == rail.u_channel:
+        return int((5 + 0.5*math.sin(float(now)))/(U_RES*U_FAC))
+      elif channel == rail.i_channel:
+        i = 0.5 + 0.5*math.cos(float(now))
+        return int((rail.u_cc_2 - i*rail.conv_value)/U_RES)
+    return 0
   else:
     cmd_bytes = list(ADC_BYTES[channel])       # use copy, since
     data = options.spi.xfer(cmd_bytes)         # xfer changes the data
@@ -206,65 +1046,129 @@ def read_spi(channel,options):
                        bin(((data[1]&ADC_MASK) << 8) + data[2]))
     return ((data[1]&ADC_MASK) << 8) + data[2]
 
+# --- layout of round-robin-archives   ---------------------------------------
+
+def get_rra_profile():
+  """ return tiers and consolidation functions of the configured profile """
+
+  if RRD_PROFILE in RRA_PROFILES:
+    profile = RRA_PROFILES[RRD_PROFILE]
+    (tiers,cfs) = (profile['tiers'],profile['cf'])
+  else:
+    (tiers,cfs) = ([],["AVERAGE"])
+  if RRD_TIERS:
+    tiers = [tuple(float(v) for v in t.split(":"))
+                                           for t in RRD_TIERS.split(",")]
+  if RRD_CF:
+    cfs = [cf.strip().upper() for cf in RRD_CF.split(",")]
+  if not "AVERAGE" in cfs:
+    cfs = ["AVERAGE"] + cfs        # needed for summary and graphs
+  return (tiers,cfs)
+
+def get_rra_layout(interval):
+  """ return the smallest list of (steps,rows) of the RRAs which meets the
+      retention of all tiers, steps are in intervals """
+
+  (tiers,cfs) = get_rra_profile()
+  layout = []
+  for res,keep in sorted(tiers):
+    steps = max(1,int(round(res/interval)))
+    rows  = int(math.ceil(keep/(steps*interval)))
+    if steps == 1:
+      # native resolution: limit the number of rows for small intervals
+      rows = min(rows,RRA_MAX_ROWS)
+
+    # skip tiers already covered by a finer tier
+    if [s for s,r in layout if s*r*interval >= keep]:
+      continue
+    if layout and layout[-1][0] == steps:
+      layout[-1] = (steps,max(rows,layout[-1][1]))
+    else:
+      layout.append((steps,rows))
+  return layout
+
 # --- create database   ------------------------------------------------------
 
-def create_db(options):
-  """ create RRD database """
+def create_db(options,interval=INTERVAL,names=None,start="now-10s"):
+  """ create RRD database (default: rails of the configuration) """
 
   # create database with averages, minimums and maximums
   options.logger.msg("INFO", "creating %s" % options.dbfile)
-  rrdtool.create(
-    options.dbfile,
-    "--start", "now",
-    "--step", str(INTERVAL),
-    "DS:U:GAUGE:%d:0:%f" % (2*INTERVAL,U_MAX),              # voltage
-    "DS:I:GAUGE:%d:0:%f" % (2*INTERVAL,I_SCALE*A_MAX),      # current
-    "DS:P:GAUGE:%d:0:%f" % (2*INTERVAL,U_MAX*A_MAX),        # power
-
-    "RRA:AVERAGE:0.5:1s:%dh" % KEEP_SEC,
-    "RRA:AVERAGE:0.5:1m:%dh" % KEEP_MIN,
-    "RRA:AVERAGE:0.5:1h:%dM" % KEEP_HOUR,
-    "RRA:AVERAGE:0.5:1d:%dM" % KEEP_DAY,
-
-    "RRA:MIN:0.5:1s:%dh" % KEEP_SEC,
-    "RRA:MIN:0.5:1m:%dh" % KEEP_MIN,
-    "RRA:MIN:0.5:1h:%dM" % KEEP_HOUR,
-    "RRA:MIN:0.5:1d:%dM" % KEEP_DAY,
-
-    "RRA:MAX:0.5:1s:%dh" % KEEP_SEC,
-    "RRA:MAX:0.5:1m:%dh" % KEEP_MIN,
-    "RRA:MAX:0.5:1h:%dM" % KEEP_HOUR,
-    "RRA:MAX:0.5:1d:%dM" % KEEP_DAY
-    )
+  if names is None:
+    names = [rail.name for rail in RAILS]
+  step = get_rrd_step(interval)
+  args = [
+    "--start", str(start),
+    "--step", str(step)
+    ]
+  for name in names:
+    suffix = "_" + name if name else ""
+    args.extend([
+      "DS:U%s:GAUGE:%d:0:%f" % (suffix,2*step,U_MAX),          # voltage
+      "DS:I%s:GAUGE:%d:0:%f" % (suffix,2*step,I_SCALE*A_MAX),  # current
+      "DS:P%s:GAUGE:%d:0:%f" % (suffix,2*step,U_MAX*A_MAX)     # power
+      ])
+  for cf in get_rra_profile()[1]:
+    for steps,rows in get_rra_layout(interval):
+      args.append("RRA:%s:0.5:%d:%d" % (cf,steps,rows))
+  options.logger.msg("DEBUG", "RRD-definition: %r" % args)
+  rrdtool.create(options.dbfile,*args)
 
   return
 
 # --- convert data   ---------------------------------------------------------
 
-def convert_data(u_raw,ui_raw,voltage=False):
-  """ convert (scale) data """
-
-  global secs, u_max, i_max, p_max, p_sum
+def convert_data(rail,u_raw,ui_raw,voltage=False):
+  """ convert (scale) data of a rail """
 
-  secs += 1
   u = u_raw*U_RES*U_FAC
   if voltage:
     i = ui_raw*U_RES
     p = 0.0                 # not relevant
   else:
-    i = max(0.0,(U_CC_2 - ui_raw*U_RES)/CONV_VALUE)*I_SCALE
+    i = max(0.0,(rail.u_cc_2 - ui_raw*U_RES)/rail.conv_value)*I_SCALE
     if i > A_MAX*I_SCALE:
       # ignore invalid high values
       i = 0
     p = u*i/I_SCALE
 
-  u_max  = max(u_max,u)
-  i_max  = max(i_max,i)
-  p_max  = max(p_max,p)
-  p_sum += p             # N.B: unit is Ws
+  update_totals(rail,u,i,p,p)
+  return (u,i,p)
 
+# --- convert samples   ------------------------------------------------------
+
+def convert_samples(options,luts,u_raw,ui_raw):
+  """ convert buffers of ADC-codes using the lookup-tables (of a rail) -
+      returns buffers (u,i,p) """
+
+  (u_lut,i_lut) = luts
+  if options.use_numpy:
+    u = u_lut.take(u_raw)
+    i = i_lut.take(ui_raw)
+    if options.mode == 'normal':
+      p = u*i/I_SCALE
+    else:
+      p = numpy.zeros(len(u))   # not relevant
+  else:
+    u = map(u_lut.__getitem__,u_raw)
+    i = map(i_lut.__getitem__,ui_raw)
+    if options.mode == 'normal':
+      p = [x*y/I_SCALE for x,y in zip(u,i)]
+    else:
+      p = [0.0]*len(u)          # not relevant
   return (u,i,p)
 
+# --- update maxima and total energy   ---------------------------------------
+
+def update_totals(rail,u_peak,i_peak,p_peak,p):
+  """ update running maxima and total energy of a rail with values of an
+      interval """
+
+  rail.u_max  = max(rail.u_max,u_peak)
+  rail.i_max  = max(rail.i_max,i_peak)
+  rail.p_max  = max(rail.p_max,p_peak)
+  rail.p_sum += p*INTERVAL    # N.B: unit is Ws
+
 # --- convert seconds to hh:mm:ss   ------------------------------------------
 
 def convert_secs(secs):
@@ -275,17 +1179,18 @@ def convert_secs(secs):
 
 # --- display data   ---------------------------------------------------------
 
-def display_data(options,ts,ts_unix,u,i,p):
-  """ display current data """
+def display_data(options,rec):
+  """ display current data (runs in the display-worker) """
 
-  global secs, u_max, i_max, p_max, p_sum
+  (ts,ts_unix,u,i,p) = (rec['ts'],rec['ts_unix'],rec['U'],rec['I'],rec['P'])
+  (u_max,i_max,p_max,p_sum) = (rec['U_max'],rec['I_max'],
+                               rec['P_max'],rec['P_sum'])
+  (h,m,s) = convert_secs(int(rec['secs']))
+  rails   = rec['rails'][1:]   # the LCD only shows the primary rail
 
-  if options.ts_start == 0:
-    # we don't measure yet, so secs is all we have (and should be good enough)
-    (h,m,s) = convert_secs(secs)
-  else:
-    # calculate seconds since start
-    (h,m,s) = convert_secs(ts_unix-options.ts_start)
+  # pass record to the client of the engine
+  if options.sink:
+    options.sink(get_record(rec))
 
   # always try to write to the display
   try:
@@ -304,7 +1209,7 @@ def display_data(options,ts,ts_unix,u,i,p):
     #traceback.format_exc()
     pass
 
-  # check other output-options (silently ignore 'none')
+  # check other output-options (silently ignore 'none' and 'log')
   try:
     if options.out_opt == "term":
       print("\033c")
@@ -312,129 +1217,490 @@ def display_data(options,ts,ts_unix,u,i,p):
       if options.voltage:
         print("|%s|" % LINE1V)
         print("|%s|" % LINE2V.format("now",i,u))
+        for r in rails:
+          print("|%s|" % LINE2V.format("%-3.3s" % r['name'],r['I'],r['U']))
         print("|%s|" % LINE3V.format(i_max,u_max))
         print("|%s|" % LINE4V.format(h,m,s))
       else:
         print("|%s|" % LINE1)
         print("|%s|" % LINE2.format("now",int(i),u,p))
+        for r in rails:
+          print("|%s|" % LINE2.format("%-3.3s" % r['name'],
+                                      int(r['I']),r['U'],r['P']))
         print("|%s|" % LINE3.format(int(i_max),u_max,p_max))
         print("|%s|" % LINE4.format(h,m,s,p_sum/3600.0))
       print(LINE0)
 
-    elif options.out_opt == "log":
-      options.logger.msg("INFO", "%s: %fV, %fmA, %fW" %
-                         (ts.strftime(TIMESTAMP_FMT+".%f"),u,i,p))
-
     elif options.out_opt == "plain":
       if options.raw:
-        sys.stderr.write("%s: U: %8.2f, I: %8.2f\n" %
-                       (ts.strftime(TIMESTAMP_FMT+".%f"),u,i))
+        fmt = "U: %8.2f, I: %8.2f"
       elif options.voltage:
-        sys.stderr.write("%s: U: %6.4fV, I: %6.4fV\n" %
-                       (ts.strftime(TIMESTAMP_FMT+".%f"),u,i))
+        fmt = "U: %6.4fV, I: %6.4fV"
       else:
-        sys.stderr.write("%s: %4.2fV, %6.1fmA, %5.2fW\n" %
-                       (ts.strftime(TIMESTAMP_FMT+".%f"),u,i,p))
+        fmt = "%4.2fV, %6.1fmA, %5.2fW"
+      n   = fmt.count("%")
+      line = "%s: " % ts.strftime(TIMESTAMP_FMT+".%f") + fmt % (u,i,p)[:n]
+      for r in rails:
+        line += (", %s: " % r['name']) + fmt % (r['U'],r['I'],r['P'])[:n]
+      sys.stderr.write(line+"\n")
       sys.stderr.flush()
 
     elif options.out_opt == "json":
-      sys.stdout.write(
-          '{"ts": "%d", "U": "%.2f", "I": "%.1f", "P": "%.2f", ' %
-                         (ts_unix,u,i,p) +
-                       '"U_max": "%.2f", "I_max": "%.1f", "P_max": "%.2f",' %
-                         (u_max,i_max,p_max) +
-                       ' "s_tot": "%02d:%02d:%02d", "P_tot": "%.2f"}\n' %
-                         (h,m,s,p_sum/3600.0 ))
+      sys.stdout.write(json.dumps(get_record(rec),sort_keys=True)+"\n")
       sys.stdout.flush()
   except:
     #traceback.format_exc()
     pass
 
+# --- typed record of an interval   ------------------------------------------
+
+def get_record(rec):
+  """ return the values of an interval-record for clients (json-output
+      and the engine): numbers are rounded, s_tot is formatted """
+
+  (h,m,s) = convert_secs(int(rec['secs']))
+  record  = {'type': 'data', 'ts': rec['ts_unix'],
+             'secs': round(rec['secs'],3),
+             'U': round(rec['U'],2), 'I': round(rec['I'],1),
+             'P': round(rec['P'],2), 'U_max': round(rec['U_max'],2),
+             'I_max': round(rec['I_max'],1), 'P_max': round(rec['P_max'],2),
+             's_tot': "%02d:%02d:%02d" % (h,m,s),
+             'P_tot': round(rec['P_sum']/3600.0,2)}
+  for r in rec['rails'][1:]:
+    for key,digits in [('U',2),('I',1),('P',2)]:
+      record["%s_%s" % (key,r['name'])] = round(r[key],digits)
+    record["P_tot_%s" % r['name']] = round(r['P_sum']/3600.0,2)
+  return record
+
+# --- log data   -------------------------------------------------------------
+
+def log_data(options,rec):
+  """ log statistics and current data (runs in the log-worker) """
+
+  options.logger.msg("DEBUG", "jitter: %.2fms, missed deadlines: %d" %
+                     (rec['jitter'],rec['missed']))
+  for r in rec['rails']:
+    (u_acc,ui_acc) = r['stats']
+    prefix = "%s: " % r['name'] if r['name'] else ""
+    options.logger.msg("DEBUG", prefix+"sample-size: %d" % u_acc['count'])
+    options.logger.msg("DEBUG", prefix+"u_raw   mean: %8.2f" % u_acc['mean'])
+    options.logger.msg("DEBUG", prefix+"i_raw   mean: %8.2f" % ui_acc['mean'])
+    options.logger.msg("DEBUG", prefix+"u_raw median: %5d" % u_acc['median'])
+    options.logger.msg("DEBUG", prefix+"i_raw median: %5d" % ui_acc['median'])
+    options.logger.msg("DEBUG", prefix+"u_raw  sigma: %8.2f" % u_acc['stdev'])
+    options.logger.msg("DEBUG", prefix+"i_raw  sigma: %8.2f" % ui_acc['stdev'])
+    options.logger.msg("TRACE", prefix+"u_raw  range: %d-%d" %
+                       (u_acc['min'],u_acc['max']))
+    options.logger.msg("TRACE", prefix+"i_raw  range: %d-%d" %
+                       (ui_acc['min'],ui_acc['max']))
+    if 'peaks' in r:
+      options.logger.msg("DEBUG", prefix+"peaks (U,I,P): %4.2f,%6.1f,%5.2f" %
+                         tuple(r['peaks']))
+      options.logger.msg("DEBUG", prefix+"I_rms: %6.1f" % r['I_rms'])
+
+  if options.out_opt == "log":
+    for r in rec['rails']:
+      options.logger.msg("INFO", "%s: %s%fV, %fmA, %fW" %
+                         (rec['ts'].strftime(TIMESTAMP_FMT+".%f"),
+                          "%s: " % r['name'] if r['name'] else "",
+                          r['U'],r['I'],r['P']))
+
+# --- options for rrdcached   ------------------------------------------------
+
+def get_daemon_args(options):
+  """ return arguments to route rrdtool-calls through rrdcached """
+  return ["--daemon", options.daemon[0]] if options.daemon[0] else []
+
+def flush_cached(options):
+  """ write pending updates of rrdcached to the database """
+  if options.daemon[0]:
+    rrdtool.flushcached(options.dbfile,*get_daemon_args(options))
+
+# --- save data   ------------------------------------------------------------
+
+def save_data(options,rec):
+  """ update database (runs in the db-worker) - updates are collected and
+      written in batches of BATCH_SIZE intervals """
+
+  rows = rec.get('pre',[]) + [(rec['ts_rrd'],[rec['stamp']] +
+               [v for r in rec['rails'] for v in (r['U'],r['I'],r['P'])])]
+  for ts_rrd,row in rows:
+    options.db_batch.append("%d:%s" % (ts_rrd,":".join("%f" % v
+                                                          for v in row[1:])))
+    options.store_batch.append(row)
+    options.running.add(ts_rrd,row)
+  if len(options.db_batch) >= BATCH_SIZE:
+    flush_data(options)
+
+def flush_data(options):
+  """ write collected updates with a single call (runs in the db-worker) """
+
+  if not options.db_batch:
+    return
+  (updates,rows) = (options.db_batch,options.store_batch)
+  options.db_batch    = []
+  options.store_batch = []
+  options.logger.msg("TRACE", "writing %d updates" % len(updates))
+  if options.store:
+    options.store.append(rows)
+  rrdtool.update(options.dbfile,*(get_daemon_args(options)+updates))
+
+  # checkpoint of the running summary
+  if CHECKPOINT > 0 and options.running.due(CHECKPOINT):
+    options.logger.msg("TRACE", "checkpoint of summary")
+    options.running.write(options.ts_start)
+
+# --- running summary   ------------------------------------------------------
+
+class RunningSummary(object):
+  """ Summary of a session, updated with every interval written to the
+      database (runs in the db-worker) """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,sumfile,names,interval,voltage):
+    """ Constructor """
+
+    self.sumfile  = sumfile
+    self.names    = names
+    self.interval = interval
+    self.voltage  = voltage
+    self.ts_rrd   = None
+    self.accs     = [(Accumulator(),Accumulator(),Accumulator())
+                                                             for _ in names]
+    self.p_sums   = [0.0 for _ in names]
+    self._last    = monotonic_ns()
+
+  # --- add an interval   ----------------------------------------------------
+
+  def add(self,ts_rrd,row):
+    """ add values of an interval, row is (stamp,U,I,P,U_name,...) """
+
+    self.ts_rrd = ts_rrd
+    for k,accs in enumerate(self.accs):
+      for acc,value in zip(accs,row[1+3*k:4+3*k]):
+        acc.add(value)
+      self.p_sums[k] += row[3+3*k]*self.interval    # N.B: unit is Ws
+
+  # --- check for checkpoint   -----------------------------------------------
+
+  def due(self,every):
+    """ check if the last checkpoint is older than every seconds """
+    return monotonic_ns() - self._last >= every*1e9
+
+  # --- create summary   -----------------------------------------------------
+
+  def get(self,ts_start):
+    """ return the summary (same format as sum_data) """
+
+    values = []
+    for (u_acc,i_acc,p_acc),p_sum in zip(self.accs,self.p_sums):
+      values.append(get_rail_summary(u_acc.mean,u_acc.max,
+                                     i_acc.mean,i_acc.max,
+                                     p_acc.mean,p_acc.max,
+                                     p_sum/3600,self.voltage))
+    return get_summary(self.names,values,ts_start,
+                       from_rrd_time(self.ts_rrd,ts_start,self.interval),
+                       self.interval)
+
+  # --- write summary   ------------------------------------------------------
+
+  def write(self,ts_start):
+    """ write summary to the summary-file """
+
+    self._last = monotonic_ns()
+    if self.ts_rrd is None:
+      return False
+    write_summary(self.sumfile,self.get(ts_start))
+    return True
+
+# --- worker-thread for slow sinks   -----------------------------------------
+
+class Worker(object):
+  """ Consumer of interval-records running in a separate thread.
+
+  Records are passed using a bounded queue. With block set, the producer
+  waits up to timeout seconds for a free slot (back-pressure), otherwise
+  records are dropped as soon as the queue is full. Dropped records are
+  counted.
+  """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,name,handler,options,size,block=False,timeout=None,
+               flush=None):
+    """ Constructor """
+
+    self.name     = name
+    self.done     = 0
+    self.dropped  = 0
+    self._handler = handler
+    self._flush   = flush
+    self._options = options
+    self._block   = block
+    self._timeout = timeout
+    self._queue   = Queue.Queue(size)
+    self._thread  = Thread(target=self._run,name=name)
+    self._thread.daemon = True
+    self._thread.start()
+
+  # --- pass a record to the worker   ----------------------------------------
+
+  def put(self,rec):
+    """ queue record - returns False if the record was dropped """
+
+    try:
+      if self._block:
+        self._queue.put(rec,True,self._timeout)
+      else:
+        self._queue.put_nowait(rec)
+      return True
+    except Queue.Full:
+      self.dropped += 1
+      self._options.logger.msg("DEBUG", "%s-worker: queue full, dropped %d" %
+                               (self.name,self.dropped))
+      return False
+
+  # --- processing loop   ----------------------------------------------------
+
+  def _run(self):
+    """ process records until the end-marker (None) is read """
+
+    while True:
+      rec = self._queue.get()
+      if rec is None:
+        break
+      try:
+        self._handler(self._options,rec)
+      except:
+        self._options.logger.msg("ERROR", "%s-worker failed" % self.name)
+        self._options.logger.msg("TRACE", traceback.format_exc())
+      self.done += 1
+
+    # write buffered data
+    if self._flush:
+      try:
+        self._flush(self._options)
+      except:
+        self._options.logger.msg("ERROR", "%s-worker: flush failed" %
+                                 self.name)
+        self._options.logger.msg("TRACE", traceback.format_exc())
+
+  # --- stop worker   --------------------------------------------------------
+
+  def stop(self):
+    """ process pending records and stop the worker """
+
+    self._queue.put(None)
+    self._thread.join()
+    self._options.logger.msg("INFO", "%s-worker: %d records, %d dropped" %
+                             (self.name,self.done,self.dropped))
+
+# --- start workers   --------------------------------------------------------
+
+def start_workers(options):
+  """ create the consumer-threads for display, log and database """
+
+  # running summary, checkpointed by the db-worker
+  options.running = RunningSummary(get_sumfile(options.dbfile),
+                                   [rail.name for rail in RAILS],INTERVAL,
+                                   options.voltage)
+
+  # session-store with full resolution (next to the database)
+  options.db_batch    = []
+  options.store_batch = []
+  if USE_STORE and not options.raw:
+    options.store = vamstore.StoreWriter(
+                      vamstore.get_store_path(options.dbfile),
+                      [ds+rail.suffix for rail in RAILS for ds in "UIP"],
+                      INTERVAL,reset=not options.do_notcreate)
+  else:
+    options.store = None
+
+  options.workers = {
+    'display': Worker('display',display_data,options,DISPLAY_QUEUE),
+    'log':     Worker('log',log_data,options,LOG_QUEUE),
+    'db':      Worker('db',save_data,options,DB_QUEUE,
+                      block=True,timeout=DB_TIMEOUT,flush=flush_data)
+    }
+
+# --- stop workers   ---------------------------------------------------------
+
+def stop_workers(options):
+  """ stop consumer-threads (the db-worker writes all pending records) """
+
+  for worker in options.workers.values():
+    worker.stop()
+
 # --- collect data   ---------------------------------------------------------
 
 def collect_data(options):
-  """ collect data in an endless loop """
+  """ collect data in an endless loop (producer) """
 
-  # glocal accumulators
-  global secs, u_max, i_max, p_max, p_sum
+  # glocal accumulators (maxima and total energy are kept by the rails)
+  global secs
   secs  = 0
-  u_max = 0.0
-  i_max = 0.0
-  p_max = 0.0
-  p_sum = 0.0
+  for rail in RAILS:
+    rail.reset()
+
+  # pre-trigger buffer: timestamp and U,I,P of all rails for every interval
+  options.pretrigger = RingBuffer(int(round(PRETRIGGER/INTERVAL)),
+                                  1+3*len(RAILS))
+
+  # capture-file for all samples
+  if options.capture:
+    options.capwriter = CaptureWriter(
+      os.path.splitext(options.dbfile)[0] + CAPTURE_EXT,options.channels,
+      options.burst.count if options.burst else 1,
+      1/options.burst.scan_sec if options.burst else 0,options.logger)
+
+  # accumulators for raw values of every rail
+  accs = [(Accumulator(RESERVOIR),Accumulator(RESERVOIR)) for rail in RAILS]
+
+  # accumulators for converted samples (burst-mode only)
+  if options.burst:
+    convs = [(Accumulator(),Accumulator(),Accumulator()) for rail in RAILS]
+  else:
+    convs = None
+
+  # fixed number of bursts per window
+  if options.burst:
+    n_bursts = get_burst_count(options.burst)
+    options.logger.msg("DEBUG", "window-size: %d scans" %
+                       (n_bursts*options.burst.count))
 
   # start at (near) full second
-  ms       = datetime.datetime.now().microsecond
-  poll_int = (1000000 - ms)/1000000.0
-  while True:
-    if options.stop_event.wait(poll_int):
-      break
+  options.sched = Scheduler(INTERVAL)
+  while options.sched.wait(options.stop_event):
+    tap = options.wave                  # live waveform (set by the engine)
 
     # reset accumulators
-    u_samp  = []
-    ui_samp = []
-
-    # read timestamp and values of voltage and current from ADC
-    ts      = datetime.datetime.now()
-    ts_save = ts + (
-              datetime.timedelta(seconds=INTERVAL,milliseconds=-10))
+    for group in accs + (convs or []):
+      for acc in group:
+        acc.reset()
 
     # read and save raw values
-    while ts < ts_save:
-      u_samp.append(read_spi(0,options))
-      ui_samp.append(read_spi(1,options))
-      time.sleep(0.01)
-      ts = datetime.datetime.now()
-
-    # save values
-    options.logger.msg("DEBUG", "sample-size: %d" % len(u_samp))
-    if not save_and_display(options,ts,u_samp,ui_samp):
-      # finish data-collection loop
-      os.kill(os.getpid(), signal.SIGINT)
-      return
+    if options.burst:
+      for _ in range(n_bursts):
+        ts_burst = time.time()
+        scan = options.burst.read()
+        if options.capture:
+          options.capwriter.write(ts_burst,scan)
+        if tap:
+          tap.add(ts_burst,scan)
+        for k,(u_acc,ui_acc) in enumerate(accs):
+          (u,ui) = (scan[2*k],scan[2*k+1])
+          u_acc.extend(u)
+          ui_acc.extend(ui)
+          if convs:
+            for acc,values in zip(convs[k],
+                            convert_samples(options,options.luts[k],u,ui)):
+              acc.extend(values)
+    else:
+      ts_save = options.sched.deadline() - SAMPLE_MARGIN
+      while monotonic_ns() < ts_save:
+        ts_scan = time.time()
+        scan    = [read_spi(c,options) for c in options.channels]
+        for k,(u_acc,ui_acc) in enumerate(accs):
+          u_acc.add(scan[2*k])
+          ui_acc.add(scan[2*k+1])
+        if options.capture or tap:
+          scan = [[v] for v in scan]
+          if options.capture:
+            options.capwriter.write(ts_scan,scan)
+          if tap:
+            tap.add(ts_scan,scan)
+        if SAMPLE_PAUSE:
+          time.sleep(SAMPLE_PAUSE)
+
+    # pass values to the workers
+    if not save_and_display(options,options.sched.stamp(),accs,convs):
+      # finish data-collection loop (and notify the owner of the loop)
+      if options.on_stop:
+        options.on_stop()
+      break
 
-    # set poll_int small enough so that we hit the next interval boundry
-    ms = datetime.datetime.now().microsecond
-    poll_int = (INTERVAL - 1 + (1000000 - ms)/1000000.0)/100.0
+  if options.capture:
+    options.capwriter.close()
+  sched = options.sched
+  options.logger.msg("INFO",
+          "scheduler: %d intervals, %d missed, jitter avg/max: %.2f/%.2fms" %
+          (sched.count,sched.missed,sched.jitters.mean,sched.jitters.max or 0))
 
-# --- save and display data   ------------------------------------------------
+# --- statistics of an accumulator   -----------------------------------------
 
-def save_and_display(options,ts,u_samp,ui_samp):
-  """ save and display data - returns False if data-collection should stop  """
-
-  options.logger.msg("TRACE", "sample u_raw: %r" % (u_samp,))
-  options.logger.msg("TRACE", "sample ui_raw: %r" % (ui_samp,))
-
-  # calculate values and log statistics
-  u_raw   = statistics.mean(u_samp)
-  ui_raw  = statistics.mean(ui_samp)
-  options.logger.msg("DEBUG", "u_raw   mean: %8.2f" % u_raw)
-  options.logger.msg("DEBUG", "i_raw   mean: %8.2f" % ui_raw)
-
-  # since calculation of statistics is expensive, check level
-  if options.level == "TRACE":
-    options.logger.msg("TRACE", "u_raw median: %5d" %
-                              statistics.median(u_samp))
-    options.logger.msg("TRACE", "i_raw median: %5d" %
-                              statistics.median(ui_samp))
-    options.logger.msg("TRACE", "u_raw  sigma: %8.2f" %
-                              statistics.stdev(u_samp,u_raw))
-    options.logger.msg("TRACE", "i_raw  sigma: %8.2f" %
-                              statistics.stdev(ui_samp,ui_raw))
+def get_stats(acc):
+  """ return statistics of an accumulator as a dict """
+
+  return {'count': acc.count, 'mean': acc.mean, 'median': acc.median(),
+          'stdev': acc.stdev(), 'min': acc.min or 0, 'max': acc.max or 0}
+
+# --- convert data of a rail   -----------------------------------------------
+
+def get_rail_data(options,rail,u_acc,ui_acc,conv=None):
+  """ convert data of a rail - returns a dict with values of the interval """
 
   # convert values
-  ts_unix = int(round((ts-DT_UNIX_0).total_seconds()))  # datetime->unixtime
-  if options.raw:
+  u_raw   = u_acc.mean
+  ui_raw  = ui_acc.mean
+  peaks = None
+  if conv:
+    # per-sample conversion: true mean power, rms and peak values
+    (U,I,P) = [acc.mean for acc in conv]
+    peaks   = [acc.max for acc in conv]
+    update_totals(rail,peaks[0],peaks[1],peaks[2],P)
+  elif options.raw:
     (U,I,P) = (u_raw,ui_raw,0)
   elif options.voltage:
-    (U,I,P) = convert_data(u_raw,ui_raw,voltage=True)
-    options.logger.msg("TRACE", "voltage data (U,I): %4.2f,%4.2f" % (U,I))
+    (U,I,P) = convert_data(rail,u_raw,ui_raw,voltage=True)
   else:
-    (U,I,P) = convert_data(u_raw,ui_raw)
-    options.logger.msg("TRACE", "converted data (U,I,P): %4.2f,%6.1f,%5.2f" % (U,I,P))
+    (U,I,P) = convert_data(rail,u_raw,ui_raw)
+
+  # create record (a snapshot, the workers must not use the rail)
+  data = {'name': rail.name, 'U': U, 'I': I, 'P': P,
+          'U_max': rail.u_max, 'I_max': rail.i_max, 'P_max': rail.p_max,
+          'P_sum': rail.p_sum,
+          'stats': (get_stats(u_acc),get_stats(ui_acc))}
+  if peaks:
+    data['peaks'] = peaks
+    data['I_rms'] = conv[1].rms()
+  return data
 
-  # show current data
-  display_data(options,ts,ts_unix,U,I,P)
+# --- save and display data   ------------------------------------------------
+
+def save_and_display(options,stamp,accs,convs=None):
+  """ convert data and pass it to the workers for display and storage -
+      returns False if data-collection should stop  """
+
+  global secs
+
+  ts      = datetime.datetime.fromtimestamp(stamp)
+  ts_unix = int(round(stamp))
+  secs   += 1
+
+  # convert values of all rails
+  rails = []
+  for k,rail in enumerate(RAILS):
+    (u_acc,ui_acc) = accs[k]
+    rails.append(get_rail_data(options,rail,u_acc,ui_acc,
+                               convs[k] if convs else None))
+
+  # create record, values of the primary rail are also on the top-level
+  if options.ts_start == 0:
+    # we don't measure yet, so secs is all we have (and should be good enough)
+    elapsed = secs*INTERVAL
+  else:
+    elapsed = stamp-options.ts_start
+  rec = dict(rails[0])
+  rec.update({'ts': ts, 'ts_unix': ts_unix, 'stamp': stamp,
+              'secs': elapsed, 'rails': rails,
+              'jitter': options.sched.jitter, 'missed': options.sched.missed})
+  (U,I) = (rec['U'],rec['I'])
+
+  # show current data (the display is updated at most once per second)
+  options.workers['log'].put(rec)
+  if secs % DISPLAY_EVERY == 0:
+    options.workers['display'].put(rec)
 
   # if U is too low, the module isn't powered yet or not anymore
   if not options.raw and U < U_MIN:
@@ -452,15 +1718,47 @@ def save_and_display(options,ts,u_samp,ui_samp):
   if I >= options.limit:
     if options.limit > 0:
       options.limit = 0  # once above the limit, record everything
-    if not options.raw:
-      rrdtool.update(options.dbfile,"%d:%f:%f:%f" % (ts_unix,U,I,P))
 
     # save start timestamp, since rrdtool does not record it
     if options.ts_start == 0:
       options.logger.msg("INFO", "starting to update DB")
-      options.ts_start = ts_unix
+      options.logger.msg("INFO", "pre-trigger intervals: %d" %
+                         options.pretrigger.count)
+      start_trigger(options,rec,stamp)
+
+    # timestamps for the database must increase, even if the clock is set back
+    rec['ts_rrd'] = max(to_rrd_time(stamp,options.ts_start,INTERVAL),
+                        options.ts_last+get_rrd_step(INTERVAL))
+    options.ts_last = rec['ts_rrd']
+    if not options.raw:
+      options.workers['db'].put(rec)
+  elif not options.raw:
+    # keep intervals below the limit to record the ramp-up
+    options.pretrigger.append([stamp] +
+                [v for r in rails for v in (r['U'],r['I'],r['P'])])
   return True
 
+# --- start recording   ------------------------------------------------------
+
+def start_trigger(options,rec,stamp):
+  """ set start timestamp and pass the pre-trigger buffer with the record """
+
+  # start of the measurement is the start of the pre-trigger buffer
+  buffered = list(options.pretrigger.items())
+  if buffered:
+    stamp = buffered[0][0]
+  options.ts_start = int(stamp) if INTERVAL < 1 else int(round(stamp))
+
+  # back-dated updates (timestamp of the database and values with the
+  # real timestamp), written by the db-worker within a single update
+  rec['pre'] = []
+  for values in buffered:
+    ts_rrd = max(to_rrd_time(values[0],options.ts_start,INTERVAL),
+                 options.ts_last+get_rrd_step(INTERVAL))
+    options.ts_last = ts_rrd
+    rec['pre'].append((ts_rrd,values.tolist()))
+  options.pretrigger.clear()
+
 # --- collect data   ---------------------------------------------------------
 
 def get_data(options):
@@ -470,9 +1768,11 @@ def get_data(options):
   signal.signal(signal.SIGTERM,signal_handler)
   signal.signal(signal.SIGINT,signal_handler)
 
-  # create and start collector-thread
+  # create and start consumer-threads and the collector-thread
   options.stop_event  = Event()
-  options.spi = init_spi(options.simulate)
+  options.on_stop     = lambda: os.kill(os.getpid(),signal.SIGINT)
+  options.spi = init_spi(options)
+  start_workers(options)
   data_thread = Thread(target=collect_data,args=(options,))
   options.logger.msg("INFO", "starting data-collection")
   data_thread.start()
@@ -480,50 +1780,348 @@ def get_data(options):
   # wait for signal
   signal.pause()
 
-  # stop data-collection
+  # stop data-collection, then write pending data
   options.logger.msg("INFO", "terminating data-collection")
   options.stop_event.set()
   data_thread.join()
+  finish_data(options)
+
+def finish_data(options):
+  """ stop the workers, write pending data and the final summary """
+
+  stop_workers(options)
+  if options.store:
+    options.store.close()
+
+  # final summary (written after the database, so it is current)
+  if not options.raw:
+    flush_cached(options)
+    if options.running.write(options.ts_start):
+      options.logger.msg("INFO", "summary-file: %s" % options.running.sumfile)
+
+# --- in-process data-collection   -------------------------------------------
+
+class Engine(object):
+  """ Data-collection for other programs (e.g. the web-server).
+
+  collect_data runs in a thread of the calling process, the workers are
+  the same as for the commandline. The client reads typed records from a
+  bounded queue: data-records (see get_record) at the rate of the display
+  and state-records (see status) whenever a run starts or ends. If the
+  client is too slow, the oldest records are dropped. While the client
+  watches (see watch), waveform-records (see WaveTap) are added, but
+  only if the queue has space left.
+  """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,size=ENGINE_QUEUE):
+    """ Constructor """
+
+    self.run      = 0               # number of the current (or last) run
+    self.state    = "idle"          # idle, running, stopped or failed
+    self.error    = None
+    self.watching = False
+    self._options = None
+    self._thread  = None
+    self._lock    = Lock()
+    self._queue   = Queue.Queue(size)
+
+  # --- start data-collection   ----------------------------------------------
+
+  def start(self,dbfile=None,args=[]):
+    """ start a run, args are additional commandline-options
+        (e.g. ["-D",directory]) - returns the number of the run """
+
+    with self._lock:
+      if self.state == "running":
+        raise RuntimeError("data collection is already running")
+      argv = ["-O","none","-r"] + list(args) + ([dbfile] if dbfile else [])
+      try:
+        options = get_parser().parse_args(argv,namespace=Options())
+        check_options(options)
+      except SystemExit:
+        raise ValueError("invalid options: %r" % argv)
+
+      query_output_opts(options)
+      if not options.do_notcreate:
+        create_db(options)
+      options.sink       = self._put
+      options.stop_event = Event()
+      options.spi        = init_spi(options)
+      options.wave       = self._get_tap(options)
+      start_workers(options)
+
+      self.run     += 1
+      self.state    = "running"
+      self.error    = None
+      self._options = options
+      self._put(self._get_state())
+      self._thread = Thread(target=self._run,args=(options,),name="engine")
+      self._thread.daemon = True
+      self._thread.start()
+      return self.run
+
+  # --- collector-thread   ---------------------------------------------------
+
+  def _run(self,options):
+    """ collect data until stopped, then write pending data """
+
+    try:
+      options.logger.msg("INFO", "starting data-collection")
+      collect_data(options)
+      options.logger.msg("INFO", "terminating data-collection")
+      finish_data(options)
+      (state,error) = ("stopped",None)
+    except:
+      error = traceback.format_exc()
+      state = "failed"
+      options.logger.msg("ERROR", "data-collection failed")
+      options.logger.msg("TRACE", error)
+
+    with self._lock:
+      (self.state,self.error) = (state,error)
+      record = self._get_state()
+    self._put(record)
+
+  # --- stop data-collection   -----------------------------------------------
+
+  def stop(self,timeout=None):
+    """ stop the current run and wait until all data is written -
+        returns the state """
+
+    thread = self._thread
+    if thread:
+      self._options.stop_event.set()
+      thread.join(timeout)
+    return self.status()
+
+  # --- live waveforms   -----------------------------------------------------
+
+  def watch(self,enable=True):
+    """ enable or disable waveform-records """
+
+    with self._lock:
+      self.watching = enable
+      if self.state == "running":
+        self._options.wave = self._get_tap(self._options)
+
+  def _get_tap(self,options):
+    """ return a WaveTap for a run (or None if nobody watches) """
+
+    if not self.watching:
+      return None
+    if options.burst:
+      rate = 1/options.burst.scan_sec          # scans/s during a burst
+    elif SAMPLE_PAUSE:
+      rate = 1/SAMPLE_PAUSE                    # single reads with a pause
+    else:
+      rate = WAVE_RATE                         # as fast as possible
+    return WaveTap(self._put_wave,
+                   [kind+rail.suffix for rail in RAILS for kind in "UI"],rate)
+
+  # --- state of the engine   ------------------------------------------------
+
+  def status(self):
+    """ return state and statistics of the current (or last) run """
+
+    with self._lock:
+      return self._get_state()
+
+  def _get_state(self):
+    """ return the state-record (the caller holds the lock) """
+
+    record  = {'type': 'state', 'state': self.state, 'run': self.run,
+               'error': self.error}
+    options = self._options
+    if not options:
+      return record
+    record.update({'dbfile': options.dbfile,
+                   'name': os.path.splitext(os.path.basename(
+                                                      options.dbfile))[0],
+                   'ts_start': options.ts_start,
+                   'dropped': dict((name,worker.dropped)
+                                   for name,worker in options.workers.items())})
+    if hasattr(options,'sched'):
+      record.update({'intervals': options.sched.count,
+                     'missed': options.sched.missed})
+    if (self.state != "running" and not options.raw and
+        options.running.ts_rrd is not None):
+      record['summary'] = options.running.get(options.ts_start)
+    return record
+
+  # --- records   ------------------------------------------------------------
+
+  def get(self,timeout=None):
+    """ return the next record (None after timeout seconds) """
+
+    try:
+      return self._queue.get(True,timeout)
+    except Queue.Empty:
+      return None
+
+  def _put(self,record):
+    """ queue a record, drop the oldest record if the queue is full """
+
+    while True:
+      try:
+        self._queue.put_nowait(record)
+        return
+      except Queue.Full:
+        try:
+          self._queue.get_nowait()
+        except Queue.Empty:
+          pass
+
+  def _put_wave(self,record):
+    """ queue a waveform-record if the queue has space left """
+
+    try:
+      self._queue.put_nowait(record)
+    except Queue.Full:
+      pass
+
+# --- engine in a separate process   -----------------------------------------
+
+class EngineProcess(object):
+  """ Engine running in a child-process, with the same start, stop, status,
+      watch and get methods. Commands and records are passed through pipes.
+
+  Servers based on gevent must create the process before monkey-patching
+  the standard-library (the engine needs real threads) and set wait to a
+  function waiting cooperatively for a readable file-descriptor.
+  """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,wait=None):
+    """ Constructor - starts the child-process """
+
+    self.wait = wait
+    (self._cmd,cmd)             = multiprocessing.Pipe()
+    (self._records,records)     = multiprocessing.Pipe(False)
+    self._process = multiprocessing.Process(target=serve_engine,
+                                            args=(cmd,records),
+                                            name="vameter-engine")
+    self._process.daemon = True
+    self._process.start()
+    cmd.close()
+    records.close()
+
+  # --- commands   -----------------------------------------------------------
+
+  def _call(self,name,*args):
+    """ execute a command of the engine - raises its exception """
+
+    self._cmd.send((name,args))
+    if self.wait:
+      self.wait(self._cmd.fileno())
+    (ok,result) = self._cmd.recv()
+    if not ok:
+      raise result
+    return result
+
+  def start(self,dbfile=None,args=[]):
+    """ start a run - returns the number of the run """
+    return self._call('start',dbfile,args)
+
+  def stop(self):
+    """ stop the current run - returns the state """
+    return self._call('stop')
+
+  def status(self):
+    """ return the state of the engine """
+    return self._call('status')
+
+  def watch(self,enable=True):
+    """ enable or disable waveform-records """
+    return self._call('watch',enable)
+
+  # --- records   ------------------------------------------------------------
+
+  def get(self):
+    """ return the next record - raises EOFError if the engine ended """
+
+    if self.wait:
+      self.wait(self._records.fileno())
+    return self._records.recv()
+
+def serve_engine(cmd,records):
+  """ run an engine and execute its commands (runs in the child-process) """
+
+  # terminate like the commandline (stop, then write pending data)
+  def terminate(_signo,_stack_frame):
+    raise SystemExit(0)
+  signal.signal(signal.SIGTERM,terminate)
+  signal.signal(signal.SIGINT,terminate)
+
+  engine = Engine()
+  def forward():
+    while True:
+      records.send(engine.get())
+  thread = Thread(target=forward,name="records")
+  thread.daemon = True
+  thread.start()
+
+  try:
+    while True:
+      try:
+        (name,args) = cmd.recv()
+      except EOFError:
+        break                                      # parent has terminated
+      try:
+        if not name in ['start','stop','status','watch']:
+          raise ValueError("unknown command %s" % name)
+        cmd.send((True,getattr(engine,name)(*args)))
+      except Exception as e:
+        cmd.send((False,e))
+  finally:
+    engine.stop()
 
 # --- fetch data   -----------------------------------------------------------
 
 def fetch_data(options):
-  """ fetch data and delete NaNs """
+  """ fetch data of the selected time-range (options.start, options.end)
+      and resolution - returns titles and a generator for the rows """
 
-  first = options.summary["ts_start"]
-  last  = options.summary["ts_end"]
-
-  time_span, titles, values = rrdtool.fetch(options.dbfile,"AVERAGE",
-                                            "--start", str(first),
-                                            "--end", str(last),
-                                            "--resolution", "1")
-  # extract valid values
-  ts_start, ts_end, ts_res = time_span
-  times = range(ts_start, ts_end, ts_res)
-  result = zip(times, values)
-  return titles, [v for v in result if v[1] != (None,None,None)]
+  flush_cached(options)
+  return vamdata.fetch_session(options.dbfile,options.summary,
+                               options.start,options.end,options.resolution,
+                               get_daemon_args(options))
 
 # --- summarize data   -------------------------------------------------------
 
-def sum_data(options):
-  """ summarize collected data """
+def sum_data(options,force=False):
+  """ summarize collected data (the summary is only created if it is
+      missing or older than the database, unless force is set) """
 
   # check if summary-file exists and is newer than database
-  sumfile = os.path.splitext(options.dbfile)[0] + ".summary"
-  if os.path.exists(sumfile) and (
-    os.path.getmtime(options.dbfile) <= os.path.getmtime(sumfile)):
-    # summary is current
+  sumfile  = get_sumfile(options.dbfile)
+  interval = options.interval
+  result   = {}
+  if os.path.exists(sumfile):
     f = open(sumfile,"r")
     result = json.load(f)
     f.close()
-    return result
-  else:
-    options.logger.msg("INFO", "creating summary-file: %s" % sumfile)
+    if (not force and
+        os.path.getmtime(options.dbfile) <= os.path.getmtime(sumfile)):
+      # summary is current
+      return result
+    interval = result.get("interval",1)
+  if not options.do_run and interval != options.interval:
+    options.logger.msg("WARN", "using interval %r of the old summary" %
+                       interval)
+  options.logger.msg("INFO", "creating summary-file: %s" % sumfile)
 
   # create summary
   try:
+    flush_cached(options)
     if options.ts_start > 0:
       first = options.ts_start
+    elif "ts_start" in result:
+      # checkpoint of an interrupted session
+      first = result["ts_start"]
+      options.logger.msg("INFO", "using start of the old summary: %r" % first)
     else:
       # either no data was collected or the summary file was deleted
       options.logger.msg("WARN", "trying to recreate start timepoint")
@@ -535,58 +2133,121 @@ def sum_data(options):
     options.logger.msg("ERROR", "no data in database: %s" % options.dbfile)
     sys.exit(3)
 
-  # extract avg and max values
-  I_def = "DEF:I=%s:I:AVERAGE" %  options.dbfile
-  I_avg = "VDEF:I_avg=I,AVERAGE"
-  I_max = "VDEF:I_max=I,MAXIMUM"
+  # extract avg and max values of all rails
+  step  = get_rrd_step(interval)
+  first = to_rrd_time(first,first,interval)
+  args = ["rrdtool", "graphv",options.dbfile,
+          "--start", str(first),
+          "--end",   str(last)]
+  rails = get_db_rails(options.dbfile)
+  for name in rails:
+    for ds in ["I","U","P"]:
+      ds += "_" + name if name else ""
+      args.extend([
+        "DEF:%s=%s:%s:AVERAGE" % (ds,options.dbfile,ds),
+        "VDEF:%s_avg=%s,AVERAGE" % (ds,ds),
+        "VDEF:%s_max=%s,MAXIMUM" % (ds,ds)
+        ])
+  for name in rails:
+    suffix = "_" + name if name else ""
+    args.extend([
+      "PRINT:I%s_avg:%%8.4lf" % suffix,
+      "PRINT:I%s_max:%%8.4lf" % suffix,
+      "PRINT:U%s_avg:%%8.4lf" % suffix,
+      "PRINT:U%s_max:%%8.4lf" % suffix,
+      "PRINT:P%s_avg:%%6.2lf" % suffix,
+      "PRINT:P%s_max:%%6.2lf" % suffix
+      ])
+  info = rrdtool.graphv(options.dbfile,args[3:]+get_daemon_args(options))
+  duration = ((last-first)//step+1)*interval
+
+  values = []
+  for k in range(len(rails)):
+    v = lambda n: float(info['print[%d]' % (6*k+n)])
+    values.append(get_rail_summary(v(2),v(3),v(0),v(1),v(4),v(5),
+                                   duration*v(4)/3600,options.voltage))
+
+  summary = get_summary(rails,values,first,
+                        from_rrd_time(last,first,interval),interval)
+  write_summary(sumfile,summary)
+  return summary
 
-  U_def = "DEF:U=%s:U:AVERAGE" %  options.dbfile
-  U_avg = "VDEF:U_avg=U,AVERAGE"
-  U_max = "VDEF:U_max=U,MAXIMUM"
+# --- recreate summary   -----------------------------------------------------
 
-  P_def = "DEF:P=%s:P:AVERAGE" %  options.dbfile
-  P_avg = "VDEF:P_avg=P,AVERAGE"
-  P_max = "VDEF:P_max=P,MAXIMUM"
+def rebuild_summary(dbfile,args=[]):
+  """ create the summary of a database again (for other programs, e.g. the
+      web-server) - returns the summary, raises ValueError for invalid
+      options or databases without data """
 
-  args = ["rrdtool", "graphv",options.dbfile,
-          "--start", str(first),
-          "--end",   str(last),
-          I_def, I_avg, I_max,
-          U_def, U_avg, U_max,
-          P_def, P_avg, P_max,
-          "PRINT:I_avg:%8.4lf",
-          "PRINT:I_max:%8.4lf",
-          "PRINT:U_avg:%8.4lf",
-          "PRINT:U_max:%8.4lf",
-          "PRINT:P_avg:%6.2lf",
-          "PRINT:P_max:%6.2lf"
-         ]
-  info = rrdtool.graphv(options.dbfile,args[3:])
-  summary = {
-    "ts_start": first,
-    "ts_end":   last,
-    "U_avg": float(info['print[2]']),
-    "U_max": float(info['print[3]']),
-    "P_avg": float(info['print[4]']),
-    "P_max": float(info['print[5]']),
-    "P_tot": round((last-first+1)*float(info['print[4]'])/3600,2)
+  argv = ["-S","-l","ERROR"] + list(args) + [dbfile]
+  try:
+    options = get_parser().parse_args(argv,namespace=Options())
+    check_options(options)
+    return sum_data(options,force=True)
+  except SystemExit:
+    raise ValueError("cannot summarize %s" % dbfile)
+
+# --- summary of a rail   ----------------------------------------------------
+
+def get_rail_summary(u_avg,u_max,i_avg,i_max,p_avg,p_max,p_tot,voltage):
+  """ return summary of a rail as a dict (p_tot in Wh, values are rounded
+      like the output of rrdtool) """
+
+  rail = {
+    "U_avg": round(u_avg,4),
+    "U_max": round(u_max,4),
+    "P_avg": round(p_avg,2),
+    "P_max": round(p_max,2),
+    "P_tot": round(p_tot,2)
     }
   try:
-    if options.voltage:
-      summary["I_avg"] = float(info['print[0]'])
-      summary["I_max"] = float(info['print[1]'])
+    if voltage:
+      rail["I_avg"] = round(i_avg,4)
+      rail["I_max"] = round(i_max,4)
     else:
-      summary["I_avg"] = int(float(info['print[0]']))
-      summary["I_max"] = int(float(info['print[1]']))
+      rail["I_avg"] = int(i_avg)
+      rail["I_max"] = int(i_max)
   except:
     pass
+  return rail
+
+# --- summary of all rails   -------------------------------------------------
+
+def get_summary(names,values,ts_start,ts_end,interval):
+  """ return summary, values of the primary rail are on the top-level """
+
+  summary = values[0]
+  summary.update({
+    "ts_start": ts_start,
+    "ts_end":   ts_end,
+    "interval": interval
+    })
+  if len(names) > 1:
+    summary["rails"] = dict(zip(names[1:],values[1:]))
+  return summary
+
+# --- write summary   --------------------------------------------------------
+
+def get_sumfile(dbfile):
+  """ return name of the summary-file of a database """
+  return os.path.splitext(dbfile)[0] + ".summary"
+
+def write_summary(sumfile,summary):
+  """ write summary atomically (readers never see a partial file) """
 
-  # write results to file
-  f = open(sumfile,"w")
+  tmpfile = sumfile + ".tmp"
+  f = open(tmpfile,"w")
   json.dump(summary,f,indent=2,sort_keys=True)
+  f.flush()
+  os.fsync(f.fileno())
   f.close()
+  os.rename(tmpfile,sumfile)
 
-  return summary
+  # the web-server's catalog is updated without waiting for the next sync
+  try:
+    vamcatalog.update_session(sumfile,summary)
+  except Exception:
+    pass
 
 # --- print summary   --------------------------------------------------------
 
@@ -600,8 +2261,10 @@ def print_summary(options):
   u_max = options.summary["U_max"]
   p_max = options.summary["P_max"]
   p_tot = options.summary["P_tot"]
-  secs  = options.summary["ts_end"]-options.summary["ts_start"]+1
-  (h,m,s) = convert_secs(secs)
+  secs  = (options.summary["ts_end"]-options.summary["ts_start"]+
+                                      options.summary.get("interval",1))
+  (h,m,s) = convert_secs(int(round(secs)))
+  rails   = sorted(options.summary.get("rails",{}).items())
 
   try:
     if options.have_disp:
@@ -625,22 +2288,32 @@ def print_summary(options):
       if options.voltage:
         print("|%s|" % LINE1V)
         print("|%s|" % LINE2V.format("avg",i_avg,u_avg,p_avg))
+        for name,r in rails:
+          print("|%s|" % LINE2V.format("%-3.3s" % name,r["I_avg"],r["U_avg"]))
         print("|%s|" % LINE3V.format(i_max,u_max,p_max))
         print("|%s|" % LINE4V.format(h,m,s))
       else:
         print("|%s|" % LINE1)
         print("|%s|" % LINE2.format("avg",i_avg,u_avg,p_avg))
+        for name,r in rails:
+          print("|%s|" % LINE2.format("%-3.3s" % name,
+                                      r["I_avg"],r["U_avg"],r["P_avg"]))
         print("|%s|" % LINE3.format(i_max,u_max,p_max))
         print("|%s|" % LINE4.format(h,m,s,p_tot))
       print(LINE0)
     elif options.out_opt == "json":
-      sys.stdout.write(
-        '{"U_avg": "%.2f", "I_avg": "%.1f", "P_avg": "%.2f", ' %
+      line = ('{"U_avg": "%.2f", "I_avg": "%.1f", "P_avg": "%.2f", ' %
                        (u_avg,i_avg,p_avg) +
-                     '"U_max": "%.2f", "I_max": "%.1f", "P_max": "%.2f"}' %
+              '"U_max": "%.2f", "I_max": "%.1f", "P_max": "%.2f", ' %
                        (u_max,i_max,p_max) +
-                     '"tot": "%02d:%02d:%02d", "P_tot": "%.2f"}\n' %
+              '"tot": "%02d:%02d:%02d", "P_tot": "%.2f"' %
                        (h,m,s,p_tot))
+      for name,r in rails:
+        line += (', "U_avg_%s": "%.2f", "I_avg_%s": "%.1f"' %
+                   (name,r["U_avg"],name,r["I_avg"]) +
+                 ', "P_avg_%s": "%.2f", "P_tot_%s": "%.2f"' %
+                   (name,r["P_avg"],name,r["P_tot"]))
+      sys.stdout.write(line+"}\n")
       sys.stdout.flush()
   except:
     #traceback.format_exc()
@@ -651,84 +2324,214 @@ def print_summary(options):
 def print_data(options):
   """ print collected data """
 
+  if options.capfile:
+    print_capture(options)
+    return
+
   result_title,result_data = fetch_data(options)
 
-  for ts,(u,i,p) in result_data:
-    ts = datetime.datetime.fromtimestamp(ts).strftime(TIMESTAMP_FMT)
-    u = 0 if not u else u
-    i = 0 if not i else i
-    p = 0 if not p else p
+  # show milliseconds for high-resolution data
+  if options.summary.get("interval",1) < 1:
+    fmt,cut = TIMESTAMP_FMT+".%f",3
+  else:
+    fmt,cut = TIMESTAMP_FMT,0
+  for ts,values in result_data:
+    ts = datetime.datetime.fromtimestamp(round(ts,cut)).strftime(fmt)
+    if cut:
+      ts = ts[:-cut]
+    values = [v or 0 for v in values]
     try:
-      if options.voltage:
-        print("%s: U=%6.4fV, UI=%6.4fV" % (ts,u,i))
-      else:
-        print("%s: %s=%4.2fV, %s=%4.0fmA, %s=%4.2fW" %
-              (ts, result_title[0],u, result_title[1],i, result_title[2],p))
+      line = []
+      for k in range(0,len(values),3):
+        (u,i,p) = values[k:k+3]
+        if options.voltage:
+          line.append("%s=%6.4fV, %s=%6.4fV" %
+                      (result_title[k],u,result_title[k+1].replace("I","UI"),i))
+        else:
+          line.append("%s=%4.2fV, %s=%4.0fmA, %s=%4.2fW" %
+                      (result_title[k],u, result_title[k+1],i,
+                       result_title[k+2],p))
+      print("%s: %s" % (ts,", ".join(line)))
     except:
       #traceback.format_exc()
       pass
 
+# --- print capture-file   ---------------------------------------------------
+
+def print_capture(options):
+  """ print all samples of a capture-file """
+
+  cap  = CaptureReader(options.capfile)
+  luts = cap.get_luts(options.mode)
+  options.logger.msg("INFO", "capture-file: %s, %d blocks of %d scans" %
+                     (cap.adc,cap.blocks,cap.block_scans))
+  for ts,codes in cap.scans():
+    ts = datetime.datetime.fromtimestamp(ts).strftime(TIMESTAMP_FMT+".%f")
+    line = []
+    for k,name in enumerate(cap.rails):
+      suffix = "_" + name if name else ""
+      u = luts[2*k][codes[2*k]]
+      i = luts[2*k+1][codes[2*k+1]]
+      if options.raw:
+        line.append("U%s=%d, I%s=%d" % (suffix,u,suffix,i))
+      elif options.voltage:
+        line.append("U%s=%6.4fV, UI%s=%6.4fV" % (suffix,u,suffix,i))
+      else:
+        line.append("U%s=%4.2fV, I%s=%4.0fmA, P%s=%4.2fW" %
+                    (suffix,u,suffix,i,suffix,u*i/I_SCALE))
+    try:
+      print("%s: %s" % (ts,", ".join(line)))
+    except:
+      #traceback.format_exc()
+      break
+  cap.close()
+
+# --- convert capture-file to a database   -----------------------------------
+
+def capture_to_rrd(options):
+  """ create a database with averages of a capture-file (for graphs and
+      the summary) - replaces options.dbfile """
+
+  cap = CaptureReader(options.capfile)
+  if not cap.blocks:
+    options.logger.msg("ERROR", "no data in capture-file: %s" % options.capfile)
+    sys.exit(3)
+  luts   = cap.get_luts('voltage' if options.voltage else 'normal')
+  period = 1.0/cap.rate if cap.rate > 0 else 0.0
+  ts0    = cap.ts_start
+
+  # interval for a limited number of points
+  duration = cap.block(cap.blocks-1)[0] + cap.block_scans*period - ts0
+  interval = max(duration/CAPTURE_POINTS,0.001)
+  if interval >= 1:
+    interval = int(round(interval))
+  else:
+    interval = 1.0/round(1.0/interval)
+
+  # sums and counts of U,I,P of all rails per interval
+  n_rails = len(cap.rails)
+  if options.use_numpy:
+    blocks = cap.array()
+    times  = (blocks['ts'][:,None] +
+              period*numpy.arange(cap.block_scans)[None,:]).ravel()
+    codes  = blocks['codes'].reshape(-1,cap.n_chan)
+    idx    = ((times-ts0)/interval).astype(numpy.int64)
+    counts = numpy.bincount(idx)
+    sums   = []
+    for k in range(n_rails):
+      u = numpy.array(luts[2*k]).take(codes[:,2*k])
+      i = numpy.array(luts[2*k+1]).take(codes[:,2*k+1])
+      p = u*i/I_SCALE if not options.voltage else numpy.zeros(len(u))
+      sums.extend([numpy.bincount(idx,weights=v) for v in (u,i,p)])
+    buckets = [(n,[s[n]/counts[n] for s in sums])
+                                  for n in numpy.nonzero(counts)[0]]
+  else:
+    acc = {}
+    for ts,scan in cap.scans():
+      n = int((ts-ts0)/interval)
+      values = []
+      for k in range(n_rails):
+        u = luts[2*k][scan[2*k]]
+        i = luts[2*k+1][scan[2*k+1]]
+        values.extend([u,i,u*i/I_SCALE if not options.voltage else 0.0])
+      if n in acc:
+        acc[n][0] += 1
+        acc[n][1]  = [a+b for a,b in zip(acc[n][1],values)]
+      else:
+        acc[n] = [1,values]
+    buckets = [(n,[v/c for v in values])
+                                   for n,(c,values) in sorted(acc.items())]
+  cap.close()
+
+  # create database and write all values
+  options.dbfile   = (os.path.splitext(options.capfile)[0] +
+                      vamcatalog.CAPTURE_SUFFIX + ".rrd")
+  options.ts_start = int(ts0) if interval < 1 else int(round(ts0))
+  options.interval = interval
+  create_db(options,interval,cap.rails,options.ts_start-1)
+  updates = []
+  ts_last = 0
+  for n,values in buckets:
+    ts_rrd  = max(to_rrd_time(ts0+n*interval,options.ts_start,interval),
+                  ts_last+get_rrd_step(interval))
+    ts_last = ts_rrd
+    updates.append("%d:%s" % (ts_rrd,":".join("%f" % v for v in values)))
+  for k in range(0,len(updates),CAPTURE_POINTS):
+    rrdtool.update(options.dbfile,
+                   *(get_daemon_args(options)+updates[k:k+CAPTURE_POINTS]))
+
 # --- graph data   -----------------------------------------------------------
 
 def graph_data(options):
   """ create graphical representation of data """
+  render_graphs(options,get_graph_jobs(options))
 
-  # extend first and last datapoint a bit for a nice graphical rep
-  first = options.summary["ts_start"]  - 5
-  last  = options.summary["ts_end"]    + 5
+# --- arguments of all graphs of a database   --------------------------------
 
-  # query filename without path and extension for title
-  title = os.path.splitext(os.path.basename(options.dbfile))[0]
+def get_graph_jobs(options):
+  """ return (imgfile,args) of all requested graphs of the database """
+
+  jobs = []
   for graph_type in options.do_graph:
     imgfile = os.path.splitext(options.dbfile)[0] + "-%s.png" % graph_type
+    args    = vamgraph.get_graph_args(options.dbfile,options.summary,
+                                      graph_type)
+    jobs.append((imgfile,args+get_daemon_args(options)))
+  return jobs
+
+# --- render graphs   --------------------------------------------------------
+
+def render_graph(job):
+  """ render a single graph (runs in a process of the pool) - returns an
+      error-message or None """
+
+  (imgfile,args) = job
+  try:
+    rrdtool.graph(imgfile,args)
+    return None
+  except Exception as e:
+    return "%s: %s" % (imgfile,e)
+
+def render_graphs(options,jobs):
+  """ render graphs in parallel, using all cores """
+
+  workers = min(len(jobs),multiprocessing.cpu_count())
+  for imgfile,_ in jobs:
     options.logger.msg("INFO", "creating image-file: %s" % imgfile)
+  if workers > 1:
+    options.logger.msg("DEBUG", "rendering %d graphs with %d processes" %
+                       (len(jobs),workers))
+    pool   = multiprocessing.Pool(workers)
+    errors = pool.map(render_graph,jobs)
+    pool.close()
+    pool.join()
+  else:
+    errors = [render_graph(job) for job in jobs]
+  for error in errors:
+    if error:
+      options.logger.msg("ERROR", "creating graph failed: %s" % error)
+
+# --- graphs of a directory   ------------------------------------------------
+
+def graph_dir(options):
+  """ create graphs of all databases of a directory """
+
+  jobs = []
+  for f in sorted(os.listdir(options.batch_dir)):
+    if not f.endswith(".rrd"):
+      continue
+    options.dbfile   = os.path.join(options.batch_dir,f)
+    options.ts_start = 0
+    try:
+      options.summary = sum_data(options)
+    except SystemExit:
+      # no data in database (sum_data logs the error)
+      continue
+    jobs.extend(get_graph_jobs(options))
+  options.logger.msg("INFO", "creating %d graphs in %s" %
+                     (len(jobs),options.batch_dir))
+  render_graphs(options,jobs)
 
-    gdef     = "DEF:%s=%s:%s:AVERAGE" %  (graph_type,options.dbfile,graph_type)
-    vdef_avg = "VDEF:%savg=%s,AVERAGE" % (graph_type,graph_type)
-    vdef_max = "VDEF:%smax=%s,MAXIMUM" % (graph_type,graph_type)
-    vlow     = None
-    vhigh    = None
-    if graph_type == 'U':
-      vlabel   = "U (V)"
-      line     = "LINE2:%s#0000FF:%savg" % (graph_type,graph_type)
-      info_avg = "GPRINT:Uavg:U Avg \t%6.2lf V"
-      info_max = "GPRINT:Umax:U Max \t%6.2lf V\c"
-      vlow     = "0.0"
-      vhigh    = "6.0"
-    elif graph_type == 'I':
-      vlabel   = "I (mA)"
-      info_avg = "GPRINT:Iavg:I Avg \t%6.0lf mA"
-      info_max = "GPRINT:Imax:I Max \t%6.0lf mA\c"
-      line     = "LINE2:%s#00FF00:%savg" % (graph_type,graph_type)
-    else:
-      vlabel   = "P (W)"
-      line     = "LINE2:%s#FF0000:%savg" % (graph_type,graph_type)
-      info_avg = "GPRINT:Pavg:P Avg \t%6.2lf W"
-      info_max = "GPRINT:Pmax:P Max \t%6.2lf W\c"
-
-    args = ["rrdtool", "graph", imgfile,
-                "--start", str(first),
-                "--end",   str(last),
-                "--vertical-label=%s" % vlabel,
-                "--width", "800",
-                "--height", "400",
-                "--title", title,
-                "--left-axis-format", "%6.2lf",
-                "--units-exponent", "0",
-                gdef,
-                vdef_avg,
-                vdef_max,
-                line,
-                "COMMENT:\s",
-                info_avg,
-                info_max]
-    if not vlow is None:
-      args.extend(["--lower-limit",vlow])
-    if not vhigh is None:
-      args.extend(["--upper-limit",vhigh])
-
-    rrdtool.graph(imgfile,args[3:])
-  
 # --- signal-handler   -----------------------------------------------------
 
 def signal_handler(_signo, _stack_frame):
@@ -738,6 +2541,20 @@ def signal_handler(_signo, _stack_frame):
   options.logger.msg("DEBUG", "interrupt %d detected, exiting" % _signo)
   return
 
+# --- parse timestamps   ----------------------------------------------------
+
+def parse_time(value):
+  """ convert unix-time or a timestamp (TIMESTAMP_FMT) to unix-time """
+
+  try:
+    return float(value)
+  except ValueError:
+    pass
+  try:
+    return time.mktime(time.strptime(value,TIMESTAMP_FMT))
+  except ValueError:
+    raise ArgumentTypeError("invalid time: %s" % value)
+
 # --- cmdline-parser   ------------------------------------------------------
 
 def get_parser():
@@ -750,6 +2567,10 @@ def get_parser():
     metavar='directory', default=[os.path.expanduser("~")],
     dest='target_dir',
     help='directory for RRDs and graphics if no database-name is supplied')
+  parser.add_argument('-d', '--daemon', nargs=1,
+    metavar='address', default=[RRD_DAEMON],
+    dest='daemon',
+    help='address of rrdcached, e.g. unix:/var/run/rrdcached.sock')
   parser.add_argument('-n', '--no-create', action='store_true',
     dest='do_notcreate', default=False,
     help="don't recreate the database")
@@ -759,13 +2580,29 @@ def get_parser():
   parser.add_argument('-g', '--graph', nargs='?',
     metavar='graph_opt', default=None, const="UIP",
     dest='do_graph',
-    help='create graphic from data for U,I,P (use any combination)')
+    help='''create graphic from data for U,I,P and C (combined U,I,P)
+            (use any combination)''')
+  parser.add_argument('-B', '--batch', action='store_true',
+    dest='batch', default=False,
+    help='''create graphics (-g) of all databases of a directory
+            (database-file is the directory, default: see -D)''')
   parser.add_argument('-p', '--print', action='store_true',
     dest='do_print',
     help='print results')
   parser.add_argument('-S', '--summary', action='store_true',
     dest='do_sum',
     help='print summary')
+  parser.add_argument('--start', metavar='time',
+    dest='start', default=None, type=parse_time,
+    help='print data starting at time (unix-time or "%s")' %
+                                              TIMESTAMP_FMT.replace("%","%%"))
+  parser.add_argument('--end', metavar='time',
+    dest='end', default=None, type=parse_time,
+    help='print data up to time (unix-time or "%s")' %
+                                              TIMESTAMP_FMT.replace("%","%%"))
+  parser.add_argument('--resolution', metavar='seconds',
+    dest='resolution', default=0, type=float,
+    help='print data with at least this resolution (default: finest)')
 
   parser.add_argument('-O', '--output', nargs='?',
     metavar='opt', default='auto', const="auto",
@@ -777,6 +2614,9 @@ def get_parser():
   parser.add_argument('-R', '--raw', action='store_true',
     dest='raw', default=False,
     help='record raw ADC-values')
+  parser.add_argument('-C', '--capture', action='store_true',
+    dest='capture', default=False,
+    help='write all samples to a capture-file (%s)' % CAPTURE_EXT)
   parser.add_argument('-V', '--voltage', action='store_true',
     dest='voltage', default=False,
     help='record voltage values from ADC')
@@ -810,18 +2650,46 @@ def check_options(options):
 
   # add logger
   options.logger   = Msg(options.level,options.syslog)
+  options.sink     = None         # receiver of typed records (see Engine)
+  options.on_stop  = None         # called if the collector stops itself
+  options.wave     = None         # WaveTap for live waveforms (see Engine)
+
+  # batch-mode: graphics of all databases of a directory
+  if options.batch:
+    options.batch_dir = options.dbfile or options.target_dir[0]
+    if not options.do_graph or not os.path.isdir(options.batch_dir):
+      options.logger.msg("ERROR", "batch-mode needs -g and a directory")
+      sys.exit(3)
+    options.do_run       = False
+    options.do_notcreate = True
+    options.interval     = INTERVAL
+    options.capfile      = None
+    options.ts_start     = 0
+    return
 
   # default database
   if not options.dbfile:
     now            = datetime.datetime.now()
     fname          = now.strftime("%Y%m%d_%H%M%S.rrd")
     options.dbfile = os.path.join(options.target_dir[0],fname)
+  if options.daemon[0]:
+    # rrdcached resolves relative names relative to its base-directory
+    options.dbfile = os.path.abspath(options.dbfile)
   options.logger.msg("INFO", "Database-file: %s" % options.dbfile)
 
   # set run-mode as default
   if not options.do_graph and not options.do_print and not options.do_sum:
     options.do_run = True
 
+  # capture-files are only read, they are written with option --capture
+  options.capfile  = None
+  options.interval = INTERVAL
+  if options.dbfile.endswith(CAPTURE_EXT):
+    if options.do_run:
+      options.logger.msg("ERROR", "use -p, -S or -g to read a capture-file")
+      sys.exit(3)
+    options.capfile = options.dbfile
+
   # do not recreate the database if no new run is requested
   if os.path.exists(options.dbfile) and not options.do_run:
     options.do_notcreate = True
@@ -837,6 +2705,44 @@ def check_options(options):
   options.limit    = options.limit[0]
   options.logger.msg("DEBUG", "limit: %f" % options.limit)
   options.ts_start = 0
+  options.ts_last  = 0
+
+  # select lookup-tables, numpy is optional
+  if options.raw:
+    options.mode = 'raw'
+  elif options.voltage:
+    options.mode = 'voltage'
+  else:
+    options.mode = 'normal'
+  options.use_numpy = USE_NUMPY and have_numpy
+  options.logger.msg("INFO", "numpy-pipeline: %r" % options.use_numpy)
+  if options.use_numpy:
+    options.luts = [tuple(numpy.array(lut) for lut in luts[options.mode])
+                                                            for luts in LUTS]
+  else:
+    options.luts = [luts[options.mode] for luts in LUTS]
+
+  # check retention of the database
+  if not RRD_PROFILE in RRA_PROFILES and not RRD_TIERS:
+    options.logger.msg("ERROR", "unknown profile %s and no tiers" %
+                       RRD_PROFILE)
+    sys.exit(3)
+  options.logger.msg("DEBUG", "RRA-profile: %s, layout: %r" %
+                     (RRD_PROFILE,get_rra_layout(INTERVAL)))
+
+  # check channels and names of the rails
+  options.channels = [c for rail in RAILS
+                                  for c in (rail.u_channel,rail.i_channel)]
+  names = [rail.name for rail in RAILS[1:]]
+  if (len(set(options.channels)) != len(options.channels) or
+      max(options.channels) >= len(ADC_BYTES) or min(options.channels) < 0):
+    options.logger.msg("ERROR", "invalid channels %r for %s" %
+                       (options.channels,ADC))
+    sys.exit(3)
+  if (len(set(names)) != len(names) or
+      [n for n in names if not n.isalnum() or len(n) > 8]):
+    options.logger.msg("ERROR", "invalid rail-names: %r" % names)
+    sys.exit(3)
 
   # without real hardware we just simulate
   options.simulate = options.simulate or not have_spi
@@ -851,6 +2757,11 @@ if __name__ == '__main__':
   options        = opt_parser.parse_args(namespace=Options)
   check_options(options)
 
+  # create graphics of a directory
+  if options.batch:
+    graph_dir(options)
+    sys.exit(0)
+
   # query output options
   query_output_opts(options)
 
@@ -864,18 +2775,29 @@ if __name__ == '__main__':
     options.logger.msg("DEBUG", "ADC resolution: %s" % ADC_RES)
     options.logger.msg("DEBUG", "ADC command-bytes: %r" % ADC_BYTES)
     options.logger.msg("DEBUG", "ADC mask: %r" % bin(ADC_MASK))
+    options.logger.msg("DEBUG", "SPI speed:       %d Hz" % SPI_SPEED)
+    options.logger.msg("DEBUG", "SPI sample-rate: %d" % SAMPLE_RATE)
+    options.logger.msg("DEBUG", "SPI burst-size:  %d" % BURST_SIZE)
     options.logger.msg("DEBUG", "HALL U_CC_2:     %4.2f" % U_CC_2)
     options.logger.msg("DEBUG", "HALL conv-value: %5.3f" % CONV_VALUE)
+    for rail in RAILS[1:]:
+      options.logger.msg("DEBUG", "rail %s: channels %d/%d, %4.2f, %5.3f" %
+                         (rail.name,rail.u_channel,rail.i_channel,
+                          rail.u_cc_2,rail.conv_value))
     get_data(options)
 
+  # graphs and summary of capture-files need a database
+  if options.capfile and (options.do_graph or options.do_sum):
+    capture_to_rrd(options)
+
   # we always create a summary if it does not yet exist
-  if not options.raw:
+  if not options.raw and not options.dbfile.endswith(CAPTURE_EXT):
     options.summary = sum_data(options)
 
-  # create output
+  # create output (capture-files are printed with full resolution)
+  if options.do_print and (options.capfile or not options.raw):
+    print_data(options)
   if not options.raw:
-    if options.do_print:
-      print_data(options)
     if options.do_sum:
       print_summary(options)
     if options.do_graph:
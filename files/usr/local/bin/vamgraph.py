@@ -0,0 +1,244 @@
+# ----------------------------------------------------------------------------
+# Graphs of the sessions of pi-vameter.
+#
+# Creates the arguments of rrdtool-graphs (used by vameter.py and the
+# web-server) and implements the size-bounded cache of graphs rendered
+# on demand by the web-server.
+#
+# Author: Bernhard Bablok, Lothar Hiller
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-vameter
+#
+# ----------------------------------------------------------------------------
+
+import os, datetime, hashlib, collections, tempfile
+import rrdtool
+from vamdata import get_rrd_step, to_rrd_time, get_db_rails, TIMESTAMP_FMT
+
+GRAPH_TYPES = "UIPC"          # U, I, P and combined graph
+RAIL_COLORS = ["FF8000","800080","008080"]   # graph-colors of extra rails
+
+# --- arguments of a graph   -------------------------------------------------
+
+def get_graph_args(dbfile,summary,graph_type,start=None,end=None,
+                   width=800,height=400):
+  """ return arguments of rrdtool.graph for a graph of a database. The
+      time-range defaults to the complete session """
+
+  # extend first and last datapoint a bit for a nice graphical rep
+  ts_start = summary["ts_start"]
+  start    = max(start or ts_start,ts_start)
+  end      = min(end or summary["ts_end"],summary["ts_end"])
+  interval = summary.get("interval",1)
+  step     = get_rrd_step(interval)
+  first    = to_rrd_time(start,ts_start,interval) - 5*step
+  last     = to_rrd_time(end,ts_start,interval) + 5*step
+
+  # the time-axis of high-resolution data is virtual: replace it by comments
+  if interval < 1:
+    ts_fmt = lambda t: datetime.datetime.fromtimestamp(t).strftime(
+                                        TIMESTAMP_FMT).replace(":","\\:")
+    x_axis = ["--x-grid", "none"]
+    x_info = ["COMMENT:Start %s  End %s  Resolution %dms\\c" %
+              (ts_fmt(start),ts_fmt(end),int(round(1000*interval)))]
+  else:
+    x_axis = []
+    x_info = []
+
+  # query filename without path and extension for title
+  title = os.path.splitext(os.path.basename(dbfile))[0]
+  rails = get_db_rails(dbfile)
+  if graph_type == 'C':
+    lines,infos,limits = get_combined_graph(dbfile,summary,rails)
+  else:
+    lines,infos,limits = get_simple_graph(dbfile,rails,graph_type)
+
+  return ["--start", str(first),
+          "--end",   str(last),
+          "--width", str(width),
+          "--height", str(height),
+          "--title", title,
+          "--left-axis-format", "%6.2lf",
+          "--units-exponent", "0"] + limits + lines + [
+          "COMMENT:\s"] + infos + x_info + x_axis
+
+# --- graph of a single value   ----------------------------------------------
+
+def get_simple_graph(dbfile,rails,graph_type):
+  """ return lines, infos and limits of a graph of U, I or P """
+
+  limits = []
+  if graph_type == 'U':
+    vlabel   = "U (V)"
+    color    = "0000FF"
+    info_fmt = "%6.2lf V"
+    limits   = ["--lower-limit", "0.0", "--upper-limit", "6.0"]
+  elif graph_type == 'I':
+    vlabel   = "I (mA)"
+    color    = "00FF00"
+    info_fmt = "%6.0lf mA"
+  else:
+    vlabel   = "P (W)"
+    color    = "FF0000"
+    info_fmt = "%6.2lf W"
+
+  # one line for every rail
+  lines = []
+  infos = []
+  for k,name in enumerate(rails):
+    ds = graph_type + ("_" + name if name else "")
+    lines.extend([
+      "DEF:%s=%s:%s:AVERAGE" %  (ds,dbfile,ds),
+      "VDEF:%savg=%s,AVERAGE" % (ds,ds),
+      "VDEF:%smax=%s,MAXIMUM" % (ds,ds),
+      "LINE2:%s#%s:%savg" % (ds,color if k == 0 else RAIL_COLORS[k-1],ds)
+      ])
+    infos.extend([
+      "GPRINT:%savg:%s Avg \t%s" % (ds,ds,info_fmt),
+      "GPRINT:%smax:%s Max \t%s\c" % (ds,ds,info_fmt)
+      ])
+  return (lines,infos,["--vertical-label=%s" % vlabel] + limits)
+
+# --- combined graph   -------------------------------------------------------
+
+def get_combined_graph(dbfile,summary,rails):
+  """ return lines, infos and limits of a graph of U, I and P. I uses the
+      left axis, U and P are scaled to the right axis """
+
+  # scale of the right axis from the maxima of all rails
+  values = [summary] + list(summary.get("rails",{}).values())
+  i_max  = max([v.get("I_max",0) for v in values] + [1])*1.1
+  r_max  = max([v.get(k,0) for v in values for k in ("U_max","P_max")] +
+                                                                   [0.1])*1.1
+  factor = i_max/r_max
+
+  lines = []
+  infos = []
+  for k,name in enumerate(rails):
+    suffix = "_" + name if name else ""
+    dashes = ":dashes" if k else ""
+    for graph_type,color,info_fmt in [("I","00FF00","%6.0lf mA"),
+                                      ("U","0000FF","%6.2lf V"),
+                                      ("P","FF0000","%6.2lf W")]:
+      ds = graph_type + suffix
+      lines.extend([
+        "DEF:%s=%s:%s:AVERAGE" %  (ds,dbfile,ds),
+        "VDEF:%savg=%s,AVERAGE" % (ds,ds),
+        "VDEF:%smax=%s,MAXIMUM" % (ds,ds)
+        ])
+      if graph_type == "I":
+        lines.append("LINE2:%s#%s:%s%s" % (ds,color,ds,dashes))
+      else:
+        lines.extend([
+          "CDEF:%s_scaled=%s,%f,*" % (ds,ds,factor),
+          "LINE2:%s_scaled#%s:%s%s" % (ds,color,ds,dashes)
+          ])
+      infos.extend([
+        "GPRINT:%savg:%s Avg \t%s" % (ds,ds,info_fmt),
+        "GPRINT:%smax:%s Max \t%s\c" % (ds,ds,info_fmt)
+        ])
+
+  limits = ["--vertical-label=I (mA)",
+            "--right-axis-label=U (V), P (W)",
+            "--right-axis", "%f:0" % (1/factor),
+            "--right-axis-format", "%4.2lf",
+            "--lower-limit", "0", "--upper-limit", "%f" % i_max, "--rigid"]
+  return (lines,infos,limits)
+
+# --- cache of rendered graphs   ---------------------------------------------
+
+class GraphCache(object):
+  """ Directory with rendered graphs, limited to max_size bytes. The least
+      recently used graphs are removed first """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,path,max_size):
+    """ Constructor - reads existing entries (ordered by mtime) """
+
+    self.path     = path
+    self.max_size = max_size
+    if not os.path.isdir(path):
+      os.makedirs(path)
+
+    entries = []
+    for f in os.listdir(path):
+      if f.endswith(".png"):
+        st = os.stat(os.path.join(path,f))
+        entries.append((st.st_mtime,f,st.st_size))
+    self._entries = collections.OrderedDict(
+                                 (f,size) for _,f,size in sorted(entries))
+    self.size     = sum(self._entries.values())
+
+  # --- key of a graph   -----------------------------------------------------
+
+  def get_key(self,name,*args):
+    """ return key of a graph of a session (args: all parameters which
+        change the graph, e.g. the mtime of the database) """
+
+    digest = hashlib.sha1(repr(args)).hexdigest()[:16]
+    return "%s-%s.png" % (name,digest)
+
+  # --- lookup   -------------------------------------------------------------
+
+  def get(self,key):
+    """ return path of a cached graph (or None) """
+
+    if not key in self._entries:
+      return None
+    path = os.path.join(self.path,key)
+    if not os.path.exists(path):
+      self._remove(key)
+      return None
+    self._entries[key] = self._entries.pop(key)       # most recently used
+    os.utime(path,None)
+    return path
+
+  # --- render and add graph   -----------------------------------------------
+
+  def render(self,key,args,run=None):
+    """ render a graph into the cache - returns the path of the graph.
+        If given, run(func,args) executes rrdtool (e.g. in a thread) """
+
+    # every render uses its own temporary file (concurrent renders of a key)
+    path       = os.path.join(self.path,key)
+    fd,tmpfile = tempfile.mkstemp(suffix=".tmp",dir=self.path)
+    os.close(fd)
+    try:
+      if run:
+        run(rrdtool.graph,(tmpfile,args))
+      else:
+        rrdtool.graph(tmpfile,args)
+      os.rename(tmpfile,path)
+    except:
+      if os.path.exists(tmpfile):
+        os.unlink(tmpfile)
+      raise
+    size = os.path.getsize(path)
+    if key in self._entries:
+      self.size -= self._entries.pop(key)
+    self._entries[key] = size
+    self.size += size
+
+    # remove least recently used graphs
+    while self.size > self.max_size and len(self._entries) > 1:
+      self._remove(next(iter(self._entries)))
+    return path
+
+  # --- remove graphs   ------------------------------------------------------
+
+  def purge(self,name):
+    """ remove all graphs of a session """
+
+    for key in [k for k in self._entries if k.rsplit("-",1)[0] == name]:
+      self._remove(key)
+
+  def _remove(self,key):
+    """ remove a single graph """
+
+    self.size -= self._entries.pop(key)
+    try:
+      os.unlink(os.path.join(self.path,key))
+    except OSError:
+      pass
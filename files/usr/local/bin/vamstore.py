@@ -0,0 +1,252 @@
+# ----------------------------------------------------------------------------
+# Columnar session store for pi-vameter.
+#
+# A session store is a directory next to the database (<name>.col) with
+#   - meta.json:  columns and interval of the session
+#   - ts.f64:     time index (unix-time, float64)
+#   - <col>.f32:  one file per column (float32)
+# All files are little-endian and append-only, rows are appended in chunks.
+# The number of rows is derived from the file sizes, so readers never see
+# a timestamp without values (the time index is written last).
+#
+# Author: Bernhard Bablok, Lothar Hiller
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-vameter
+#
+# ----------------------------------------------------------------------------
+
+try:
+  import numpy
+  have_numpy = True
+except ImportError:
+  have_numpy = False
+
+import os, sys, json, struct, array, mmap
+
+STORE_EXT  = ".col"
+META_FILE  = "meta.json"
+TIME_FILE  = "ts.f64"
+COL_EXT    = ".f32"
+CHUNK_ROWS = 4096             # rows per chunk of StoreReader.iter_rows()
+
+# --- path of the store   ----------------------------------------------------
+
+def get_store_path(dbfile):
+  """ return path of the store of a database """
+  return os.path.splitext(dbfile)[0] + STORE_EXT
+
+# --- convert arrays to little-endian bytes   --------------------------------
+
+def _to_bytes(typecode,values):
+  """ convert values to little-endian bytes """
+
+  data = array.array(typecode,values)
+  if sys.byteorder == 'big':
+    data.byteswap()
+  return data.tostring()
+
+# --- writer   ---------------------------------------------------------------
+
+class StoreWriter(object):
+  """ Append rows (timestamp and values) to a store """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,path,columns,interval,reset=True):
+    """ Constructor - an existing store is only continued if it has the
+        same columns and reset is not set """
+
+    self.path    = path
+    self.columns = columns
+    self.rows    = 0
+
+    meta_file = os.path.join(path,META_FILE)
+    if not reset and os.path.exists(meta_file):
+      f = open(meta_file,"r")
+      meta = json.load(f)
+      f.close()
+      reset = meta['columns'] != columns
+    if reset:
+      self._create(interval)
+    self._open()
+
+  # --- create store   -------------------------------------------------------
+
+  def _create(self,interval):
+    """ create directory and meta-data, remove old data """
+
+    if not os.path.isdir(self.path):
+      os.makedirs(self.path)
+    for f in os.listdir(self.path):
+      if f == TIME_FILE or f.endswith(COL_EXT):
+        os.unlink(os.path.join(self.path,f))
+
+    meta = {'columns': self.columns, 'interval': interval, 'version': 1}
+    f = open(os.path.join(self.path,META_FILE),"w")
+    json.dump(meta,f,indent=2,sort_keys=True)
+    f.close()
+
+  # --- open files   ---------------------------------------------------------
+
+  def _open(self):
+    """ open all files for appending """
+
+    flags     = os.O_WRONLY|os.O_CREAT|os.O_APPEND
+    self._fds = [os.open(os.path.join(self.path,c+COL_EXT),flags,0644)
+                                                       for c in self.columns]
+    self._ts  = os.open(os.path.join(self.path,TIME_FILE),flags,0644)
+
+  # --- append rows   --------------------------------------------------------
+
+  def append(self,rows):
+    """ append a chunk of rows, every row is (ts,value1,...,valueN) """
+
+    if not rows:
+      return
+    for k,fd in enumerate(self._fds):
+      os.write(fd,_to_bytes('f',[row[k+1] for row in rows]))
+    os.write(self._ts,_to_bytes('d',[row[0] for row in rows]))
+    self.rows += len(rows)
+
+  # --- close store   --------------------------------------------------------
+
+  def close(self):
+    """ close all files """
+
+    for fd in self._fds + [self._ts]:
+      os.close(fd)
+    self._fds = []
+
+# --- reader   ---------------------------------------------------------------
+
+class StoreReader(object):
+  """ Read slices of a store using memory-maps """
+
+  # --- constructor   --------------------------------------------------------
+
+  def __init__(self,path):
+    """ Constructor """
+
+    f = open(os.path.join(path,META_FILE),"r")
+    meta = json.load(f)
+    f.close()
+    self.path     = path
+    self.columns  = meta['columns']
+    self.interval = meta['interval']
+
+    self._maps = {}
+    sizes      = [self._map(TIME_FILE)//8]
+    for c in self.columns:
+      sizes.append(self._map(c+COL_EXT)//4)
+    self.rows  = min(sizes)
+
+  # --- map a file   ---------------------------------------------------------
+
+  def _map(self,name):
+    """ map a file - returns the size of the file """
+
+    f = open(os.path.join(self.path,name),"rb")
+    size = os.fstat(f.fileno()).st_size
+    if size:
+      self._maps[name] = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+    f.close()
+    return size
+
+  # --- time of a row   ------------------------------------------------------
+
+  def time(self,k):
+    """ return timestamp of row k """
+    return struct.unpack_from("<d",self._maps[TIME_FILE],8*k)[0]
+
+  # --- binary search   ------------------------------------------------------
+
+  def find(self,t,side='left'):
+    """ return index of the first row with timestamp >= t (side='left')
+        or > t (side='right') """
+
+    if have_numpy and self.rows:
+      return int(numpy.searchsorted(self._numpy(TIME_FILE,'<f8'),t,side))
+    lo,hi = 0,self.rows
+    while lo < hi:
+      mid = (lo+hi)//2
+      if self.time(mid) < t or (side == 'right' and self.time(mid) == t):
+        lo = mid+1
+      else:
+        hi = mid
+    return lo
+
+  # --- numpy-views   --------------------------------------------------------
+
+  def _numpy(self,name,dtype):
+    """ return a numpy-view of a file """
+    return numpy.frombuffer(self._maps[name],dtype=dtype,count=self.rows)
+
+  # --- read a slice   -------------------------------------------------------
+
+  def read(self,start=None,end=None,columns=None):
+    """ return timestamps and values of all rows with start <= ts <= end.
+        Values are numpy-arrays if numpy is available, arrays otherwise """
+
+    columns    = columns or self.columns
+    first,last = self._range(start,end)
+    if first == last:
+      return ([],dict((c,[]) for c in columns))
+    return self._read(first,last,columns)
+
+  # --- iterate over rows   --------------------------------------------------
+
+  def iter_rows(self,start=None,end=None,columns=None,chunk=CHUNK_ROWS):
+    """ iterate over (ts,values) of all rows with start <= ts <= end,
+        reading chunk rows at a time """
+
+    columns    = columns or self.columns
+    first,last = self._range(start,end)
+    for k in range(first,last,chunk):
+      times,values = self._read(k,min(k+chunk,last),columns)
+      for row in zip(times.tolist(),
+                     zip(*[values[c].tolist() for c in columns])):
+        yield row
+
+  # --- rows of a time-range   -----------------------------------------------
+
+  def _range(self,start,end):
+    """ return index of the first row and after the last row of a range """
+
+    first = 0 if start is None else self.find(start)
+    last  = self.rows if end is None else self.find(end,'right')
+    return (first,max(first,last))
+
+  # --- read rows   ----------------------------------------------------------
+
+  def _read(self,first,last,columns):
+    """ return timestamps and values of rows first...last-1 """
+
+    if have_numpy:
+      times  = self._numpy(TIME_FILE,'<f8')[first:last]
+      values = dict((c,self._numpy(c+COL_EXT,'<f4')[first:last])
+                                                            for c in columns)
+      return (times,values)
+
+    times = self._array('d',TIME_FILE,8,first,last)
+    values = dict((c,self._array('f',c+COL_EXT,4,first,last))
+                                                            for c in columns)
+    return (times,values)
+
+  def _array(self,typecode,name,size,first,last):
+    """ return rows first...last-1 of a file as an array """
+
+    data = array.array(typecode)
+    data.fromstring(self._maps[name][size*first:size*last])
+    if sys.byteorder == 'big':
+      data.byteswap()
+    return data
+
+  # --- close store   --------------------------------------------------------
+
+  def close(self):
+    """ close memory-maps """
+
+    for m in self._maps.values():
+      m.close()
+    self._maps = {}
@@ -3,6 +3,7 @@
 # Simple web-interface for the results of vameter.py
 #
 # This file defines the content area for data (table of available results)
+# and the list of background jobs (polled while jobs are active)
 #
 # Author: Bernhard Bablok
 # License: GPL3
@@ -16,20 +17,16 @@
 
   var current_selection = null;
 
+  var jobs_timer  = null;
+  var jobs_active = false;
+
   get_results = function() {
-    $.ajax({
-      type: "POST",
-      cache: false,
-      url: "/results",
-      success: function(data){
-        current_selection = null;
-        updateRenameButton();
-        var table = $('#result_list').DataTable();
-        table.clear();
-        table.rows.add(data).draw();
-      }
-    });
-     return false;
+    current_selection = null;
+    updateRenameButton();
+    updateJobButtons();
+    // sorting, filtering and paging is done by the server
+    $('#result_list').DataTable().ajax.reload(null,false);
+    return false;
   };
 
   getDelButton = function(name) {
@@ -38,6 +35,55 @@
     return head + name + end;
   };
 
+  updateJobButtons = function() {
+    if (current_selection) {
+      $('.job').removeClass('w3-disabled');
+    } else {
+      $('.job').addClass('w3-disabled');
+    }
+  };
+
+  // --- background jobs   --------------------------------------------------
+
+  pollJobs = function() {
+    if (jobs_timer) {
+      clearTimeout(jobs_timer);
+      jobs_timer = null;
+    }
+    $.getJSON("/jobs",function(data) {
+      var active = false;
+      var rows   = $.map(data.jobs.reverse(),function(job) {
+        active = active || job.state == "queued" || job.state == "running";
+        return getJobRow(job);
+      });
+      $('#job_list tbody').html(rows.join(""));
+      $('#job_list').toggle(rows.length > 0);
+      if (active) {
+        jobs_timer = setTimeout(pollJobs,1000);
+      } else if (jobs_active) {
+        // summaries may have changed
+        get_results();
+      }
+      jobs_active = active;
+    });
+  };
+
+  getJobRow = function(job) {
+    var action = "";
+    if (job.state == "queued" || job.state == "running") {
+      action = '<a href="#" onClick="doCancelJob(' + job.id + ')">cancel</a>';
+    } else if (job.result) {
+      action = '<a href="/jobs/' + job.id + '/result">download</a>';
+    }
+    var state = job.state + (job.msg ? ": " + $('<i>').text(job.msg).html()
+                                     : "");
+    return '<tr><td>' + job.id + '</td><td>' + job.kind + '</td><td>' +
+           $('<i>').text(job.name).html() + '</td><td>' + state + '</td>' +
+           '<td><div class="w3-light-grey"><div class="w3-blue" style="' +
+           'height:12px;width:' + Math.round(100*job.progress) + '%">' +
+           '</div></div></td><td>' + action + '</td></tr>';
+  };
+
   getDldButton = function(name) {
     var head =  '<img class = "w3-border" src="images/download.png" alt="download" onClick="doDownload(\'';
     var end  =  '\')">';
@@ -48,6 +94,22 @@
       var table = $("#result_list").DataTable( {
         select: {style: 'single'},
         order: [[ 1, "desc" ]],
+        processing: true,
+        serverSide: true,
+        searchDelay: 500,
+        ajax: function(data,callback,settings) {
+                // GET with a fixed draw-counter: identical requests have
+                // identical URLs, so the browser revalidates its copy
+                // with the ETag of the response
+                var draw  = data.draw;
+                data.draw = 0;
+                $.ajax({url: "/results", type: "GET", data: data,
+                        dataType: "json", cache: true,
+                        success: function(json) {
+                          json.draw = draw;
+                          callback(json);
+                        }});
+              },
         columns: [
             { data: "name",     title: "Name",
               className: "dt-left" },
@@ -86,30 +148,32 @@
             { data: "P_tot",    title: "P (Wh) total",
               className: "dt-right" },
             { data: null,    title: "Del",
-              className: "dt-right",
+              className: "dt-right", orderable: false, searchable: false,
               render: function(data,type,raw,meta) {
                    return getDelButton(data.name);
               }
              },
             { data: null,    title: "Save",
-              className: "dt-right",
+              className: "dt-right", orderable: false, searchable: false,
               render: function(data,type,raw,meta) {
                    return getDldButton(data.name);
               }
              },
         ]
       });
-      get_results();
       table.on('select', function(e,dt,type,indexes) {
         var data = table.rows(indexes).data();
         current_selection = data[0];
         setTabData(data[0]);
         updateRenameButton();
+        updateJobButtons();
       });
       table.on('deselect', function(e,dt,type,indexes) {
         current_selection = null;
         updateRenameButton();
+        updateJobButtons();
       });
+      pollJobs();
   });
 </script>
 
@@ -118,4 +182,25 @@
   <h3>Measurements</h3>
   <table id="result_list" class="display"
          width="100%" cellspacing="0"></table>
+  <div class="w3-bar w3-margin-top">
+    <a href="#" class="job w3-bar-item w3-button w3-border w3-disabled"
+       onclick="doJob('graph')">Render graphs</a>
+    <a href="#" class="job w3-bar-item w3-button w3-border w3-disabled"
+       onclick="doJob('summary')">Rebuild summary</a>
+    <a href="#" class="job w3-bar-item w3-button w3-border w3-disabled"
+       onclick="doJob('export',{format: $('#job_format').val()})">Export</a>
+    <select id="job_format" class="w3-bar-item w3-select" style="width:auto">
+      <option value="csv">CSV</option>
+      <option value="ndjson">NDJSON</option>
+      <option value="bin">Binary</option>
+    </select>
+  </div>
+  <table id="job_list" style="display:none"
+         class="w3-table w3-striped w3-border w3-margin-top">
+    <thead>
+      <tr><th>Job</th><th>Kind</th><th>Name</th><th>State</th>
+          <th>Progress</th><th></th></tr>
+    </thead>
+    <tbody></tbody>
+  </table>
 </section>
@@ -2,7 +2,9 @@
 # ----------------------------------------------------------------------------
 # Simple web-interface for the results of vameter.py
 #
-# This file defines the content area for graphical output
+# This file defines the content area for graphical output. Charts are drawn
+# from downsampled data (/chart), select a range with the mouse to zoom in,
+# double-click to zoom out.
 #
 # Author: Bernhard Bablok
 # License: GPL3
@@ -14,46 +16,253 @@
 
 <script  type="text/javascript">
   var selected_tab = null;
-  function openTab(button,tabName) {
-    $(".tab").css("display","none");
-    $(tabName).css("display","block");
+  var chart = {line: null, type: 'I', start: null, end: null,
+               data: null, drag: null};
+  var CHART_TYPES = {
+    I: {label: "I (mA)", color: "#00c000"},
+    U: {label: "U (V)",  color: "#0000ff"},
+    P: {label: "P (W)",  color: "#ff0000"}
+  };
+  var RAIL_COLORS = ["#ff8000","#800080","#008080"];
+  var CHART_PAD   = {left: 60, right: 60, top: 10, bottom: 30};
+
+  function openTab(button,type) {
     $(".detail").removeClass("w3-blue-gray");
     $(button).addClass("w3-blue-gray");
     selected_tab = button;
+    chart.type   = type;
+    drawChart();
   };
 
   function setTabData(line) {
+    chart.line  = line;
+    chart.start = line['ts_start'];
+    chart.end   = line['ts_end'];
     if (!selected_tab) {
       $("#btnCurrent").click();
     }
-    $('#I_img').attr('src',line['I_img']);
-    $('#U_img').attr('src',line['U_img']);
-    $('#P_img').attr('src',line['P_img']);
+    loadChart();
+  };
+
+  // --- load downsampled data   ---------------------------------------------
+
+  function loadChart() {
+    if (!chart.line) {
+      return;
+    }
+    var canvas = $('#chart')[0];
+    canvas.width = $('#content_graphics').width();
+    $.getJSON("/chart", {name:   chart.line['name'],
+                         start:  chart.start,
+                         end:    chart.end,
+                         mode:   $('#chart_mode').val(),
+                         points: canvas.width-CHART_PAD.left-CHART_PAD.right},
+              function(data) {
+                chart.data = data;
+                drawChart();
+              });
+  };
+
+  // --- draw chart   --------------------------------------------------------
+
+  function getSeries(type) {
+    var series = [];
+    if (!chart.data) {
+      return series;
+    }
+    $.each(chart.data.series,function(name,s) {
+      if (name[0] == type) {
+        series.push({name: name, data: s});
+      }
+    });
+    series.sort(function(a,b) { return a.name.length - b.name.length; });
+    return series;
+  };
+
+  function getMax(series) {
+    var max = 0;
+    $.each(series,function(k,s) {
+      $.each(s.data.max || s.data.values,function(j,v) {
+        max = Math.max(max,v);
+      });
+    });
+    return 1.1*max || 1;
+  };
+
+  function drawAxis(ctx,canvas,max,x,align,label) {
+    ctx.fillStyle = "#000000";
+    ctx.textAlign = align;
+    var h = canvas.height-CHART_PAD.top-CHART_PAD.bottom;
+    for (var k=0; k<=5; k++) {
+      var y = CHART_PAD.top + h - k*h/5;
+      ctx.fillText((k*max/5).toFixed(max < 10 ? 2 : 0),x,y+4);
+    }
+    ctx.fillText(label,x,CHART_PAD.top+h+20);
+  };
+
+  function drawSeries(ctx,canvas,s,max,color,dashed) {
+    var w   = canvas.width-CHART_PAD.left-CHART_PAD.right;
+    var h   = canvas.height-CHART_PAD.top-CHART_PAD.bottom;
+    var ts  = s.data.ts;
+    var x   = function(t) {
+      return CHART_PAD.left + w*(t-chart.data.start)/
+                           Math.max(chart.data.end-chart.data.start,1e-3);
+    };
+    var y   = function(v) { return CHART_PAD.top + h - h*v/max; };
+
+    // envelope of minimum and maximum
+    if (s.data.min && ts.length) {
+      ctx.globalAlpha = 0.25;
+      ctx.fillStyle   = color;
+      ctx.beginPath();
+      ctx.moveTo(x(ts[0]),y(s.data.max[0]));
+      for (var k=1; k<ts.length; k++) {
+        ctx.lineTo(x(ts[k]),y(s.data.max[k]));
+      }
+      for (var k=ts.length-1; k>=0; k--) {
+        ctx.lineTo(x(ts[k]),y(s.data.min[k]));
+      }
+      ctx.closePath();
+      ctx.fill();
+      ctx.globalAlpha = 1.0;
+    }
+
+    // values
+    ctx.strokeStyle = color;
+    ctx.lineWidth   = 1.5;
+    ctx.setLineDash(dashed ? [4,3] : []);
+    ctx.beginPath();
+    for (var k=0; k<ts.length; k++) {
+      if (k) {
+        ctx.lineTo(x(ts[k]),y(s.data.values[k]));
+      } else {
+        ctx.moveTo(x(ts[k]),y(s.data.values[k]));
+      }
+    }
+    ctx.stroke();
+    ctx.setLineDash([]);
+  };
+
+  function drawChart() {
+    var canvas = $('#chart')[0];
+    var ctx    = canvas.getContext("2d");
+    ctx.clearRect(0,0,canvas.width,canvas.height);
+    ctx.font = "12px sans-serif";
+    if (!chart.data) {
+      return;
+    }
+
+    // frame and time-axis
+    var w = canvas.width-CHART_PAD.left-CHART_PAD.right;
+    var h = canvas.height-CHART_PAD.top-CHART_PAD.bottom;
+    ctx.strokeStyle = "#808080";
+    ctx.lineWidth   = 1;
+    ctx.strokeRect(CHART_PAD.left,CHART_PAD.top,w,h);
+    ctx.fillStyle = "#000000";
+    ctx.textAlign = "center";
+    for (var k=0; k<=4; k++) {
+      var t = chart.data.start + k*(chart.data.end-chart.data.start)/4;
+      ctx.fillText((new Date(1000*t)).toLocaleTimeString(),
+                   CHART_PAD.left+k*w/4,CHART_PAD.top+h+15);
+    }
+
+    // the combined chart shows I on the left and U, P on the right axis
+    var left  = chart.type == 'C' ? ['I'] : [chart.type];
+    var right = chart.type == 'C' ? ['U','P'] : [];
+    var l_series = getSeries(left[0]);
+    var r_series = right.length ? getSeries('U').concat(getSeries('P')) : [];
+    var l_max = getMax(l_series);
+    var r_max = getMax(r_series);
+    drawAxis(ctx,canvas,l_max,CHART_PAD.left-5,"right",
+             CHART_TYPES[left[0]].label);
+    if (right.length) {
+      drawAxis(ctx,canvas,r_max,canvas.width-CHART_PAD.right+5,"left",
+               "U (V), P (W)");
+    }
+    $.each([[l_series,l_max],[r_series,r_max]],function(k,axis) {
+      $.each(axis[0],function(j,s) {
+        var rail  = s.name.indexOf("_") > 0;
+        var color = CHART_TYPES[s.name[0]].color;
+        if (rail && chart.type != 'C') {
+          color = RAIL_COLORS[(j-1) % RAIL_COLORS.length];
+        }
+        drawSeries(ctx,canvas,s,axis[1],color,rail && chart.type == 'C');
+      });
+    });
+
+    // selected range
+    if (chart.drag && chart.drag.x1 != null) {
+      ctx.globalAlpha = 0.2;
+      ctx.fillStyle   = "#000000";
+      ctx.fillRect(Math.min(chart.drag.x0,chart.drag.x1),CHART_PAD.top,
+                   Math.abs(chart.drag.x1-chart.drag.x0),h);
+      ctx.globalAlpha = 1.0;
+    }
   };
+
+  // --- zoom   --------------------------------------------------------------
+
+  function getChartTime(canvas,x) {
+    var w = canvas.width-CHART_PAD.left-CHART_PAD.right;
+    var f = Math.min(Math.max((x-CHART_PAD.left)/w,0),1);
+    return chart.data.start + f*(chart.data.end-chart.data.start);
+  };
+
+  $(document).ready(function() {
+    var canvas = $('#chart');
+    canvas.on('mousedown',function(e) {
+      chart.drag = {x0: e.offsetX, x1: null};
+    });
+    canvas.on('mousemove',function(e) {
+      if (chart.drag) {
+        chart.drag.x1 = e.offsetX;
+        drawChart();
+      }
+    });
+    canvas.on('mouseup',function(e) {
+      var drag   = chart.drag;
+      chart.drag = null;
+      if (!chart.data || !drag || Math.abs(e.offsetX-drag.x0) < 5) {
+        drawChart();
+        return;
+      }
+      var t0 = getChartTime(canvas[0],drag.x0);
+      var t1 = getChartTime(canvas[0],e.offsetX);
+      chart.start = Math.min(t0,t1);
+      chart.end   = Math.max(t0,t1);
+      loadChart();
+    });
+    canvas.on('dblclick',function(e) {
+      if (chart.line) {
+        chart.start = chart.line['ts_start'];
+        chart.end   = chart.line['ts_end'];
+        loadChart();
+      }
+    });
+    $('#chart_mode').on('change',loadChart);
+  });
 </script>
 
 <section class="w3-container">
  <h3>Details</h3>
  <div class="w3-bar w3-black">
   <button id="btnCurrent" class="detail w3-bar-item w3-button"
-          onclick="openTab(this,'#ipng')">Current</button>
+          onclick="openTab(this,'I')">Current</button>
   <button id="btnVoltage" class="detail w3-bar-item w3-button"
-          onclick="openTab(this,'#upng')">Voltage</button>
+          onclick="openTab(this,'U')">Voltage</button>
   <button id="btnPower" class="detail w3-bar-item w3-button"
-          onclick="openTab(this,'#ppng')">Power</button>
-</div> 
+          onclick="openTab(this,'P')">Power</button>
+  <button id="btnCombined" class="detail w3-bar-item w3-button"
+          onclick="openTab(this,'C')">Combined</button>
+  <select id="chart_mode" class="w3-bar-item w3-select w3-right"
+          style="width:auto">
+    <option value="minmax">Min/Max</option>
+    <option value="lttb">LTTB</option>
+  </select>
+</div>
 
 <div id="content_graphics" class="content">
-  <div id="ipng" class="tab" style="display:none">
-    <img id="I_img" />
-  </div>
-
-  <div id="upng" class="tab" style="display:none">
-    <img id="U_img" />
-  </div>
-
-  <div id="ppng" class="tab" style="display:none">
-    <img id="P_img" />
-  </div>
+  <canvas id="chart" width="800" height="400"
+          style="cursor:crosshair"></canvas>
 </div>        <!-- id=content_graphics   -->
 </section>
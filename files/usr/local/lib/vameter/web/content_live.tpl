@@ -2,7 +2,8 @@
 # ----------------------------------------------------------------------------
 # Simple web-interface for the results of vameter.py
 #
-# This file defines the display of live values
+# This file defines the display of live values and of the live waveforms
+# (oscilloscope-style, binary frames from the websocket /wave)
 #
 # Author: Bernhard Bablok
 # License: GPL3
@@ -12,6 +13,149 @@
 # ----------------------------------------------------------------------------
 -->
 
+<script  type="text/javascript">
+  var wave = {socket: null, channels: [], bits: 12, buffers: [],
+              rate: 0, decimation: 1, pending: false};
+  var WAVE_COLORS = {U: "#0000ff", I: "#00c000"};
+  var WAVE_DIVS   = 10;
+
+  // --- connect to /wave   --------------------------------------------------
+
+  function startWave() {
+    if (!window.WebSocket || wave.socket) {
+      return;
+    }
+    var proto = location.protocol == "https:" ? "wss://" : "ws://";
+    wave.socket = new WebSocket(proto + location.host + "/wave?decimation=" +
+                                $('#wave_dec').val());
+    wave.socket.binaryType = "arraybuffer";
+    wave.socket.onmessage  = function(e) {
+      if (typeof e.data == "string") {
+        // channels and resolution, sent before the first frame
+        var meta      = JSON.parse(e.data);
+        wave.channels = meta.channels;
+        wave.bits     = meta.bits;
+        wave.buffers  = $.map(meta.channels,function() { return [[]]; });
+        $('#Wave').show();
+      } else {
+        addFrame(e.data);
+      }
+    };
+    wave.socket.onclose = function() {
+      wave.socket = null;
+      $('#Wave').hide();
+    };
+  };
+
+  function stopWave() {
+    if (wave.socket) {
+      wave.socket.close();
+    }
+  };
+
+  // --- decode a frame   ----------------------------------------------------
+
+  function addFrame(buffer) {
+    // header: magic,bits,channels,decimation,scans,ts,rate (little-endian)
+    var view = new DataView(buffer);
+    var magic = String.fromCharCode(view.getUint8(0),view.getUint8(1),
+                                    view.getUint8(2),view.getUint8(3));
+    var n_chan = view.getUint8(5);
+    if (magic != "VAMW" || n_chan != wave.buffers.length) {
+      return;
+    }
+    var scans = view.getUint32(8,true);
+    var codes = new Uint16Array(buffer,24,n_chan*scans);
+    if (view.getUint16(6,true) != wave.decimation) {
+      // decimation changed (requested or raised by the server)
+      wave.decimation = view.getUint16(6,true);
+      $.each(wave.buffers,function(k,buf) { buf.length = 0; });
+    }
+    wave.rate = view.getFloat32(20,true);
+
+    // keep one sample per pixel
+    var width = $('#wave')[0].width;
+    $.each(wave.buffers,function(k,buf) {
+      for (var n=k*scans; n<(k+1)*scans; n++) {
+        buf.push(codes[n]);
+      }
+      if (buf.length > width) {
+        buf.splice(0,buf.length-width);
+      }
+    });
+    if (!wave.pending) {
+      wave.pending = true;
+      window.requestAnimationFrame(drawWave);
+    }
+  };
+
+  // --- draw waveforms   ----------------------------------------------------
+
+  function drawWave() {
+    wave.pending = false;
+    var canvas = $('#wave')[0];
+    var ctx    = canvas.getContext("2d");
+    var full   = Math.pow(2,wave.bits);
+    ctx.clearRect(0,0,canvas.width,canvas.height);
+
+    // grid
+    ctx.strokeStyle = "#e0e0e0";
+    ctx.lineWidth   = 1;
+    ctx.beginPath();
+    for (var k=1; k<WAVE_DIVS; k++) {
+      ctx.moveTo(k*canvas.width/WAVE_DIVS,0);
+      ctx.lineTo(k*canvas.width/WAVE_DIVS,canvas.height);
+    }
+    for (var k=1; k<4; k++) {
+      ctx.moveTo(0,k*canvas.height/4);
+      ctx.lineTo(canvas.width,k*canvas.height/4);
+    }
+    ctx.stroke();
+
+    // newest sample at the right border, codes scaled to full range
+    $.each(wave.buffers,function(k,buf) {
+      var name = wave.channels[k];
+      var x0   = canvas.width - buf.length;
+      ctx.strokeStyle = WAVE_COLORS[name[0]];
+      ctx.setLineDash(name.indexOf("_") > 0 ? [4,3] : []);
+      ctx.beginPath();
+      for (var n=0; n<buf.length; n++) {
+        var y = canvas.height*(1-buf[n]/full);
+        if (n) {
+          ctx.lineTo(x0+n,y);
+        } else {
+          ctx.moveTo(x0+n,y);
+        }
+      }
+      ctx.stroke();
+    });
+    ctx.setLineDash([]);
+
+    // legend and time-scale
+    ctx.font      = "12px sans-serif";
+    ctx.textAlign = "left";
+    $.each(wave.channels,function(k,name) {
+      ctx.fillStyle = WAVE_COLORS[name[0]];
+      ctx.fillText(name,5+40*k,15);
+    });
+    if (wave.rate) {
+      ctx.fillStyle = "#000000";
+      ctx.textAlign = "right";
+      ctx.fillText((1000*canvas.width/WAVE_DIVS/wave.rate).toFixed(1) +
+                   " ms/div (1:" + wave.decimation + ")",canvas.width-5,15);
+    }
+  };
+
+  $(document).ready(function() {
+    $('#wave_dec').on('change',function() {
+      if (wave.socket && wave.socket.readyState == WebSocket.OPEN) {
+        wave.socket.send(JSON.stringify({decimation:
+                                         parseInt($('#wave_dec').val())}));
+      }
+    });
+  });
+</script>
+
 <div id="Live" style="display:none" class="w3-panel">
   <div class="w3-center w3-cell w3-card-4">
     <table class="w3-table w3-striped w3-border">
@@ -40,4 +184,20 @@
       </tr>
     </table>
   </div>
+  <div id="Wave" style="display:none" class="w3-card-4 w3-margin-top">
+    <div class="w3-bar w3-black">
+      <span class="w3-bar-item">Waveform</span>
+      <select id="wave_dec" class="w3-bar-item w3-select w3-right"
+              style="width:auto">
+        <option value="1">1:1</option>
+        <option value="2">1:2</option>
+        <option value="4" selected>1:4</option>
+        <option value="8">1:8</option>
+        <option value="16">1:16</option>
+        <option value="32">1:32</option>
+        <option value="64">1:64</option>
+      </select>
+    </div>
+    <canvas id="wave" width="800" height="200"></canvas>
+  </div>
 </div>
@@ -29,14 +29,14 @@ setup_SSE=function() {
     var source = new EventSource('/update');
     source.addEventListener('message', function(e) {
       data = JSON.parse(e.data);
-      $("#I_act").text(data.I);
-      $("#U_act").text(data.U);
-      $("#P_act").text(data.P);
-      $("#I_max").text(data.I_max);
-      $("#U_max").text(data.U_max);
-      $("#P_max").text(data.P_max);
+      $("#I_act").text(data.I.toFixed(1));
+      $("#U_act").text(data.U.toFixed(2));
+      $("#P_act").text(data.P.toFixed(2));
+      $("#I_max").text(data.I_max.toFixed(1));
+      $("#U_max").text(data.U_max.toFixed(2));
+      $("#P_max").text(data.P_max.toFixed(2));
       $("#s_tot").text(data.s_tot);
-      $("#P_tot").text(data.P_tot);
+      $("#P_tot").text(data.P_tot.toFixed(2));
      }, false);
   }
 };
@@ -59,6 +59,7 @@ doStart=function() {
       $('#inpStart').val('');
       $('#btnStop').show();
       setup_SSE();
+      startWave();
       $('#Live').show();
     }
   });
@@ -74,6 +75,7 @@ doStop=function() {
   $('#Start').show();
   $('#btnRename').show();
   $('#btnStop').hide();
+  stopWave();
   $('#Live').hide();
   setTimeout(function() { get_results();},3000);
 };
@@ -147,11 +149,41 @@ doDelete=function(name) {
 };
 
 /**
-  Handle action download
+  Handle background jobs of the selected measurement
+*/
+
+doJob=function(kind,args) {
+  if (!current_selection) {
+    return;
+  }
+  $.ajax({
+    type: "POST",
+        data : $.extend({kind: kind, name: current_selection.name},args),
+    cache: false,
+    url: "/jobs",
+    success: function(data){
+      showMsg(data.msg,2000);
+      pollJobs();
+    },
+    error: function(err){
+      showMsg(err.responseJSON ? err.responseJSON.msg : err.statusText,3000);
+    }
+  });
+};
+
+doCancelJob=function(id) {
+  $.post("/jobs/" + id + "/cancel",function(data) {
+    pollJobs();
+  });
+};
+
+/**
+  Handle action download (export in the format selected for export-jobs)
 */
 
 doDownload=function(name) {
-  window.location="/download?name="+name;
+  window.location="/export?name=" + encodeURIComponent(name) +
+                  "&format=" + ($('#job_format').val() || "csv");
 };
 
 /**
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# ----------------------------------------------------------------------------
+# Tests for the online statistics (Accumulator) of vameter.py.
+#
+# Run from the top-level directory: python -m unittest discover tests
+#
+# Author: Bernhard Bablok, Lothar Hiller
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-vameter
+#
+# ----------------------------------------------------------------------------
+
+import os, sys, math, random, unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "..","files","usr","local","bin"))
+import vameter
+
+# --- helpers   --------------------------------------------------------------
+
+def get_values(n,seed=1):
+  """ return n reproducible values (raw codes of an ADC) """
+  rnd = random.Random(seed)
+  return [rnd.randint(0,4095) for _ in range(n)]
+
+def get_batches(values,sizes):
+  """ split values into batches of the given sizes (repeated) """
+  batches = []
+  k = 0
+  while k < len(values):
+    n = sizes[len(batches) % len(sizes)]
+    batches.append(values[k:k+n])
+    k += n
+  return batches
+
+# --- tests   ----------------------------------------------------------------
+
+class AccumulatorTest(unittest.TestCase):
+  """ statistics of add, extend (list and numpy) and the reservoir """
+
+  def assertStats(self,acc,values):
+    """ compare statistics with a direct computation """
+    n    = len(values)
+    mean = float(sum(values))/n
+    var  = sum((x-mean)**2 for x in values)/(n-1)
+    self.assertEqual(acc.count,n)
+    self.assertAlmostEqual(acc.mean,mean,places=6)
+    self.assertAlmostEqual(acc.stdev(),math.sqrt(var),places=6)
+    self.assertEqual(acc.min,min(values))
+    self.assertEqual(acc.max,max(values))
+
+  def test_add(self):
+    """ single values (Welford) """
+    values = get_values(1000)
+    acc = vameter.Accumulator()
+    for x in values:
+      acc.add(x)
+    self.assertStats(acc,values)
+
+  def test_extend(self):
+    """ batches of different sizes (Chan) """
+    values = get_values(1000)
+    acc = vameter.Accumulator()
+    for batch in get_batches(values,[1,50,7,200]):
+      acc.extend(batch)
+    self.assertStats(acc,values)
+
+  def test_add_extend(self):
+    """ single values and batches mixed """
+    values = get_values(500)
+    acc = vameter.Accumulator()
+    for k,batch in enumerate(get_batches(values,[3,40])):
+      if k % 2:
+        acc.extend(batch)
+      else:
+        for x in batch:
+          acc.add(x)
+    self.assertStats(acc,values)
+
+  @unittest.skipUnless(vameter.have_numpy,"numpy not available")
+  def test_extend_numpy(self):
+    """ batches as numpy-arrays """
+    values = get_values(1000)
+    acc = vameter.Accumulator()
+    for batch in get_batches(values,[50,13]):
+      acc.extend(vameter.numpy.array(batch))
+    self.assertStats(acc,values)
+    self.assertIsInstance(acc.min,int)
+
+  def test_extend_empty(self):
+    """ an empty batch does not change the statistics """
+    acc = vameter.Accumulator(8)
+    acc.extend([])
+    self.assertEqual(acc.count,0)
+    self.assertIsNone(acc.min)
+    self.assertEqual(acc.stdev(),0.0)
+
+  def test_reset(self):
+    """ reset removes all values """
+    acc = vameter.Accumulator(8)
+    acc.extend(get_values(100))
+    acc.reset()
+    values = get_values(10,seed=2)
+    acc.extend(values)
+    self.assertStats(acc,values)
+    self.assertEqual(len(acc._res),8)
+
+  def test_reservoir_size(self):
+    """ the reservoir is bounded and only holds values of the stream """
+    random.seed(1)
+    values = get_values(10000)
+    acc = vameter.Accumulator(64)
+    for batch in get_batches(values,[50,1,500]):
+      acc.extend(batch)
+      self.assertLessEqual(len(acc._res),64)
+    self.assertEqual(len(acc._res),64)
+    self.assertTrue(set(acc._res) <= set(values))
+
+  def test_reservoir_small(self):
+    """ a stream smaller than the reservoir is kept completely """
+    values = get_values(20)
+    acc = vameter.Accumulator(64)
+    acc.extend(values[:5])
+    for x in values[5:]:
+      acc.add(x)
+    self.assertEqual(sorted(acc._res),sorted(values))
+    self.assertEqual(acc.median(),sorted(values)[10])
+
+  def test_reservoir_sample(self):
+    """ the reservoir is a sample of the whole stream (not only the start) """
+    random.seed(1)
+    values = range(100000)
+    acc = vameter.Accumulator(256)
+    for batch in get_batches(values,[50]):
+      acc.extend(batch)
+    late = [x for x in acc._res if x >= 50000]
+    self.assertGreater(len(late),256/4)
+    self.assertLess(len(late),3*256/4)
+    self.assertAlmostEqual(acc.median(),50000,delta=10000)
+
+  def test_no_reservoir(self):
+    """ without reservoir, percentiles are the mean """
+    values = get_values(100)
+    acc = vameter.Accumulator()
+    acc.extend(values)
+    self.assertEqual(acc._res,[])
+    self.assertEqual(acc.percentile(90),acc.mean)
+
+if __name__ == '__main__':
+  unittest.main()
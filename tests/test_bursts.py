@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# ----------------------------------------------------------------------------
+# Tests for the size and number of bursts of an acquisition window.
+#
+# Run from the top-level directory: python -m unittest discover tests
+#
+# Author: Bernhard Bablok, Lothar Hiller
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-vameter
+#
+# ----------------------------------------------------------------------------
+
+import os, sys, unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "..","files","usr","local","bin"))
+import vameter
+
+# --- tests   ----------------------------------------------------------------
+
+class BurstTest(unittest.TestCase):
+  """ window-size of burst-mode with and without a sample-rate """
+
+  CHANNELS = [0,1]
+
+  def setUp(self):
+    """ save configuration """
+    self._config = (vameter.SAMPLE_RATE,vameter.BURST_SIZE,
+                    vameter.SPI_SPEED,vameter.INTERVAL)
+    vameter.SPI_SPEED = 50000
+
+  def tearDown(self):
+    """ restore configuration """
+    (vameter.SAMPLE_RATE,vameter.BURST_SIZE,
+     vameter.SPI_SPEED,vameter.INTERVAL) = self._config
+
+  def _window(self,rate,size,interval):
+    """ return (burst,n_bursts) for the given configuration """
+    vameter.SAMPLE_RATE = rate
+    vameter.BURST_SIZE  = size
+    vameter.INTERVAL    = interval
+    burst = vameter.BurstReader(None,self.CHANNELS,
+                                vameter.get_burst_size(len(self.CHANNELS)),
+                                vameter.SPI_SPEED,rate/vameter.WINDOW_FILL,
+                                vameter.Msg("NONE",False))
+    return (burst,vameter.get_burst_count(burst))
+
+  def test_rate(self):
+    """ a sample-rate defines the number of scans of a window """
+    (burst,n_bursts) = self._window(500,50,1)
+    self.assertEqual(burst.count,50)
+    self.assertEqual(n_bursts,10)
+
+  def test_rate_0(self):
+    """ without a sample-rate, the bursts fill the window """
+    (burst,n_bursts) = self._window(0,50,1)
+    self.assertGreater(n_bursts,1)
+    window = n_bursts*burst.count*burst.scan_sec
+    self.assertLessEqual(window,vameter.WINDOW_FILL)
+    self.assertGreater(window,vameter.WINDOW_FILL-burst.count*burst.scan_sec)
+
+  def test_rate_short_interval(self):
+    """ a burst is shortened to fit the window of a short interval """
+    (burst,n_bursts) = self._window(500,50,0.01)
+    self.assertEqual(burst.count,4)
+    self.assertEqual(n_bursts,1)
+
+  def test_rate_0_short_interval(self):
+    """ without a sample-rate, a burst is shortened to fit the window """
+    (burst,n_bursts) = self._window(0,50,0.01)
+    self.assertLess(burst.count,50)
+    self.assertEqual(n_bursts,1)
+    self.assertLessEqual(burst.count*burst.scan_sec,
+                         0.01*vameter.WINDOW_FILL)
+
+if __name__ == '__main__':
+  unittest.main()
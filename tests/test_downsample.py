@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# ----------------------------------------------------------------------------
+# Tests for downsampling of sessions (MinMaxSampler, LTTBSampler of
+# vamdata.py).
+#
+# Run from the top-level directory: python -m unittest discover tests
+#
+# Author: Bernhard Bablok, Lothar Hiller
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-vameter
+#
+# ----------------------------------------------------------------------------
+
+import os, sys, math, unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "..","files","usr","local","bin"))
+import vamdata
+
+NAN = float('nan')
+
+# --- helpers   --------------------------------------------------------------
+
+def get_rows(n,func=lambda t: math.sin(t/7.0)):
+  """ return n rows (ts,[v]) with one row per second """
+  return [(float(t),[func(t)]) for t in range(n)]
+
+def downsample(rows,buckets,mode):
+  """ downsample rows of a single column into the given number of buckets """
+  width = float(rows[-1][0]-rows[0][0]+1)/buckets
+  return vamdata.downsample(rows,1,rows[0][0],width,mode)[0]
+
+# --- tests of minmax   ------------------------------------------------------
+
+class MinMaxTest(unittest.TestCase):
+  """ average, minimum and maximum of every bucket """
+
+  def test_buckets(self):
+    """ one point for every bucket """
+    for n in [100,101,150,1000,1001]:
+      result = downsample(get_rows(n),100,"minmax")
+      for key in ["ts","values","min","max"]:
+        self.assertEqual(len(result[key]),100)
+
+  def test_values(self):
+    """ statistics of a bucket """
+    result = downsample(get_rows(40,lambda t: t % 10),4,"minmax")
+    self.assertEqual(result["ts"],[4.5,14.5,24.5,34.5])
+    self.assertEqual(result["values"],[4.5]*4)
+    self.assertEqual(result["min"],[0]*4)
+    self.assertEqual(result["max"],[9]*4)
+
+  def test_nan(self):
+    """ NaN and missing values are skipped, empty buckets left out """
+    rows = get_rows(40,lambda t: 1.0)
+    for k in range(10,20):
+      rows[k][1][0] = NAN
+    rows[25][1][0] = None
+    result = downsample(rows,4,"minmax")
+    self.assertEqual(result["ts"],
+                     [4.5,round((sum(range(20,30))-25)/9.0,3),34.5])
+    self.assertEqual(result["values"],[1.0]*3)
+
+# --- tests of lttb   --------------------------------------------------------
+
+class LTTBTest(unittest.TestCase):
+  """ largest-triangle-three-buckets """
+
+  def test_buckets(self):
+    """ one point for every bucket, first and last point are kept """
+    for n in [100,101,150,250,1000,1001]:
+      rows   = get_rows(n)
+      result = downsample(rows,100,"lttb")
+      self.assertEqual(len(result["ts"]),100)
+      self.assertEqual(len(result["values"]),100)
+      self.assertEqual(result["ts"][0],rows[0][0])
+      self.assertEqual(result["ts"][-1],rows[-1][0])
+      self.assertEqual(result["ts"],sorted(set(result["ts"])))
+
+  def test_few_points(self):
+    """ less points than buckets are returned unchanged """
+    for n in [1,2,3,50]:
+      rows   = get_rows(n)
+      result = downsample(rows,100,"lttb")
+      self.assertEqual(result["ts"],[ts for ts,_ in rows])
+
+  def test_peak(self):
+    """ a single peak is selected """
+    rows = get_rows(1000,lambda t: 5.0 if t == 437 else 0.0)
+    result = downsample(rows,10,"lttb")
+    self.assertIn(437.0,result["ts"])
+    self.assertEqual(max(result["values"]),5.0)
+
+  def test_nan(self):
+    """ NaN and missing values are never selected """
+    rows = get_rows(100)
+    for k in [0,1,50,98,99]:
+      rows[k][1][0] = NAN
+    rows[60][1][0] = None
+    result = downsample(rows,10,"lttb")
+    self.assertEqual(result["ts"][0],2.0)
+    self.assertEqual(result["ts"][-1],97.0)
+    for ts in [0.0,1.0,50.0,60.0,98.0,99.0]:
+      self.assertNotIn(ts,result["ts"])
+    self.assertFalse([v for v in result["values"] if v != v])
+
+if __name__ == '__main__':
+  unittest.main()
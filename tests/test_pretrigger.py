@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# ----------------------------------------------------------------------------
+# Tests for the pre-trigger buffer (RingBuffer, start_trigger) of vameter.py.
+#
+# Run from the top-level directory: python -m unittest discover tests
+#
+# Author: Bernhard Bablok, Lothar Hiller
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-vameter
+#
+# ----------------------------------------------------------------------------
+
+import os, sys, unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "..","files","usr","local","bin"))
+import vameter
+
+# --- helpers   --------------------------------------------------------------
+
+class Options(object):
+  """ options of a recording (only the attributes used by the tests) """
+  pass
+
+class Running(object):
+  """ records the rows passed to the running summary """
+
+  def __init__(self):
+    self.rows = []
+
+  def add(self,ts_rrd,row):
+    self.rows.append((ts_rrd,row))
+
+def get_row(stamp):
+  """ return a row of the pre-trigger buffer (stamp, U, I, P) """
+  return [stamp,5.0,stamp-90.0,0.5]
+
+# --- tests of the ring-buffer   ---------------------------------------------
+
+class RingBufferTest(unittest.TestCase):
+  """ fill, wrap around and clear the ring-buffer """
+
+  def test_fill(self):
+    """ records are returned oldest first """
+    buf = vameter.RingBuffer(4,2)
+    for k in range(3):
+      buf.append([k,10*k])
+    self.assertEqual(buf.count,3)
+    self.assertEqual([r.tolist() for r in buf.items()],
+                     [[0,0],[1,10],[2,20]])
+
+  def test_wraparound(self):
+    """ a full buffer overwrites the oldest records """
+    buf = vameter.RingBuffer(3,2)
+    for k in range(8):
+      buf.append([k,10*k])
+      self.assertEqual(buf.count,min(k+1,3))
+    self.assertEqual([r.tolist() for r in buf.items()],
+                     [[5,50],[6,60],[7,70]])
+
+  def test_size_0(self):
+    """ a buffer of size 0 keeps nothing """
+    buf = vameter.RingBuffer(0,2)
+    buf.append([1,2])
+    self.assertEqual(buf.count,0)
+    self.assertEqual(list(buf.items()),[])
+    buf.clear()
+    self.assertEqual(list(buf.items()),[])
+
+  def test_clear(self):
+    """ a cleared buffer is empty and can be filled again """
+    buf = vameter.RingBuffer(3,1)
+    for k in range(5):
+      buf.append([k])
+    buf.clear()
+    self.assertEqual(list(buf.items()),[])
+    buf.append([9])
+    self.assertEqual([r.tolist() for r in buf.items()],[[9]])
+
+# --- tests of the trigger   -------------------------------------------------
+
+class TriggerTest(unittest.TestCase):
+  """ pre-trigger rows are written with the first batch of the database """
+
+  def setUp(self):
+    """ save configuration, create options """
+    self._config = (vameter.INTERVAL,vameter.BATCH_SIZE)
+    vameter.INTERVAL   = 1
+    vameter.BATCH_SIZE = 100
+    self.options = Options()
+    self.options.ts_start    = 0
+    self.options.ts_last     = 0
+    self.options.db_batch    = []
+    self.options.store_batch = []
+    self.options.running     = Running()
+    self.options.store       = None
+
+  def tearDown(self):
+    """ restore configuration """
+    (vameter.INTERVAL,vameter.BATCH_SIZE) = self._config
+
+  def _trigger(self,size,stamps,stamp):
+    """ fill the pre-trigger buffer, trigger at stamp and save the record """
+    options = self.options
+    options.pretrigger = vameter.RingBuffer(size,4)
+    for t in stamps:
+      options.pretrigger.append(get_row(t))
+    rec = {'stamp': stamp, 'rails': [{'U': 5.0, 'I': 200.0, 'P': 1.0}]}
+    vameter.start_trigger(options,rec,stamp)
+    rec['ts_rrd'] = max(vameter.to_rrd_time(stamp,options.ts_start,1),
+                        options.ts_last+1)
+    options.ts_last = rec['ts_rrd']
+    vameter.save_data(options,rec)
+    return rec
+
+  def test_first_batch(self):
+    """ the buffered rows precede the first record """
+    self._trigger(10,[100,101,102],103)
+    self.assertEqual(self.options.ts_start,100)
+    self.assertEqual(self.options.pretrigger.count,0)
+    self.assertEqual(self.options.db_batch,
+                     ["100:5.000000:10.000000:0.500000",
+                      "101:5.000000:11.000000:0.500000",
+                      "102:5.000000:12.000000:0.500000",
+                      "103:5.000000:200.000000:1.000000"])
+    self.assertEqual([row[0] for row in self.options.store_batch],
+                     [100,101,102,103])
+    self.assertEqual([ts for ts,_ in self.options.running.rows],
+                     [100,101,102,103])
+
+  def test_wrapped_buffer(self):
+    """ only the last rows of a wrapped buffer are written """
+    self._trigger(2,[100,101,102,103],104)
+    self.assertEqual(self.options.ts_start,102)
+    self.assertEqual([u.split(":")[0] for u in self.options.db_batch],
+                     ["102","103","104"])
+
+  def test_no_buffer(self):
+    """ without a pre-trigger buffer, the record starts the measurement """
+    rec = self._trigger(0,[100,101],103)
+    self.assertEqual(self.options.ts_start,103)
+    self.assertEqual(rec['pre'],[])
+    self.assertEqual(self.options.db_batch,
+                     ["103:5.000000:200.000000:1.000000"])
+
+  def test_increasing(self):
+    """ timestamps of the database increase, even for equal stamps """
+    self._trigger(10,[100.2,100.4,100.6],100.8)
+    ts = [int(u.split(":")[0]) for u in self.options.db_batch]
+    self.assertEqual(ts,[100,101,102,103])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/python
+# ----------------------------------------------------------------------------
+# Tests for the columnar session-store (vamstore.py).
+#
+# Run from the top-level directory: python -m unittest discover tests
+#
+# Author: Bernhard Bablok, Lothar Hiller
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-vameter
+#
+# ----------------------------------------------------------------------------
+
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "..","files","usr","local","bin"))
+import vamstore
+
+COLUMNS = ["U","I","P"]
+
+# --- helpers   --------------------------------------------------------------
+
+def get_rows(first,n,step=0.5):
+  """ return n rows starting with row first (values are exact in float32) """
+  return [(1000.0+step*k,float(k),k/4.0,-float(k))
+                                         for k in range(first,first+n)]
+
+# --- tests   ----------------------------------------------------------------
+
+class StoreTest(unittest.TestCase):
+  """ write, continue and read a store (with and without numpy) """
+
+  use_numpy = vamstore.have_numpy
+
+  def setUp(self):
+    """ create temporary directory """
+    self._have_numpy    = vamstore.have_numpy
+    vamstore.have_numpy = self.use_numpy
+    self.dir  = tempfile.mkdtemp()
+    self.path = vamstore.get_store_path(os.path.join(self.dir,"s.rrd"))
+
+  def tearDown(self):
+    """ remove temporary directory """
+    vamstore.have_numpy = self._have_numpy
+    shutil.rmtree(self.dir)
+
+  def _write(self,chunks,reset=True,columns=COLUMNS):
+    """ write chunks of rows - returns the number of written rows """
+    writer = vamstore.StoreWriter(self.path,columns,0.5,reset)
+    for rows in chunks:
+      writer.append(rows)
+    writer.close()
+    return writer.rows
+
+  def _read_all(self,reader,start=None,end=None,chunk=vamstore.CHUNK_ROWS):
+    """ return all rows of a range as tuples (ts,U,I,P) """
+    return [(ts,)+tuple(values)
+            for ts,values in reader.iter_rows(start,end,chunk=chunk)]
+
+  def test_roundtrip(self):
+    """ rows are read as written """
+    rows = get_rows(0,100)
+    self.assertEqual(self._write([rows[:30],[],rows[30:]]),100)
+    self.assertEqual(os.path.basename(self.path),"s" + vamstore.STORE_EXT)
+    reader = vamstore.StoreReader(self.path)
+    self.assertEqual(reader.rows,100)
+    self.assertEqual(reader.columns,COLUMNS)
+    self.assertEqual(reader.interval,0.5)
+    self.assertEqual(self._read_all(reader),rows)
+    reader.close()
+
+  def test_reopen(self):
+    """ a store with the same columns is continued, otherwise reset """
+    rows = get_rows(0,50)
+    self._write([rows[:20]])
+    self._write([rows[20:]],reset=False)
+    reader = vamstore.StoreReader(self.path)
+    self.assertEqual(self._read_all(reader),rows)
+    reader.close()
+
+    self._write([rows[:20]],reset=True)
+    reader = vamstore.StoreReader(self.path)
+    self.assertEqual(reader.rows,20)
+    reader.close()
+
+    self._write([[(1.0,2.0)]],reset=False,columns=["U"])
+    reader = vamstore.StoreReader(self.path)
+    self.assertEqual((reader.rows,reader.columns),(1,["U"]))
+    reader.close()
+
+  def test_partial_row(self):
+    """ a timestamp without values (e.g. crash) is not a row """
+    self._write([get_rows(0,10)])
+    f = open(os.path.join(self.path,"U" + vamstore.COL_EXT),"ab")
+    f.write("\0"*4)
+    f.close()
+    reader = vamstore.StoreReader(self.path)
+    self.assertEqual(reader.rows,10)
+    reader.close()
+
+  def test_find(self):
+    """ binary search for the first row >= t (left) or > t (right) """
+    self._write([get_rows(0,100)])
+    reader = vamstore.StoreReader(self.path)
+    self.assertEqual(reader.find(0),0)
+    self.assertEqual(reader.find(1000.0),0)
+    self.assertEqual(reader.find(1000.0,'right'),1)
+    self.assertEqual(reader.find(1000.2),1)
+    self.assertEqual(reader.find(1010.0),20)
+    self.assertEqual(reader.find(1010.0,'right'),21)
+    self.assertEqual(reader.find(1049.5),99)
+    self.assertEqual(reader.find(1049.5,'right'),100)
+    self.assertEqual(reader.find(2000),100)
+    reader.close()
+
+  def test_iter_rows_range(self):
+    """ start and end are inclusive, chunks do not change the result """
+    rows = get_rows(0,100)
+    self._write([rows])
+    reader = vamstore.StoreReader(self.path)
+    for chunk in [1,7,10,100,1000]:
+      self.assertEqual(self._read_all(reader,1010.0,1020.0,chunk),
+                       rows[20:41])
+      self.assertEqual(self._read_all(reader,1010.2,1019.9,chunk),
+                       rows[21:40])
+      self.assertEqual(self._read_all(reader,None,1001.0,chunk),rows[:3])
+      self.assertEqual(self._read_all(reader,1048.0,None,chunk),rows[96:])
+    self.assertEqual(self._read_all(reader,1020.0,1010.0),[])
+    self.assertEqual(self._read_all(reader,2000.0,None),[])
+    reader.close()
+
+  def test_read(self):
+    """ read a slice of some columns """
+    rows = get_rows(0,100)
+    self._write([rows])
+    reader = vamstore.StoreReader(self.path)
+    times,values = reader.read(1010.0,1012.0,columns=["I"])
+    self.assertEqual(list(times),[r[0] for r in rows[20:25]])
+    self.assertEqual(values.keys(),["I"])
+    self.assertEqual(list(values["I"]),[r[2] for r in rows[20:25]])
+    times,values = reader.read(3000.0)
+    self.assertEqual(list(times),[])
+    self.assertEqual(sorted(values.keys()),sorted(COLUMNS))
+    reader.close()
+
+  def test_empty(self):
+    """ a new store has no rows """
+    self._write([])
+    reader = vamstore.StoreReader(self.path)
+    self.assertEqual(reader.rows,0)
+    self.assertEqual(reader.find(1000.0),0)
+    self.assertEqual(self._read_all(reader),[])
+    self.assertEqual(list(reader.read()[0]),[])
+    reader.close()
+
+class StoreNoNumpyTest(StoreTest):
+  """ same tests without numpy """
+
+  use_numpy = False
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,185 @@
+#!/usr/bin/python
+# ----------------------------------------------------------------------------
+# Tests for reading sessions from the round-robin-database (vamdata.py).
+#
+# rrdtool is replaced by a fake database with one AVERAGE-archive per step.
+#
+# Run from the top-level directory: python -m unittest discover tests
+#
+# Author: Bernhard Bablok, Lothar Hiller
+# License: GPL3
+#
+# Website: https://github.com/bablokb/pi-vameter
+#
+# ----------------------------------------------------------------------------
+
+import os, sys, unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "..","files","usr","local","bin"))
+import vamdata
+
+LAST_UPDATE = 100000
+ARCHIVES    = [(1,10000),(10,2000),(60,1000)]     # (step,rows)
+
+# --- helpers   --------------------------------------------------------------
+
+class FakeRRD(object):
+  """ database with one AVERAGE- and one MAX-archive per step. Every row
+      holds (ts,step). The database is updated by advance seconds after
+      every fetch (a running measurement), so older rows of an archive
+      drop out and rrdtool falls back to a coarser archive """
+
+  def __init__(self,archives=ARCHIVES,advance=0):
+    self.archives    = archives
+    self.advance     = advance
+    self.last_update = LAST_UPDATE
+    self.fetches     = []
+
+  def info(self,dbfile):
+    """ return info of the database (at creation of the fake) """
+    info = {"step": 1, "last_update": LAST_UPDATE,
+            "ds[U].index": 0, "ds[I].index": 1}
+    for k,(step,rows) in enumerate(self.archives):
+      for n,cf in enumerate(["AVERAGE","MAX"]):
+        info["rra[%d].cf" % (2*k+n)]          = cf
+        info["rra[%d].pdp_per_row" % (2*k+n)] = step
+        info["rra[%d].rows" % (2*k+n)]        = rows
+    return info
+
+  def _start(self,step,rows):
+    """ return the time of the oldest row of an archive """
+    return (self.last_update - self.last_update % step) - step*(rows-1)
+
+  def fetch(self,dbfile,cf,*args):
+    """ return rows of the finest archive with at least the requested
+        resolution which holds data at start """
+    args  = dict(zip(args[0::2],args[1::2]))
+    start = int(args["--start"])
+    end   = int(args["--end"])
+    res   = int(args["--resolution"])
+    candidates = [a for a in self.archives if a[0] >= res]
+    step,rows  = ([a for a in candidates if self._start(*a) <= start] or
+                  candidates[-1:])[0]
+    a_start = self._start(step,rows)
+    t0 = start - start % step
+    t1 = end - end % step + step
+    values = [(float(ts),float(step))
+              if a_start <= ts <= self.last_update else (None,None)
+              for ts in range(t0,t1,step)]
+    self.fetches.append((start,end,res,step,len(values)))
+    self.last_update += self.advance
+    return (t0,t1,step), ["U","I"], values
+
+def get_summary(ts_start,ts_end=LAST_UPDATE):
+  """ return the summary of a session with an interval of one second """
+  return {"ts_start": ts_start, "ts_end": ts_end, "interval": 1}
+
+# --- tests of the archive-selection   ---------------------------------------
+
+class ArchiveTest(unittest.TestCase):
+  """ archives of a database and selection of an archive """
+
+  def setUp(self):
+    """ archives of the fake database """
+    self.archives = vamdata.get_db_archives(FakeRRD().info("s.rrd"))
+
+  def test_archives(self):
+    """ only AVERAGE-archives, finest first """
+    self.assertEqual(self.archives,[(1,90001),(10,80010),(60,40020)])
+
+  def test_select(self):
+    """ finest archive holding data at first, up to the next finer one """
+    select = vamdata.select_archive
+    self.assertEqual(select(self.archives,95000,1),(1,None))
+    self.assertEqual(select(self.archives,90001,1),(1,None))
+    self.assertEqual(select(self.archives,90000,1),(10,90001))
+    self.assertEqual(select(self.archives,80010,1),(10,90001))
+    self.assertEqual(select(self.archives,80009,1),(60,80010))
+    self.assertEqual(select(self.archives,50000,1),(60,80010))
+
+  def test_select_old(self):
+    """ data older than all archives is read from the coarsest one """
+    self.assertEqual(vamdata.select_archive(self.archives,1000,1),
+                     (60,80010))
+
+  def test_select_resolution(self):
+    """ archives finer than the resolution are skipped """
+    select = vamdata.select_archive
+    self.assertEqual(select(self.archives,95000,10),(10,None))
+    self.assertEqual(select(self.archives,50000,10),(60,80010))
+    self.assertEqual(select(self.archives,95000,30),(60,None))
+    self.assertEqual(select(self.archives,95000,120),(60,None))
+
+# --- tests of chunked reads   -----------------------------------------------
+
+class FetchTest(unittest.TestCase):
+  """ read a session spanning several archives and chunks """
+
+  def setUp(self):
+    """ replace rrdtool """
+    self._rrdtool   = vamdata.rrdtool
+    vamdata.rrdtool = self.rrd = FakeRRD()
+
+  def tearDown(self):
+    """ restore rrdtool """
+    vamdata.rrdtool = self._rrdtool
+
+  def _fetch(self,summary,start=None,end=None,resolution=0):
+    """ return the rows of a session as list of (ts,step) """
+    titles,rows = vamdata.fetch_session("/nonexistent/s.rrd",summary,
+                                        start,end,resolution)
+    self.assertEqual(titles,["U","I"])
+    rows = list(rows)
+    for ts,(v_ts,_) in rows:
+      self.assertEqual(ts,v_ts)
+    return [(ts,step) for ts,(_,step) in rows]
+
+  def assertContinuous(self,rows):
+    """ every row starts where the previous one ends """
+    for (ts,step),(ts_next,_) in zip(rows,rows[1:]):
+      self.assertEqual(ts_next,ts+step)
+
+  def test_archives(self):
+    """ every part of the session is read from the finest archive """
+    rows = self._fetch(get_summary(70000))
+    self.assertContinuous(rows)
+    self.assertEqual(rows[0],(69960,60))
+    self.assertEqual(rows[-1],(LAST_UPDATE,1))
+    for ts,step in rows:
+      self.assertEqual(step,1 if ts >= 90001 else 10 if ts >= 80010 else 60)
+    self.assertEqual([f[3] for f in self.rrd.fetches],[60,10,1,1,1])
+
+  def test_chunks(self):
+    """ no fetch returns more than FETCH_ROWS rows """
+    rows = self._fetch(get_summary(90001))
+    self.assertEqual(len(rows),LAST_UPDATE-90001+1)
+    self.assertContinuous(rows)
+    self.assertEqual(len(self.rrd.fetches),3)
+    for fetch in self.rrd.fetches:
+      self.assertLessEqual(fetch[4],vamdata.FETCH_ROWS)
+
+  def test_range(self):
+    """ a time-range within the session """
+    rows = self._fetch(get_summary(70000),85005,95000)
+    self.assertContinuous(rows)
+    self.assertEqual(rows[0],(85000,10))
+    self.assertEqual(rows[-1],(95000,1))
+
+  def test_resolution(self):
+    """ archives finer than the resolution are not read """
+    rows = self._fetch(get_summary(70000),resolution=10)
+    self.assertContinuous(rows)
+    self.assertEqual(set(step for _,step in rows),set([10,60]))
+
+  def test_no_duplicates(self):
+    """ rows of a coarser archive returned by rrdtool are not repeated """
+    vamdata.rrdtool = self.rrd = FakeRRD([(1,10000),(60,1000)],5000)
+    rows = self._fetch(get_summary(91000))
+    ts   = [t for t,_ in rows]
+    self.assertEqual(ts,sorted(set(ts)))
+    self.assertEqual(self.rrd.fetches[1][3],60)
+    self.assertEqual(ts[ts.index(94599)+1],94620)
+
+if __name__ == '__main__':
+  unittest.main()